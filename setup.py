@@ -9,6 +9,7 @@ setup(name='staticgenerator',
       author_email="me@superjared.com",
       url="http://superjared.com/projects/static-generator/",
       packages=['staticgenerator',
+                'staticgenerator.templatetags',
                 'staticgenerator.management',
                 'staticgenerator.management.commands']
 )
@@ -4,12 +4,9 @@
 """Static file generator for Django."""
 import logging
 import os
-import stat
-import tempfile
+import re
 import urlparse
 
-import shutil
-
 from django.utils.functional import Promise
 from django.http import HttpRequest, QueryDict
 from django.db.models.base import ModelBase
@@ -18,78 +15,31 @@ from django.db.models import Model
 from django.db.models.query import QuerySet
 from django.conf import settings as django_settings
 from django.test.client import RequestFactory
+from django.utils.encoding import iri_to_uri
 from django.utils.http import urlquote
 from handlers import DummyHandler
 
-from staticgenerator import settings
+from staticgenerator import (
+    fanout, negative, purge, replication, settings, writer
+)
 from staticgenerator.exceptions import StaticGeneratorException
+from staticgenerator.filters import apply_filters
+from staticgenerator.fragments import get_fragment_path, split_fragments
+from staticgenerator.headers import (
+    META_SUFFIX, compute_etag, format_metadata, get_type_suffix,
+    get_type_suffixes
+)
+from staticgenerator.sharding import shard_path
+from staticgenerator.storage import (
+    TMP_PREFIX, create_directory, get_storage, hardlink, write_file
+)
+from staticgenerator.variants import get_variant_request_meta
 
 
 logger = logging.getLogger('staticgenerator')
 
-
-def create_directory(directory):
-    """Creates the given directory and missing intermediate directories
-
-    Does nothing if the directory already exists.
-
-    """
-    if os.path.exists(directory):
-        return
-    try:
-        os.makedirs(directory)
-    except OSError as exc:
-        if exc.errno == 17:  # OSError 17 = 'File exists'
-            return
-    except Exception as exc:
-        raise StaticGeneratorException('Could not create directory',
-                                       directory=directory)
-
-
-def hardlink(src, dst, remove_dst=False, ignore_src=False, ignore_dst=False):
-    """Hard links the ``src`` file to the ``dst`` file path.
-
-    Arguments:
-    * ``src``: the source file
-    * ``dst``: the destination hard link path
-    * ``remove_dst``: if a true value, first attempts to remove the destination
-      file if it exists
-    * ``ignore_src``: if a true value, ignores missing source file silently
-    * ``ignore_dst``: if a true value, ignores existing destination file
-      silently
-
-    """
-    create_directory(os.path.dirname(dst))
-    if remove_dst:
-        try:
-            os.remove(dst)
-        except OSError as exc:
-            if exc.errno != 2:  # 2 = existing destination file not found
-                raise StaticGeneratorException('Could not delete file',
-                                               dst=dst)
-    try:
-        os.link(src, dst)
-        logger.debug('Linked %s to %s', src, dst)
-    except OSError as exc:
-        if exc.errno == 2 and ignore_src:
-            logger.debug('Source file not found, ignoring',
-                         exc_info=True,
-                         extra={'src': src})
-            return
-        if exc.errno == 17 and ignore_dst:
-            logger.debug('Destination file already exists, ignoring',
-                         exc_info=True,
-                         extra={'dst': dst})
-            return
-        logger.debug('Cannot link file',
-                     exc_info=True,
-                     extra={'src': src, 'dst': dst})
-        raise StaticGeneratorException('Could not link file', src=src, dst=dst)
-    except Exception as exc:
-        logger.debug('Cannot link file',
-                     exc_info=True,
-                     extra={'src': src, 'dst': dst})
-        raise StaticGeneratorException('Could not link file', src=src, dst=dst)
+# The cache variant suffix at the start of a file name suffix
+variant_re = re.compile(r',[^.]+')
 
 
 class StaticGenerator(object):
@@ -122,7 +72,8 @@ class StaticGenerator(object):
         self.resources = self.extract_resources(resources)
         self.server_name = self.get_server_name()
         self.web_root = settings.ROOT
-        
+        self.storage = get_storage()
+
     def extract_resources(self, resources):
         """Takes a list of resources, and gets paths by type"""
         extracted = []
@@ -171,17 +122,23 @@ class StaticGenerator(object):
             print '*** Warning ***: Using "localhost" for domain name. Use django.contrib.sites or set settings.SERVER_NAME to disable this warning.'
             return 'localhost'
 
-    def get_content_from_path(self, path):
+    def get_content_from_path(self, path, headers=None, variant=''):
         """
         Imitates a basic http request using DummyHandler to retrieve
         resulting output (HTML, XML, whatever)
+
+        The ``content_type`` and ``cache_control`` of the response are stored
+        in the ``headers`` dictionary if given.  The request gets the
+        headers of the cache ``variant``, see ``staticgenerator.variants``.
         """
         # Create the request
         request = RequestFactory(
             SERVER_PORT=80,
             SERVER_NAME=self.server_name,
             REMOTE_ADDR='127.0.0.1',
-        ).get(path)
+        ).get(path, **get_variant_request_meta(variant))
+        # Tells the middleware not to strip fragment markers from the content
+        request._static_generator_internal = True
         
         # We must parse the path to grab query string
         parsed = urlparse.urlparse(path)
@@ -197,6 +154,11 @@ class StaticGenerator(object):
         if int(response.status_code) != 200:
             raise StaticGeneratorException("The requested page(\"%s\") returned http code %d. Static Generation failed." % (path, int(response.status_code)))
 
+        if headers is not None:
+            for key, name in (('content_type', 'Content-Type'),
+                              ('cache_control', 'Cache-Control')):
+                value = response.get(name)
+                headers[key] = value if isinstance(value, basestring) else None
         return response.content
 
     def get_query_string_from_path(self, path):
@@ -207,10 +169,14 @@ class StaticGenerator(object):
             raise StaticGeneratorException('Path %s has multiple query string values' % path)
         return parts[0], parts[1]
 
-    def get_filename_from_path(self, path, query_string, is_ajax=False):
+    def get_filename_from_path(self, path, query_string, is_ajax=False,
+                               variant=''):
         """
         Returns (filename, directory). None if unable to cache this request.
         Creates index.html for path if necessary
+
+        ``variant`` is the cache variant suffix of the request, see
+        ``staticgenerator.variants``.
         """
         if path.endswith('/'):
             # Always include a %3F in the file name, even if there are no query
@@ -227,67 +193,97 @@ class StaticGenerator(object):
             # This makes it possible to cache responses which have different
             # content for AJAX requests.
             path += ',ajax'
+        if variant:
+            path += variant
 
         filename = (os.path.join(self.web_root, path.lstrip('/'))
                     .encode('utf-8'))
         if len(filename) > 255:
             return None
+        if '/' + TMP_PREFIX in '/' + path:
+            return None  # would look like a temporary file
         return filename
 
-    def _get_publish_data(self, path, query_string, is_ajax):
+    def _get_publish_data(self, path, query_string, is_ajax, variant=''):
         # The query_string parameter is only passed from the
         # middleware. If we're generating a page from, e.g.,
         # the `quick_publish` function, the path may still
         # have a query string component.
         if query_string is None:
             path, query_string = self.get_query_string_from_path(path)
+        path = shard_path(path)
         fresh_filename = self.get_filename_from_path(
-            u'fresh{0}'.format(path), query_string, is_ajax=is_ajax)
+            u'fresh{0}'.format(path), query_string, is_ajax=is_ajax,
+            variant=variant)
         stale_filename = self.get_filename_from_path(
-            u'stale{0}'.format(path), query_string, is_ajax=is_ajax)
+            u'stale{0}'.format(path), query_string, is_ajax=is_ajax,
+            variant=variant)
         return fresh_filename, stale_filename
 
-    def _publish_stale_file(self, fresh_filename, stale_filename):
-        if os.path.isfile(fresh_filename):
-            # We already have a fresh version of the resource. Don't
-            # overwrite.
-            logger.debug('StaticGenerator._publish_stale_file: '
-                         '%s already exists', fresh_filename)
-            return
+    def _publish_stale_files(self, fresh_filename, stale_filename):
+        """Publishes the stale file and its sidecar in each content type
 
-        # We don't have a fresh version of the resource.  Either it
-        # has never been rendered or it has been invalidated.  Copy a
-        # stale version for the duration of the request.
-        hardlink(stale_filename, fresh_filename,
-                 ignore_src=True, ignore_dst=True)
+        If we don't have a fresh version of the resource, either it has
+        never been rendered or it has been invalidated.  Copy a stale
+        version for the duration of the request.
 
-    def publish_stale_path(self, path, query_string=None, is_ajax=False):
+        """
+        if self.storage.exists(stale_filename):
+            self.storage.link_stale(stale_filename, fresh_filename)
+            # Pages with fragments have a sidecar even without
+            # STATIC_GENERATOR_HEADER_SIDECARS
+            suffixes = [META_SUFFIX]
+        else:
+            # Pages of other content types have no HTML file, find them
+            # with one listing instead of probing each type
+            directory, basename = os.path.split(stale_filename)
+            type_suffixes = set(type_suffix + extra
+                                for type_suffix in get_type_suffixes()
+                                for extra in ('', META_SUFFIX))
+            suffixes = [name[len(basename):]
+                        for name in self.storage.listdir(directory)
+                        if name.startswith(basename)
+                        and name[len(basename):] in type_suffixes]
+        for suffix in suffixes:
+            self.storage.link_stale(stale_filename + suffix,
+                                    fresh_filename + suffix)
+
+    def publish_stale_path(self, path, query_string=None, is_ajax=False,
+                           variant=''):
         """Publishes a stale page in the given path if it exists
 
         This is called from the request middleware
 
         """
         fresh_filename, stale_filename = self._get_publish_data(
-            path, query_string, is_ajax)
+            path, query_string, is_ajax, variant)
         if fresh_filename:  # too long URLs not cached
-            self._publish_stale_file(fresh_filename, stale_filename)
+            self._publish_stale_files(fresh_filename, stale_filename)
 
     def publish_from_path(self,
                           path,
                           query_string=None,
                           content=None,
-                          is_ajax=False):
+                          is_ajax=False,
+                          variant='',
+                          content_type=None,
+                          cache_control=None):
         """
         Gets filename and content for a path, attempts to create directory if
         necessary, writes to file.  Also hard links the fresh version to a
         stale version in a separate tree.  Serves stale version if available
         while generating content.
+
+        The file name gets the suffix of ``content_type``, see
+        ``staticgenerator.headers``.  Content of other types than HTML is
+        only cached if the type is in ``STATIC_GENERATOR_CONTENT_TYPES``.
         """
         content_path = path
 
         fresh_filename, stale_filename = self._get_publish_data(path,
                                                                   query_string,
-                                                                  is_ajax)
+                                                                  is_ajax,
+                                                                  variant)
 
         if not fresh_filename:
             return  # cannot cache
@@ -296,66 +292,204 @@ class StaticGenerator(object):
             # The content needs to be fetched with a simulated request to a
             # real view.  Publish a stale version for the duration of the
             # request if available.
-            self._publish_stale_file(fresh_filename, stale_filename)
+            self._publish_stale_files(fresh_filename, stale_filename)
             # Now make the request for the content.  This might take time.
-            content = self.get_content_from_path(content_path)
+            headers = {}
+            content = self.get_content_from_path(content_path, headers,
+                                                 variant)
+            content_type = headers.get('content_type')
+            cache_control = headers.get('cache_control')
+
+        suffix = get_type_suffix(content_type)
+        if suffix is None:
+            logger.debug('Content type %s of %s not cached',
+                         content_type, path)
+            return
 
-        # Write the content into the fresh version of the cached file.
-        fresh_directory = os.path.dirname(fresh_filename)
-        create_directory(fresh_directory)
-        try:
-            f, tmpname = tempfile.mkstemp(dir=fresh_directory)
-            os.write(f, content)
-            os.close(f)
-        except Exception as exc:
-            raise StaticGeneratorException(
-                'Could not write temporary fresh file',
-                fresh_directory=fresh_directory)
-        try:
-            os.chmod(tmpname,
-                     stat.S_IREAD |
-                     stat.S_IWRITE |
-                     stat.S_IWUSR |
-                     stat.S_IRUSR |
-                     stat.S_IRGRP |
-                     stat.S_IROTH)
-            os.rename(tmpname, fresh_filename)
-        except Exception:
-            logger.warning(
-                'Could not chmod or rename fresh file. '
-                'Temporary file probably removed by invalidation.',
-                exc_info=True,
-                extra={'fresh_filename': fresh_filename})
-        else:
-            # The fresh version of the cached file is now on the disk.  Now
-            # create a hard link to it in the stale cache directory.
-            hardlink(fresh_filename, stale_filename,
-                     remove_dst=True, ignore_dst=True)
+        self._publish_fragments(
+            (fresh_filename + suffix, stale_filename + suffix), content,
+            is_ajax, variant,
+            {'content_type': content_type, 'cache_control': cache_control})
+
+        if settings.CACHE_NOT_FOUND or settings.CACHE_REDIRECTS:
+            # The resource exists now
+            self.delete_negative_from_path(path, query_string)
+
+    def _publish_fragments(self, filenames, content, is_ajax, variant,
+                           headers=None):
+        """Publishes content and each fragment in it as a separate file
+
+        Shared regions marked as fragments are replaced with SSI directives
+        in the published content.
+
+        """
+        content, fragments = split_fragments(content)
+        for name, fragment_content in fragments:
+            self._publish_fragments(
+                self._get_publish_data(get_fragment_path(name), '', is_ajax,
+                                       variant),
+                fragment_content, is_ajax, variant)
+        content_type = headers and headers['content_type']
+        if fragments and headers is not None:
+            headers = dict(headers, includes=True)
+        self._publish_content(filenames,
+                              apply_filters(content, content_type), headers)
+
+    def _publish_content(self, filenames, content, headers=None):
+        """Atomically writes the fresh file and the stale copy of it
+
+        No stale file is linked if its name is ``None``.  With
+        ``STATIC_GENERATOR_HEADER_SIDECARS``, or if ``headers`` has
+        ``includes`` set, the ``headers`` are written into a sidecar file
+        first.
+
+        """
+        fresh_filename, stale_filename = filenames
+        if not fresh_filename:
+            return  # cannot cache
+
+        if headers is not None and (settings.HEADER_SIDECARS or
+                                    headers.get('includes')):
+            self._publish_content(
+                (fresh_filename + META_SUFFIX,
+                 stale_filename and stale_filename + META_SUFFIX),
+                format_metadata(headers['content_type'],
+                                headers['cache_control'],
+                                compute_etag(content),
+                                headers.get('includes', False)))
+
+        if not self.storage.write(fresh_filename, content, stale_filename):
+            return
+
+        replication.replicate(self.web_root, fresh_filename, stale_filename,
+                              content)
+
+    def _get_negative_filename(self, tree, path, query_string, variant=''):
+        if query_string is None:
+            path, query_string = self.get_query_string_from_path(path)
+        return self.get_filename_from_path(u'{0}{1}'.format(tree, path),
+                                           query_string, variant=variant)
+
+    def publish_not_found_from_path(self,
+                                    path,
+                                    query_string=None,
+                                    content='',
+                                    variant='',
+                                    content_type=None):
+        """Caches the body of a 404 response in the ``negative`` tree
+
+        The output filters of ``content_type`` are applied like for
+        published pages.
+
+        """
+        filename = self._get_negative_filename('negative', path,
+                                               query_string, variant)
+        if not filename:
+            return  # cannot cache
+        self._publish_content((filename, None),
+                              apply_filters(content, content_type))
+        negative.entry_published()
+
+    def publish_redirect_from_path(self, path, query_string, status,
+                                   location, request_uri=None):
+        """Caches a redirect in the ``redirects`` tree
+
+        ``request_uri`` is the raw URI nginx matches the redirect with, see
+        ``negative.get_request_uri``.  By default it's the encoded path and
+        query string.  Run the ``staticgenerator_negative`` management
+        command to collect the redirects into nginx map files.
+
+        """
+        filename = self._get_negative_filename('redirects', path,
+                                               query_string)
+        if not filename:
+            return  # cannot cache
+        if request_uri is None:
+            if query_string is not None:
+                path = u'?'.join((path, query_string)).rstrip('?')
+            request_uri = iri_to_uri(path)
+        self._publish_content(
+            (filename, None),
+            negative.format_redirect(status, request_uri, location))
+        negative.entry_published()
+
+    def delete_negative_from_path(self, path, query_string=None):
+        """Deletes cached 404 responses and redirects for the path"""
+        for tree in ('negative', 'redirects'):
+            filename = self._get_negative_filename(tree, path, query_string)
+            if not filename:
+                continue
+            self.storage.delete(
+                [filename] + self._get_variant_filenames(filename))
 
     def recursive_delete_from_path(self, path):
+        writer.discard_writes(path, recursive=True)
         filename = self.get_filename_from_path(
-            u'fresh{0}'.format(path), '')
-        shutil.rmtree(os.path.dirname(filename), True)
+            u'fresh{0}'.format(shard_path(path)), '')
+        if filename:  # too long URLs are not cached
+            self.storage.delete_prefix(os.path.dirname(filename))
+
+    def delete_from_path(self, path, is_ajax=False, variant=''):
+        """Deletes file, attempts to delete directory
+
+        Cached variants of the file are deleted too.
 
-    def delete_from_path(self, path, is_ajax=False):
-        """Deletes file, attempts to delete directory"""
+        """
         path, query_string = self.get_query_string_from_path(path)
+        writer.discard_writes(path, query_string)
         filename = self.get_filename_from_path(
-            u'fresh{0}'.format(path), query_string, is_ajax=is_ajax)
+            u'fresh{0}'.format(shard_path(path)), query_string,
+            is_ajax=is_ajax, variant=variant)
 
-        try:
-            if os.path.exists(filename):
-                os.remove(filename)
-        except:
-            raise StaticGeneratorException('Could not delete file',
-                                           filename=filename)
+        if filename:  # too long URLs are not cached
+            self.storage.delete([filename] +
+                                self._get_variant_filenames(filename))
 
-        try:
-            os.rmdir(os.path.dirname(filename))
-        except OSError:
-            # Will fail if a directory is not empty, in which case we don't
-            # want to delete it anyway
-            pass
+        if settings.CACHE_NOT_FOUND or settings.CACHE_REDIRECTS:
+            self.delete_negative_from_path(path, query_string)
+
+    def get_cached_variants_from_path(self, path):
+        """Returns the variant suffixes other than the default one cached
+        for the path
+
+        The stale tree is listed, so variants of invalidated pages are
+        found too.
+
+        """
+        fresh_filename, stale_filename = self._get_publish_data(
+            path, None, False)
+        if not stale_filename:
+            return []
+        start = len(os.path.basename(stale_filename))
+        variants = set()
+        for filename in self._get_variant_filenames(stale_filename):
+            variant = variant_re.match(os.path.basename(filename), start)
+            if variant:
+                variants.add(variant.group())
+        return sorted(variants)
+
+    def publish_variants_from_path(self, path):
+        """Publishes the default variant and each cached variant of the
+        path"""
+        self.publish_from_path(path)
+        for variant in self.get_cached_variants_from_path(path):
+            self.publish_from_path(path, variant=variant)
+
+    def _get_variant_filenames(self, filename):
+        """Returns existing cached variants of the given file
+
+        These are the files of other cache variants and content types, and
+        the sidecar files.
+
+        """
+        directory, basename = os.path.split(filename)
+        suffix_re = re.compile(r'(,[^.]*)?(%s)?(%s)?$' % (
+            '|'.join(re.escape(suffix) for suffix in get_type_suffixes()),
+            re.escape(META_SUFFIX)))
+        return [os.path.join(directory, name)
+                for name in self.storage.listdir(directory)
+                if name.startswith(basename) and name != basename
+                and suffix_re.match(name, len(basename))]
 
     def do_all(self, func):
         return [func(path) for path in self.resources]
@@ -367,16 +501,28 @@ class StaticGenerator(object):
         return self.do_all(self.recursive_delete_from_path)
 
     def publish(self):
-        return self.do_all(self.publish_from_path)
+        return self.do_all(self.publish_variants_from_path)
 
 def quick_publish(*resources):
-    return StaticGenerator(*resources).publish()
+    generator = StaticGenerator(*resources)
+    result = generator.publish()
+    fanout.broadcast('publish', generator.resources)
+    return result
 
 def quick_delete(*resources):
-    return StaticGenerator(*resources).delete()
+    generator = StaticGenerator(*resources)
+    result = generator.delete()
+    fanout.broadcast('delete', generator.resources)
+    purge.purge(purge.get_delete_keys(resources, generator.resources))
+    return result
 
 def recursive_delete(*resources):
-    return StaticGenerator(*resources).recursive_delete()
+    generator = StaticGenerator(*resources)
+    result = generator.recursive_delete()
+    fanout.broadcast('recursive_delete', generator.resources)
+    purge.purge(purge.get_delete_keys(resources, generator.resources,
+                                      recursive=True))
+    return result
 
 def bypass_request(response, n=1):
     """
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""Content-addressed blob store
+
+With ``STATIC_GENERATOR_DEDUPE`` the content of each published file is
+stored once in the ``blobs`` tree under its SHA-1 digest, and the fresh and
+stale files are hard links to the blob.  Byte-identical pages (e.g. AJAX and
+non-AJAX variants of views which ignore the difference) then share one inode
+on the disk and in the page cache.
+
+Blobs whose only remaining link is the one in the blob store are removed by
+:func:`gc_blobs`, run with the ``staticgenerator_gc_blobs`` management
+command.
+
+"""
+import hashlib
+import logging
+import os
+import time
+
+from staticgenerator import settings
+
+
+logger = logging.getLogger('staticgenerator.blobs')
+
+
+def get_blob_filename(root, content):
+    """Returns the blob file name of the given content"""
+    digest = hashlib.sha1(content).hexdigest()
+    return os.path.join(root, 'blobs', digest[:2], digest[2:])
+
+
+def gc_blobs(root=None, grace=60, now=None):
+    """Removes blobs which aren't linked from any cached file
+
+    Blobs modified within the last ``grace`` seconds are kept, since they may
+    be just about to be linked.  Returns a ``(blobs, bytes)`` tuple of what
+    was removed.
+
+    """
+    root = root or settings.ROOT
+    now = time.time() if now is None else now
+    removed = reclaimed = 0
+    for dirpath, dirnames, filenames in os.walk(os.path.join(root, 'blobs')):
+        for name in filenames:
+            filename = os.path.join(dirpath, name)
+            try:
+                st = os.stat(filename)
+                if st.st_nlink > 1 or now - st.st_mtime < grace:
+                    continue
+                os.remove(filename)
+            except OSError:
+                continue  # removed concurrently
+            removed += 1
+            reclaimed += st.st_size
+    logger.debug('Removed %d unreferenced blobs (%d bytes)',
+                 removed, reclaimed)
+    return removed, reclaimed
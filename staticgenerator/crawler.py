@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""Link-following cache warm-up crawler
+
+Renders pages in-process through :class:`staticgenerator.StaticGenerator`
+(and thus ``DummyHandler``), extracts same-site links from the rendered HTML
+and publishes every page which matches ``STATIC_GENERATOR_URLS`` but not
+``STATIC_GENERATOR_EXCLUDE_URLS``.  No HTTP round-trips are made.  The
+cache variants already cached for a page are rendered again too.
+
+Usage::
+
+    from staticgenerator.crawler import Crawler
+    Crawler(['/'], max_depth=3, concurrency=4).crawl()
+
+"""
+import hashlib
+import logging
+import math
+import re
+import threading
+import urlparse
+from HTMLParser import HTMLParser, HTMLParseError
+from multiprocessing.pool import ThreadPool
+
+from django.db import connections
+
+from staticgenerator import StaticGenerator, settings
+from staticgenerator.exceptions import StaticGeneratorException
+
+
+logger = logging.getLogger('staticgenerator.crawler')
+
+
+class LinkExtractor(HTMLParser):
+    """Streaming parser which collects ``href`` values of ``<a>`` tags
+
+    Feed the HTML in chunks with :meth:`feed` and read the links found so far
+    from :attr:`links`.
+
+    """
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'a':
+            return
+        for name, value in attrs:
+            if name == 'href' and value:
+                self.links.append(value)
+
+
+class BoundedVisitedSet(object):
+    """Bloom filter used as the crawler's visited set
+
+    Memory use is fixed by ``capacity`` and ``error_rate`` regardless of the
+    number of URLs added.  False positives mean that a small fraction of
+    pages may be skipped; there are no false negatives, so no page is ever
+    rendered twice.
+
+    """
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        bits = int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.num_bits = max(bits, 8)
+        self.num_hashes = max(int(round(
+            self.num_bits / float(capacity) * math.log(2))), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.lock = threading.Lock()
+
+    def _positions(self, item):
+        digest = hashlib.sha1(item).hexdigest()
+        first, second = int(digest[:20], 16), int(digest[20:], 16)
+        return [(first + i * second) % self.num_bits
+                for i in range(self.num_hashes)]
+
+    def add(self, item):
+        """Adds ``item`` and returns ``True`` if it wasn't seen before"""
+        if isinstance(item, unicode):
+            item = item.encode('utf-8')
+        positions = self._positions(item)
+        with self.lock:
+            if all(self.bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in positions):
+                return False
+            for pos in positions:
+                self.bits[pos >> 3] |= 1 << (pos & 7)
+            return True
+
+    def __contains__(self, item):
+        if isinstance(item, unicode):
+            item = item.encode('utf-8')
+        return all(self.bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(item))
+
+
+class Crawler(object):
+    """Breadth-first warm-up crawler
+
+    Arguments:
+    * ``seeds``: URL paths to start from; they are always rendered
+    * ``max_depth``: how many links away from the seeds to follow
+    * ``concurrency``: how many pages to render in parallel
+    * ``max_visited``: expected number of URLs, sizes the visited set
+    * ``chunk_size``: size of the chunks fed to the link extractor
+
+    """
+    def __init__(self, seeds, max_depth=3, concurrency=1,
+                 max_visited=1000000, chunk_size=65536):
+        self.seeds = list(seeds)
+        self.max_depth = max_depth
+        self.concurrency = max(int(concurrency), 1)
+        self.chunk_size = chunk_size
+        self.visited = BoundedVisitedSet(capacity=max_visited)
+        self.gen = StaticGenerator()
+        self.urls = tuple([re.compile(url) for url in settings.URLS])
+        self.excluded_urls = tuple([re.compile(url)
+                                    for url in settings.EXCLUDE_URLS])
+        self.published = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def is_cacheable(self, path):
+        """Returns ``True`` if the middleware would cache ``path``"""
+        for url in self.excluded_urls:
+            if url.match(path):
+                return False
+        for url in self.urls:
+            if url.match(path):
+                return True
+        return False
+
+    def normalize_link(self, base, link):
+        """Returns the local path of ``link`` or ``None`` if off-site"""
+        url = urlparse.urljoin(base, link.strip())
+        parsed = urlparse.urlparse(url)
+        if parsed.scheme not in ('', 'http', 'https'):
+            return None
+        if parsed.netloc and parsed.netloc.split(':')[0] != \
+                self.gen.server_name:
+            return None
+        path = parsed.path or '/'
+        if parsed.query:
+            path = '%s?%s' % (path, parsed.query)
+        return path
+
+    def extract_links(self, base, content):
+        """Parses ``content`` in chunks and returns same-site link paths"""
+        parser = LinkExtractor()
+        try:
+            for start in xrange(0, len(content), self.chunk_size):
+                parser.feed(content[start:start + self.chunk_size])
+            parser.close()
+        except HTMLParseError:
+            logger.debug('Crawler: could not fully parse %s', base,
+                         exc_info=True)
+        links = []
+        for link in parser.links:
+            path = self.normalize_link(base, link)
+            if path is not None:
+                links.append(path)
+        return links
+
+    def visit(self, path):
+        """Renders and publishes ``path``, returns the links it contains"""
+        try:
+            headers = {}
+            content = self.gen.get_content_from_path(path, headers)
+            if self.is_cacheable(urlparse.urlparse(path).path):
+                self.gen.publish_from_path(path, content=content, **headers)
+                for variant in self.gen.get_cached_variants_from_path(path):
+                    self.gen.publish_from_path(path, variant=variant)
+                with self.lock:
+                    self.published += 1
+        except StaticGeneratorException:
+            logger.warning('Crawler: failed to render %s', path,
+                           exc_info=True)
+            with self.lock:
+                self.failed += 1
+            return []
+        finally:
+            if self.concurrency > 1:
+                for connection in connections.all():
+                    connection.close()
+        return self.extract_links(path, content)
+
+    def crawl(self):
+        """Crawls breadth-first from the seeds, returns number of pages
+        published"""
+        level = [seed for seed in self.seeds if self.visited.add(seed)]
+        pool = ThreadPool(self.concurrency) if self.concurrency > 1 else None
+        try:
+            for depth in range(self.max_depth + 1):
+                if not level:
+                    break
+                logger.info('Crawler: depth %d, %d pages', depth, len(level))
+                if pool:
+                    results = pool.imap(self.visit, level)
+                else:
+                    results = (self.visit(path) for path in level)
+                next_level = []
+                for links in results:
+                    if depth == self.max_depth:
+                        continue
+                    for link in links:
+                        if (self.is_cacheable(urlparse.urlparse(link).path)
+                                and self.visited.add(link)):
+                            next_level.append(link)
+                level = next_level
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        return self.published
+
+
+def warm_cache(*seeds, **kwargs):
+    return Crawler(seeds, **kwargs).crawl()
@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""Cross-node invalidation fan-out
+
+In deployments where each app server has its own ``STATIC_GENERATOR_ROOT``,
+invalidations have to reach every node.  When
+``STATIC_GENERATOR_INVALIDATION_TRANSPORT`` is set, :func:`quick_delete`,
+:func:`recursive_delete` and :func:`quick_publish` broadcast their paths to
+the peers after applying them locally.  Each peer runs the
+``staticgenerator_listen`` management command, which applies the events
+through its local :class:`StaticGenerator`.
+
+Events of one call are sent as one message.  Use :func:`batch` to collect
+the events of several calls into one message::
+
+    from staticgenerator import fanout, quick_delete
+
+    with fanout.batch():
+        quick_delete(post)
+        quick_delete('/')
+
+Messages carry the sending process' node name and a sequence number, so
+listeners can detect dropped messages.  On a gap the listener logs a warning
+and, with ``STATIC_GENERATOR_INVALIDATION_ON_GAP = 'flush'``, invalidates
+its whole cache.
+
+Two transports are built in: :class:`UDPTransport` for unicast or multicast
+UDP and :class:`SpoolTransport` for a spool directory shared by the nodes,
+e.g. on NFS.  Other transports subclass :class:`Transport` and implement:
+
+* ``send(payload)`` sending a message to all peers
+* ``receive(timeout=None)`` returning a list of the messages received
+  within ``timeout`` seconds
+
+"""
+from contextlib import contextmanager
+import errno
+import json
+import logging
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+from django.utils.importlib import import_module
+
+from staticgenerator import settings
+from staticgenerator.exceptions import StaticGeneratorException
+from staticgenerator.utils import parse_address
+
+
+logger = logging.getLogger('staticgenerator.fanout')
+
+ACTIONS = ('delete', 'recursive_delete', 'publish')
+
+
+class Transport(object):
+    """Base class of invalidation transports
+
+    Subclasses implement ``send`` and ``receive``, see the module
+    docstring.  The base class provides the optional parts.
+
+    """
+
+    # Maximum size of one message in bytes, or None for no limit
+    max_size = None
+
+    def acknowledge(self):
+        """Marks the messages received so far as applied"""
+        pass
+
+    def close(self):
+        pass
+
+
+class UDPTransport(Transport):
+    """Sends messages as UDP datagrams
+
+    Arguments:
+    * ``peers``: ``host:port`` addresses to send to, for unicast
+    * ``group``: ``address:port`` of a multicast group to send to and
+      receive from
+    * ``bind``: ``host:port`` address to receive unicast messages at
+    * ``ttl``: multicast time-to-live
+
+    """
+    max_size = 60000
+
+    def __init__(self, peers=(), group=None, bind=None, ttl=1):
+        self.peers = [parse_address(peer) for peer in peers]
+        self.group = parse_address(group) if group else None
+        self.bind = parse_address(bind) if bind else None
+        self.ttl = ttl
+        self.send_socket = None
+        self.receive_socket = None
+
+    def _get_send_socket(self):
+        if self.send_socket is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if self.group:
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL,
+                                self.ttl)
+            self.send_socket = sock
+        return self.send_socket
+
+    def _get_receive_socket(self):
+        if self.receive_socket is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.group:
+                sock.bind(('', self.group[1]))
+                membership = struct.pack('4sl',
+                                         socket.inet_aton(self.group[0]),
+                                         socket.INADDR_ANY)
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                membership)
+            elif self.bind:
+                sock.bind(self.bind)
+            else:
+                raise StaticGeneratorException(
+                    'UDPTransport needs a group or bind address to receive')
+            self.receive_socket = sock
+        return self.receive_socket
+
+    def send(self, payload):
+        sock = self._get_send_socket()
+        addresses = self.peers + ([self.group] if self.group else [])
+        for address in addresses:
+            try:
+                sock.sendto(payload, address)
+            except socket.error:
+                logger.warning('Could not send invalidation to %s:%d',
+                               *address, exc_info=True)
+
+    def receive(self, timeout=None):
+        sock = self._get_receive_socket()
+        sock.settimeout(timeout)
+        try:
+            payload, address = sock.recvfrom(65535)
+        except socket.timeout:
+            return []
+        except socket.error as exc:
+            if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []  # non-blocking receive with a zero timeout
+            raise
+        return [payload]
+
+    def close(self):
+        for sock in (self.send_socket, self.receive_socket):
+            if sock is not None:
+                sock.close()
+        self.send_socket = self.receive_socket = None
+
+
+class SpoolTransport(Transport):
+    """Exchanges messages as files in a directory shared by the nodes
+
+    Each message is written atomically into its own file.  Files older than
+    ``retention`` seconds are removed by the receivers.
+
+    Each receiver keeps the name of the last message it applied in
+    ``state_file``, by default a file named after the node in the
+    directory, so it doesn't apply the messages again after a restart.
+
+    """
+    def __init__(self, directory, retention=3600, poll_interval=1.0,
+                 state_file=None):
+        self.directory = directory
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self.state_file = state_file
+        self.seen = set()
+        self.applied_on_start = None
+        self.received = self.saved = ''
+
+    def _get_state_file(self):
+        return self.state_file or os.path.join(
+            self.directory, '.%s.applied' % get_node_name())
+
+    def _get_applied_on_start(self):
+        """Returns the name of the last message applied before this
+        receiver started, or ``''``
+
+        Later messages are tracked in ``seen``, so messages of nodes whose
+        clocks lag behind aren't skipped.
+
+        """
+        if self.applied_on_start is None:
+            try:
+                with open(self._get_state_file()) as state:
+                    self.applied_on_start = state.read().strip()
+            except IOError:
+                self.applied_on_start = ''
+        return self.applied_on_start
+
+    def acknowledge(self):
+        if self.received <= max(self.saved, self._get_applied_on_start()):
+            return
+        state_file = self._get_state_file()
+        try:
+            f, tmpname = tempfile.mkstemp(
+                dir=os.path.dirname(state_file) or '.', prefix='.tmp')
+            os.write(f, self.received)
+            os.close(f)
+            os.rename(tmpname, state_file)
+        except Exception:
+            logger.warning('Could not save the last applied message in %s',
+                           state_file, exc_info=True)
+            return
+        self.saved = self.received
+
+    def send(self, payload):
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+        except OSError as exc:
+            if exc.errno != 17:  # OSError 17 = 'File exists'
+                raise StaticGeneratorException(
+                    'Could not create directory', directory=self.directory)
+        try:
+            f, tmpname = tempfile.mkstemp(dir=self.directory,
+                                          prefix='.tmp')
+            os.write(f, payload)
+            os.close(f)
+            os.rename(tmpname, os.path.join(
+                self.directory, '%.6f-%s.json' % (
+                    time.time(), os.path.basename(tmpname)[4:])))
+        except Exception:
+            raise StaticGeneratorException(
+                'Could not write invalidation message',
+                directory=self.directory)
+
+    def _poll(self, now):
+        try:
+            names = sorted(name for name in os.listdir(self.directory)
+                           if name.endswith('.json'))
+        except OSError:
+            return []
+        payloads = []
+        applied = self._get_applied_on_start()
+        for name in names:
+            filename = os.path.join(self.directory, name)
+            if now - float(name.split('-', 1)[0]) > self.retention:
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass  # removed by another receiver
+                continue
+            if name in self.seen or name <= applied:
+                continue
+            try:
+                with open(filename) as message:
+                    payloads.append(message.read())
+            except IOError:
+                continue
+            self.seen.add(name)
+            self.received = max(self.received, name)
+        self.seen.intersection_update(names)
+        return payloads
+
+    def receive(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            now = time.time()
+            payloads = self._poll(now)
+            if payloads or (deadline is not None and now >= deadline):
+                return payloads
+            time.sleep(self.poll_interval if deadline is None
+                       else max(min(self.poll_interval, deadline - now), 0))
+
+
+def get_node_name():
+    return settings.NODE_NAME or socket.gethostname()
+
+
+class Broadcaster(object):
+    """Batches events and sends them through a transport"""
+
+    def __init__(self, transport, node=None):
+        self.transport = transport
+        self.node = '%s:%d' % (node or get_node_name(), os.getpid())
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _encode(self, events):
+        with self.lock:
+            self.seq += 1
+            seq = self.seq
+        return json.dumps({'node': self.node, 'seq': seq, 'events': events})
+
+    def split(self, events):
+        """Splits events into chunks which fit in the transport's messages"""
+        max_size = self.transport.max_size
+        if (max_size and len(events) > 1
+                and len(json.dumps(events)) + 200 > max_size):
+            half = len(events) // 2
+            return self.split(events[:half]) + self.split(events[half:])
+        return [events]
+
+    def send(self, events):
+        """Sends events, returns the messages sent"""
+        messages = [self._encode(chunk) for chunk in self.split(events)]
+        for message in messages:
+            self.transport.send(message)
+        return messages
+
+    def add(self, action, paths):
+        """Sends an event for each path, or queues them inside a batch"""
+        events = [[action, path] for path in paths]
+        if not events:
+            return
+        pending = getattr(self.local, 'pending', None)
+        if pending is not None:
+            pending.extend(events)
+        else:
+            self.send(events)
+
+    @contextmanager
+    def batch(self):
+        outermost = getattr(self.local, 'pending', None) is None
+        if outermost:
+            self.local.pending = []
+        try:
+            yield
+        finally:
+            if outermost:
+                events, self.local.pending = self.local.pending, None
+                if events:
+                    self.send(events)
+
+
+class Listener(object):
+    """Applies events received from peers through a local StaticGenerator"""
+
+    def __init__(self, transport, generator=None, node=None):
+        from staticgenerator import StaticGenerator
+        self.transport = transport
+        self.generator = generator or StaticGenerator()
+        self.host = node or get_node_name()
+        self.last_seq = {}
+        self.received = 0
+        self.dropped = 0
+
+    def check_sequence(self, node, seq):
+        """Tracks sequence numbers, returns the number of missed messages"""
+        last = self.last_seq.get(node)
+        self.last_seq[node] = max(seq, last or 0)
+        if last is None or seq <= last:
+            return 0
+        return seq - last - 1
+
+    def handle_payload(self, payload):
+        try:
+            message = json.loads(payload)
+            node, seq = message['node'], int(message['seq'])
+            events = message['events']
+        except (ValueError, KeyError, TypeError):
+            logger.warning('Invalid invalidation message', exc_info=True)
+            return
+        if node.rpartition(':')[0] == self.host:
+            return  # our own node already applied the events
+        self.received += 1
+        missed = self.check_sequence(node, seq)
+        if missed:
+            self.dropped += missed
+            logger.warning('Missed %d invalidation messages from %s',
+                           missed, node)
+            if settings.INVALIDATION_ON_GAP == 'flush':
+                self.generator.recursive_delete_from_path(u'/')
+        for action, path in events:
+            self.apply(action, path)
+
+    def apply(self, action, path):
+        if action not in ACTIONS:
+            logger.warning('Unknown invalidation action %r', action)
+            return
+        try:
+            getattr(self.generator, '%s_from_path' % action)(path)
+        except StaticGeneratorException:
+            logger.warning('Could not apply %s of %s', action, path,
+                           exc_info=True)
+
+    def poll(self, timeout=None):
+        """Receives and applies messages, returns the number received"""
+        payloads = self.transport.receive(timeout)
+        for payload in payloads:
+            self.handle_payload(payload)
+        if payloads:
+            self.transport.acknowledge()
+        return len(payloads)
+
+    def serve_forever(self):
+        while True:
+            self.poll(timeout=1.0)
+
+
+def get_transport():
+    """Returns the transport configured in the settings, or ``None``"""
+    transport = settings.INVALIDATION_TRANSPORT
+    if not transport:
+        return None
+    if isinstance(transport, basestring):
+        module_name, _, name = transport.rpartition('.')
+        try:
+            transport = getattr(import_module(module_name), name)
+        except (ImportError, AttributeError, ValueError):
+            raise StaticGeneratorException(
+                'Could not import invalidation transport',
+                transport=transport)
+    return transport(**settings.INVALIDATION_OPTIONS)
+
+
+_broadcasters = {}
+_broadcasters_lock = threading.Lock()
+
+
+def get_broadcaster():
+    """Returns the process-wide broadcaster, or ``None`` if not configured"""
+    key = (settings.INVALIDATION_TRANSPORT,
+           repr(sorted(settings.INVALIDATION_OPTIONS.items())))
+    if not key[0]:
+        return None
+    with _broadcasters_lock:
+        if key not in _broadcasters:
+            _broadcasters[key] = Broadcaster(get_transport())
+        return _broadcasters[key]
+
+
+def broadcast(action, paths):
+    """Sends an event of each path to the peers if a transport is set"""
+    broadcaster = get_broadcaster()
+    if broadcaster is None:
+        return
+    try:
+        broadcaster.add(action, paths)
+    except StaticGeneratorException:
+        logger.warning('Could not broadcast %s', action, exc_info=True)
+
+
+@contextmanager
+def batch():
+    """Collects the broadcasts within the block into one message"""
+    broadcaster = get_broadcaster()
+    if broadcaster is None:
+        yield
+        return
+    with broadcaster.batch():
+        yield
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""Output filters applied to content before it is written into the cache
+
+``STATIC_GENERATOR_FILTERS`` lists filter classes (or their dotted paths).
+A new instance of each filter is created for every file written.  Filters
+work chunk by chunk: :meth:`Filter.feed` takes a chunk and returns the
+filtered output available so far, :meth:`Filter.close` returns the rest.
+
+Example::
+
+    STATIC_GENERATOR_FILTERS = ['staticgenerator.filters.HTMLMinifyFilter']
+
+A custom filter only needs to implement ``feed`` and ``close``::
+
+    class StripBOMFilter(Filter):
+        def __init__(self):
+            self.started = False
+
+        def feed(self, chunk):
+            if not self.started and chunk:
+                self.started = True
+                return chunk.lstrip('\\xef\\xbb\\xbf')
+            return chunk
+
+Filters only run for the content types in their ``content_types``
+attribute.  Content of an unknown type is treated as ``text/html``.
+
+"""
+import logging
+import re
+import threading
+
+from django.utils.importlib import import_module
+
+from staticgenerator import settings
+from staticgenerator.exceptions import StaticGeneratorException
+
+
+logger = logging.getLogger('staticgenerator.filters')
+
+_stats = {'files': 0, 'bytes_in': 0, 'bytes_out': 0}
+_stats_lock = threading.Lock()
+
+
+class Filter(object):
+    """Base class of output filters, passes content through unchanged"""
+
+    content_types = ('text/html',)
+
+    def feed(self, chunk):
+        return chunk
+
+    def close(self):
+        return ''
+
+
+class HTMLMinifyFilter(Filter):
+    """Removes comments and collapses whitespace in HTML
+
+    The contents of ``<pre>``, ``<textarea>``, ``<script>`` and ``<style>``
+    elements and the tags themselves are left intact.  SSI directives,
+    conditional comments and fragment markers are kept.
+
+    """
+    raw_tag_re = re.compile(r'<(pre|textarea|script|style)(?=[\s>/])', re.I)
+    whitespace_re = re.compile(r'\s+')
+    kept_comments = ('<!--#', '<!--[if', '<![endif]', '<!--sg-fragment:',
+                     '<!--/sg-fragment:')
+
+    def __init__(self):
+        self.pending = ''
+        self.raw_end = None
+        self.space = True  # strips leading whitespace
+
+    def feed(self, chunk):
+        self.pending += chunk
+        return self._process(final=False)
+
+    def close(self):
+        return self._process(final=True)
+
+    def _collapse(self, text):
+        if not text:
+            return ''
+        text = self.whitespace_re.sub(' ', text)
+        if self.space and text.startswith(' '):
+            text = text[1:]
+        if text:
+            self.space = text.endswith(' ')
+        return text
+
+    def _process(self, final):
+        data = self.pending
+        lower = data.lower() if self.raw_end or '<' in data else data
+        out = []
+        pos = 0
+        length = len(data)
+        while pos < length:
+            if self.raw_end:
+                end = lower.find(self.raw_end, pos)
+                if end < 0:
+                    # Keep enough to find a closing tag split between chunks
+                    safe = length if final else max(
+                        pos, length - len(self.raw_end) + 1)
+                    out.append(data[pos:safe])
+                    pos = safe
+                    break
+                out.append(data[pos:end])
+                pos = end
+                self.raw_end = None
+                continue
+            start = data.find('<', pos)
+            if start < 0:
+                out.append(self._collapse(data[pos:]))
+                pos = length
+                break
+            out.append(self._collapse(data[pos:start]))
+            pos = start
+            if data.startswith('<!--', pos):
+                end = data.find('-->', pos + 4)
+                if end < 0:
+                    break
+                comment = data[pos:end + 3]
+                if comment.startswith(self.kept_comments):
+                    out.append(comment)
+                    self.space = False
+                pos = end + 3
+                continue
+            end = data.find('>', pos + 1)
+            if end < 0:
+                break
+            tag = data[pos:end + 1]
+            out.append(tag)
+            self.space = False
+            match = self.raw_tag_re.match(tag)
+            if match:
+                self.raw_end = '</%s' % match.group(1).lower()
+            pos = end + 1
+        if final and pos < length:
+            out.append(data[pos:])  # unterminated tag or comment
+            pos = length
+        self.pending = data[pos:]
+        return ''.join(out)
+
+
+def import_filter(path):
+    module_name, _, name = path.rpartition('.')
+    try:
+        return getattr(import_module(module_name), name)
+    except (ImportError, AttributeError, ValueError):
+        raise StaticGeneratorException('Could not import output filter',
+                                       path=path)
+
+
+class FilterChain(object):
+    """Runs content through a list of filters chunk by chunk"""
+
+    def __init__(self, filters):
+        self.filters = filters
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def filter_chunks(self, chunks):
+        """Yields the filtered output of an iterable of chunks"""
+        for chunk in chunks:
+            self.bytes_in += len(chunk)
+            for output_filter in self.filters:
+                chunk = output_filter.feed(chunk)
+            if chunk:
+                self.bytes_out += len(chunk)
+                yield chunk
+        # Flush each filter and feed its remainder to the following filters
+        for index, output_filter in enumerate(self.filters):
+            chunk = output_filter.close()
+            for following in self.filters[index + 1:]:
+                chunk = following.feed(chunk)
+            if chunk:
+                self.bytes_out += len(chunk)
+                yield chunk
+
+    def filter(self, content, chunk_size=65536):
+        return ''.join(self.filter_chunks(
+            content[start:start + chunk_size]
+            for start in xrange(0, len(content), chunk_size)))
+
+
+def get_filter_chain(content_type=None):
+    """Returns a chain of new filter instances for the content type"""
+    content_type = (content_type or 'text/html').split(';')[0].strip()
+    filters = []
+    for output_filter in settings.FILTERS:
+        if isinstance(output_filter, basestring):
+            output_filter = import_filter(output_filter)
+        if content_type in output_filter.content_types:
+            filters.append(output_filter())
+    return FilterChain(filters)
+
+
+def apply_filters(content, content_type=None):
+    """Runs content through the configured filters and counts bytes saved"""
+    if not settings.FILTERS:
+        return content
+    chain = get_filter_chain(content_type)
+    if not chain.filters:
+        return content
+    filtered = chain.filter(content)
+    with _stats_lock:
+        _stats['files'] += 1
+        _stats['bytes_in'] += chain.bytes_in
+        _stats['bytes_out'] += chain.bytes_out
+    logger.debug('Filters saved %d of %d bytes',
+                 chain.bytes_in - chain.bytes_out, chain.bytes_in)
+    return filtered
+
+
+def get_stats():
+    """Returns the number of files filtered and bytes saved in this
+    process"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['bytes_saved'] = stats['bytes_in'] - stats['bytes_out']
+    return stats
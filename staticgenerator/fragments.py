@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""Cached fragments assembled with nginx Server Side Includes
+
+Regions of a page which are shared between many pages (headers, sidebars)
+can be rendered with the ``{% staticfragment %}`` template tag.  The tag wraps
+the rendered region in marker comments.  When the page is published, each
+marked region is written into a separate file and replaced in the page file
+with an SSI ``<!--# include -->`` directive pointing to the fragment's URL.
+Responses sent to the client have the markers stripped.
+
+Invalidating a fragment with :func:`delete_fragment` then only deletes one
+small file; the next SSI subrequest for it falls through to Django, which
+renders the fragment with :func:`staticgenerator.views.fragment` and caches
+it again.
+
+"""
+import re
+
+from staticgenerator import settings
+from staticgenerator.exceptions import StaticGeneratorException
+
+
+FRAGMENT_MARKER = '<!--sg-fragment:'
+FRAGMENT_START = FRAGMENT_MARKER + '%s-->'
+FRAGMENT_END = '<!--/sg-fragment:%s-->'
+
+fragment_name_re = re.compile(r'^[\w-]+(?:[./][\w-]+)*$')
+fragment_re = re.compile(r'<!--sg-fragment:(?P<name>[\w./-]+)-->'
+                         r'(?P<content>.*?)'
+                         r'<!--/sg-fragment:(?P=name)-->', re.S)
+
+
+def check_fragment_name(name):
+    """Raises ``StaticGeneratorException`` for unsafe fragment names"""
+    if not fragment_name_re.match(name):
+        raise StaticGeneratorException('Invalid fragment name', name=name)
+    return name
+
+
+def get_fragment_path(name):
+    """Returns the URL path the fragment ``name`` is published and served
+    at"""
+    return u'%s%s/' % (settings.FRAGMENT_PREFIX, check_fragment_name(name))
+
+
+def get_fragment_template_name(name):
+    """Returns the template used to render the fragment ``name``"""
+    return u'%s%s' % (settings.FRAGMENT_TEMPLATE_DIR,
+                      check_fragment_name(name))
+
+
+def wrap_fragment(name, content):
+    """Wraps rendered fragment ``content`` in marker comments"""
+    check_fragment_name(name)
+    return u''.join((FRAGMENT_START % name, content, FRAGMENT_END % name))
+
+
+def ssi_include(name):
+    """Returns the SSI directive which includes the fragment ``name``"""
+    return '<!--# include virtual="%s" -->' % (
+        get_fragment_path(name).encode('utf-8'))
+
+
+def split_fragments(content):
+    """Splits marked fragments out of ``content``
+
+    Returns a ``(skeleton, fragments)`` tuple where ``skeleton`` is the
+    content with each fragment replaced by an SSI include directive and
+    ``fragments`` is a list of ``(name, content)`` tuples.  Nested fragments
+    are left in their parent's content.
+
+    """
+    if FRAGMENT_MARKER not in content:
+        return content, []
+    fragments = []
+
+    def replace(match):
+        fragments.append((match.group('name'), match.group('content')))
+        return ssi_include(match.group('name'))
+
+    return fragment_re.sub(replace, content), fragments
+
+
+def strip_fragment_markers(content):
+    """Removes fragment marker comments from ``content``"""
+    if FRAGMENT_MARKER not in content:
+        return content
+    while True:
+        stripped = fragment_re.sub(r'\g<content>', content)
+        if stripped == content:
+            return stripped
+        content = stripped
+
+
+def delete_fragment(*names):
+    """Invalidates the cached files of the given fragments"""
+    from staticgenerator import quick_delete
+    return quick_delete(*[get_fragment_path(name) for name in names])
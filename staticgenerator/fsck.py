@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""Consistency check of the cache trees
+
+Publishing and invalidation leave garbage behind over time:
+
+* temporary files of writes whose rename raced an invalidation
+* stale files of pages which were deleted and never published again
+* empty directories, e.g. shard directories of deleted pages
+
+:func:`fsck` scans the ``fresh`` and ``stale`` trees with a pool of threads,
+one top-level directory at a time, and removes these.  It's run with the
+``staticgenerator_fsck`` management command.
+
+"""
+from collections import defaultdict
+import logging
+from multiprocessing.pool import ThreadPool
+import os
+import re
+import stat
+import time
+
+from staticgenerator import settings
+from staticgenerator.storage import TMP_PREFIX
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+logger = logging.getLogger('staticgenerator.fsck')
+
+TREES = ('fresh', 'stale')
+
+# Names of ``tempfile.mkstemp`` files and of the links of blob writes
+TMP_NAME_RE = re.compile(r'^%s[a-zA-Z0-9_]{6}$' % re.escape(TMP_PREFIX))
+
+
+class Entry(object):
+    """Minimal stand-in for the ``DirEntry`` objects of ``scandir``"""
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self._stat = None
+
+    def stat(self, follow_symlinks=False):
+        if self._stat is None:
+            self._stat = os.lstat(self.path)
+        return self._stat
+
+    def is_dir(self, follow_symlinks=False):
+        return stat.S_ISDIR(self.stat().st_mode)
+
+
+def scan_directory(directory):
+    """Returns the entries of a directory, using ``scandir`` if available"""
+    if scandir is not None:
+        return list(scandir(directory))
+    return [Entry(directory, name) for name in os.listdir(directory)]
+
+
+class Checker(object):
+    """Removes orphaned files and empty directories below a document root
+
+    * ``tmp_age``: seconds after which temporary files are orphans
+    * ``stale_age``: seconds since the last publish after which stale files
+      without a fresh file are removed; ``None`` keeps them
+    * ``dry_run``: only count what would be removed
+
+    Empty directories are removed if they weren't modified within
+    ``tmp_age`` seconds before the scan, so directories which are just
+    being published into are kept.
+
+    """
+
+    def __init__(self, root=None, tmp_age=3600, stale_age=None,
+                 dry_run=False, now=None):
+        self.root = root or settings.ROOT
+        self.tmp_age = tmp_age
+        self.stale_age = stale_age
+        self.dry_run = dry_run
+        self.now = time.time() if now is None else now
+
+    def run(self, workers=4):
+        """Checks both trees and returns a dict of counts
+
+        The counts are the ``tmp_files``, ``stale_files`` and
+        ``directories`` removed, and the ``bytes`` and ``inodes`` reclaimed.
+        Files with other remaining hard links don't reclaim anything.
+
+        """
+        tasks = []
+        for tree in TREES:
+            tree_root = os.path.join(self.root, tree)
+            try:
+                entries = scan_directory(tree_root)
+            except OSError:
+                continue
+            tasks.extend((tree, entry) for entry in entries)
+        pool = ThreadPool(max(1, workers))
+        try:
+            results = pool.map(self._check_top_entry, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        totals = dict.fromkeys(
+            ('tmp_files', 'stale_files', 'directories', 'bytes', 'inodes'), 0)
+        for counts in results:
+            for key, value in counts.items():
+                totals[key] += value
+        logger.debug('Checked %s: %r', self.root, totals)
+        return totals
+
+    def _check_top_entry(self, task):
+        tree, entry = task
+        counts = defaultdict(int)
+        try:
+            if entry.is_dir():
+                self._check_directory(tree, entry, counts)
+            else:
+                self._check_file(tree, entry, counts)
+        except Exception:
+            logger.warning('Could not check %s', entry.path, exc_info=True)
+        return counts
+
+    def _check_directory(self, tree, directory, counts):
+        """Checks a directory recursively and returns whether it was
+        removed"""
+        try:
+            st = directory.stat()
+            entries = scan_directory(directory.path)
+        except OSError:
+            return False  # removed concurrently
+        remaining = len(entries)
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                remaining -= 1
+                continue
+            if is_dir:
+                removed = self._check_directory(tree, entry, counts)
+            else:
+                removed = self._check_file(tree, entry, counts)
+            if removed:
+                remaining -= 1
+        if remaining or self.now - st.st_mtime < self.tmp_age:
+            return False
+        if not self.dry_run:
+            try:
+                os.rmdir(directory.path)
+            except OSError:
+                return False  # published into concurrently
+        counts['directories'] += 1
+        counts['inodes'] += 1
+        return True
+
+    def _check_file(self, tree, entry, counts):
+        """Removes the file if it's an orphan and returns whether it was"""
+        try:
+            st = entry.stat()
+        except OSError:
+            return False
+        age = self.now - st.st_mtime
+        if TMP_NAME_RE.match(entry.name) and age >= self.tmp_age:
+            key = 'tmp_files'
+        elif (tree == 'stale' and self.stale_age is not None and
+              age >= self.stale_age and not self._has_fresh_file(entry)):
+            key = 'stale_files'
+        else:
+            return False
+        if not self.dry_run:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                return False
+        counts[key] += 1
+        if st.st_nlink <= 1:
+            counts['bytes'] += st.st_size
+            counts['inodes'] += 1
+        return True
+
+    def _has_fresh_file(self, entry):
+        relative = os.path.relpath(entry.path,
+                                   os.path.join(self.root, 'stale'))
+        return os.path.lexists(os.path.join(self.root, 'fresh', relative))
+
+
+def fsck(root=None, tmp_age=3600, stale_age=None, workers=4, dry_run=False,
+         now=None):
+    """Removes orphaned files and empty directories from the ``fresh`` and
+    ``stale`` trees, see :class:`Checker`"""
+    return Checker(root, tmp_age, stale_age, dry_run, now).run(workers)
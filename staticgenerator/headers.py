@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""Content types and header metadata of cached files
+
+Responses of each content type in ``STATIC_GENERATOR_CONTENT_TYPES`` are
+cached with the type's extension appended to the file name, e.g.
+``index.html%3F.json`` for ``application/json``.  The ``types`` block
+generated by the ``staticgenerator_nginx`` command maps the extensions back
+to the content types.  HTML has no extension, and responses of types which
+aren't listed are not cached.
+
+With ``STATIC_GENERATOR_HEADER_SIDECARS`` a JSON sidecar file with the
+``.sgmeta`` extension is written next to each cached page.  It holds the
+``content_type``, the ``cache_control`` header and an ``etag`` computed
+from the content.  Pages with cached fragments always get a sidecar, which
+marks them with ``includes`` for ``staticgenerator.wsgi``.  The ``staticgenerator_headers`` management command
+collects the sidecars into nginx map files which restore the
+``Cache-Control`` and ``ETag`` headers.
+
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+from staticgenerator import settings
+from staticgenerator.exceptions import StaticGeneratorException
+from staticgenerator.negative import _quote
+
+
+META_SUFFIX = '.sgmeta'
+MAP_HEADERS = (('cache_control', 'cache-control.map'),
+               ('etag', 'etag.map'))
+
+
+def get_mime_type(content_type):
+    """Returns the content type without parameters, e.g. the charset"""
+    return (content_type or 'text/html').split(';')[0].strip().lower()
+
+
+def get_type_suffix(content_type):
+    """Returns the file name suffix of a content type
+
+    Returns ``None`` if responses of the type are not cached.
+
+    """
+    mime_type = get_mime_type(content_type)
+    if mime_type == 'text/html':
+        return ''
+    return settings.CONTENT_TYPES.get(mime_type)
+
+
+def get_type_suffixes():
+    """Returns the distinct file name suffixes of the cached content types"""
+    return sorted(set(suffix for suffix in settings.CONTENT_TYPES.values()
+                      if suffix))
+
+
+def compute_etag(content):
+    return '"%s"' % hashlib.md5(content).hexdigest()
+
+
+def format_metadata(content_type, cache_control, etag, includes=False):
+    """Returns the content of a sidecar file
+
+    ``includes`` marks pages containing SSI directives of cached fragments.
+
+    """
+    metadata = {'content_type': content_type,
+                'cache_control': cache_control,
+                'etag': etag}
+    if includes:
+        metadata['includes'] = True
+    return json.dumps(metadata, sort_keys=True, separators=(',', ':'))
+
+
+def read_metadata(filename):
+    """Returns the metadata of the sidecar of ``filename``, or ``None``"""
+    try:
+        with open(filename + META_SUFFIX) as sidecar:
+            return json.loads(sidecar.read())
+    except (IOError, ValueError):
+        return None
+
+
+def write_header_maps(root=None):
+    """Writes the ``Cache-Control`` and ``ETag`` headers of the sidecars
+    into nginx map files
+
+    The maps are keyed by the URI of the cached file under the ``fresh``
+    tree.  Returns the number of sidecars read.
+
+    """
+    root = root or settings.ROOT
+    fresh_root = os.path.join(root, 'fresh')
+    lines = dict((key, []) for key, name in MAP_HEADERS)
+    count = 0
+    for dirpath, dirnames, filenames in os.walk(fresh_root):
+        for name in filenames:
+            if not name.endswith(META_SUFFIX):
+                continue
+            filename = os.path.join(dirpath, name[:-len(META_SUFFIX)])
+            metadata = read_metadata(filename)
+            if metadata is None:
+                continue  # removed concurrently or incomplete
+            count += 1
+            uri = '/' + os.path.relpath(filename, fresh_root)
+            for key, map_name in MAP_HEADERS:
+                if metadata.get(key):
+                    lines[key].append('%s %s;\n' % (
+                        _quote(uri), _quote(metadata[key].encode('utf-8'))))
+    for key, map_name in MAP_HEADERS:
+        filename = os.path.join(root, map_name)
+        try:
+            f, tmpname = tempfile.mkstemp(dir=root)
+            os.write(f, ''.join(sorted(lines[key])))
+            os.close(f)
+            os.chmod(tmpname, 0644)
+            os.rename(tmpname, filename)
+        except Exception:
+            raise StaticGeneratorException('Could not write header map',
+                                           filename=filename)
+    return count
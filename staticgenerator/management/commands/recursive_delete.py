@@ -1,5 +1,7 @@
+from optparse import make_option
+
 from django.core.management.base import LabelCommand
-from staticgenerator import recursive_delete
+from staticgenerator import popularity, purge, recursive_delete
 
 
 class Command(LabelCommand):
@@ -7,7 +9,18 @@ class Command(LabelCommand):
     args = '<resource>'
     label = 'resource'
 
+    option_list = LabelCommand.option_list + (
+        make_option('--popular', type='float', dest='popular', default=None,
+                    help='Render this fraction of the most popular paths '
+                         'below the resource again'),
+    )
+
     requires_model_validation = False
 
     def handle_label(self, resource, **options):
         recursive_delete(resource)
+        purge.flush()
+        if options['popular']:
+            published = popularity.rebuild_popular(resource,
+                                                   options['popular'])
+            self.stdout.write('Published %d popular pages' % published)
@@ -0,0 +1,41 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from staticgenerator.fsck import fsck
+
+
+class Command(NoArgsCommand):
+    help = ('Removes orphaned temporary files, stale files of deleted pages '
+            'and empty directories from the cache')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--tmp-age', type='int', dest='tmp_age', default=3600,
+                    help='Remove temporary files and empty directories '
+                         'older than this many seconds'),
+        make_option('--stale-days', type='float', dest='stale_days',
+                    default=None,
+                    help='Remove stale files without a fresh file which '
+                         'were not published for this many days'),
+        make_option('--workers', type='int', dest='workers', default=4,
+                    help='Number of directories scanned in parallel'),
+        make_option('--dry-run', action='store_true', dest='dry_run',
+                    default=False,
+                    help='Only report what would be removed'),
+    )
+
+    requires_model_validation = False
+
+    def handle_noargs(self, **options):
+        stale_days = options['stale_days']
+        counts = fsck(
+            tmp_age=options['tmp_age'],
+            stale_age=None if stale_days is None else stale_days * 86400,
+            workers=options['workers'],
+            dry_run=options['dry_run'])
+        self.stdout.write(
+            '%s %d temporary files, %d stale files and %d directories, '
+            'reclaimed %d bytes and %d inodes'
+            % ('Would remove' if options['dry_run'] else 'Removed',
+               counts['tmp_files'], counts['stale_files'],
+               counts['directories'], counts['bytes'], counts['inodes']))
@@ -0,0 +1,21 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from staticgenerator.blobs import gc_blobs
+
+
+class Command(NoArgsCommand):
+    help = 'Removes blobs which are no longer linked from any cached file'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--grace', type='int', dest='grace', default=60,
+                    help='Keep blobs modified within this many seconds'),
+    )
+
+    requires_model_validation = False
+
+    def handle_noargs(self, **options):
+        removed, reclaimed = gc_blobs(grace=options['grace'])
+        self.stdout.write('Removed %d blobs, reclaimed %d bytes'
+                          % (removed, reclaimed))
@@ -0,0 +1,14 @@
+from django.core.management.base import NoArgsCommand
+
+from staticgenerator import headers
+
+
+class Command(NoArgsCommand):
+    help = ('Writes the Cache-Control and ETag headers of the cached pages '
+            'into the map files for nginx')
+
+    requires_model_validation = False
+
+    def handle_noargs(self, **options):
+        count = headers.write_header_maps()
+        self.stdout.write('Wrote the headers of %d pages' % count)
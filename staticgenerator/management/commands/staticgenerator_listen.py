@@ -0,0 +1,22 @@
+from django.core.management.base import NoArgsCommand
+
+from staticgenerator.exceptions import StaticGeneratorException
+from staticgenerator.fanout import Listener, get_transport
+
+
+class Command(NoArgsCommand):
+    help = ('Applies invalidations broadcast by other nodes to the local '
+            'cache')
+
+    requires_model_validation = False
+
+    def handle_noargs(self, **options):
+        transport = get_transport()
+        if transport is None:
+            raise StaticGeneratorException(
+                'Set STATIC_GENERATOR_INVALIDATION_TRANSPORT to listen for '
+                'invalidations')
+        try:
+            Listener(transport).serve_forever()
+        finally:
+            transport.close()
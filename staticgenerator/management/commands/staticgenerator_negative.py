@@ -0,0 +1,25 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from staticgenerator import negative
+
+
+class Command(NoArgsCommand):
+    help = ('Prunes expired cached 404 responses and redirects, and writes '
+            'the redirect map files for nginx')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--no-maps', action='store_false', dest='maps',
+                    default=True,
+                    help="Only prune, don't write the redirect maps"),
+    )
+
+    requires_model_validation = False
+
+    def handle_noargs(self, **options):
+        removed = negative.prune()
+        self.stdout.write('Pruned %d entries' % removed)
+        if options['maps']:
+            written = negative.write_redirect_maps()
+            self.stdout.write('Wrote %d redirects' % written)
@@ -0,0 +1,13 @@
+from django.core.management.base import NoArgsCommand
+
+from staticgenerator.nginx import get_nginx_config
+
+
+class Command(NoArgsCommand):
+    help = ('Prints the nginx configuration matching the staticgenerator '
+            'settings')
+
+    requires_model_validation = False
+
+    def handle_noargs(self, **options):
+        self.stdout.write(get_nginx_config())
@@ -0,0 +1,66 @@
+import gzip
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from staticgenerator import popularity
+from staticgenerator.crawler import Crawler
+
+
+class Command(BaseCommand):
+    help = ('Counts the requests of nginx access logs (combined format) in '
+            'the popularity table, or lists or prunes the table')
+    args = 'ingest <logfile ...> | top | prune'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--limit', type='int', dest='limit', default=None,
+                    help='How many paths to list'),
+        make_option('--fraction', type='float', dest='fraction',
+                    default=None,
+                    help='Which fraction of the paths to list'),
+        make_option('--prefix', dest='prefix', default='',
+                    help='Only list paths starting with this prefix'),
+        make_option('--min-score', type='float', dest='min_score',
+                    default=0.01,
+                    help='Prune paths whose score decayed below this'),
+    )
+
+    requires_model_validation = False
+
+    def handle(self, *args, **options):
+        table = popularity.get_table()
+        if table is None:
+            raise CommandError('Set STATIC_GENERATOR_POPULARITY_DB to track '
+                               'popularity')
+        if not args:
+            raise CommandError('Usage: %s' % self.args)
+        action, filenames = args[0], args[1:]
+        if action == 'ingest':
+            is_cacheable = Crawler([], max_visited=1).is_cacheable
+            counted = 0
+            for filename in filenames or ['-']:
+                if filename == '-':
+                    # Standard input can't be seeked, so it's counted whole
+                    counted += popularity.ingest_log(sys.stdin, table,
+                                                     is_cacheable)
+                    continue
+                if filename.endswith('.gz'):
+                    f = gzip.open(filename)
+                else:
+                    f = open(filename)
+                try:
+                    counted += popularity.ingest_file(f, table, is_cacheable)
+                finally:
+                    f.close()
+            self.stdout.write('Counted %d requests' % counted)
+        elif action == 'top':
+            for path, score in table.top(options['limit'],
+                                         options['fraction'],
+                                         options['prefix']):
+                self.stdout.write('%12.2f %s' % (score, path))
+        elif action == 'prune':
+            removed = table.prune(options['min_score'])
+            self.stdout.write('Pruned %d paths' % removed)
+        else:
+            raise CommandError('Unknown action %r' % action)
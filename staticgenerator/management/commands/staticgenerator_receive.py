@@ -0,0 +1,25 @@
+from django.core.management.base import CommandError, LabelCommand
+
+from staticgenerator import StaticGeneratorException, settings
+from staticgenerator.replication import Receiver
+from staticgenerator.utils import parse_address
+
+
+class Command(LabelCommand):
+    help = ('Receives files pushed by other nodes into the local cache, '
+            'listening at the given address')
+    args = '<host:port>'
+    label = 'address'
+
+    requires_model_validation = False
+
+    def handle_label(self, address, **options):
+        try:
+            server = Receiver(parse_address(address), settings.ROOT,
+                              settings.REPLICATION_SECRET)
+        except StaticGeneratorException as exc:
+            raise CommandError(str(exc))
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
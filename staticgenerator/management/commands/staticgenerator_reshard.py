@@ -0,0 +1,22 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from staticgenerator import sharding
+
+
+class Command(NoArgsCommand):
+    help = ('Moves cached files below STATIC_GENERATOR_SHARDED_PREFIXES '
+            'into their shard directories')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--prefix', action='append', dest='prefixes',
+                    default=None,
+                    help='Reshard only this prefix (repeatable)'),
+    )
+
+    requires_model_validation = False
+
+    def handle_noargs(self, **options):
+        moved = sharding.reshard(prefixes=options['prefixes'])
+        self.stdout.write('Moved %d entries' % moved)
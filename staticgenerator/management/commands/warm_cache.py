@@ -0,0 +1,42 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from staticgenerator import popularity
+from staticgenerator.crawler import Crawler
+
+
+class Command(BaseCommand):
+    help = ('Warms the on-disk cache by rendering the given paths in-process '
+            'and following same-site links')
+    args = '<path path ...>'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--depth', type='int', dest='depth', default=3,
+                    help='How many links away from the seeds to follow'),
+        make_option('--concurrency', type='int', dest='concurrency',
+                    default=1,
+                    help='How many pages to render in parallel'),
+        make_option('--max-visited', type='int', dest='max_visited',
+                    default=1000000,
+                    help='Expected number of URLs, sizes the visited set'),
+        make_option('--popular', type='float', dest='popular', default=None,
+                    help='Render this fraction of the most popular paths '
+                         'first'),
+    )
+
+    requires_model_validation = False
+
+    def handle(self, *paths, **options):
+        seeds = list(paths or ['/'])
+        table = popularity.get_table()
+        if options['popular'] and table is not None:
+            seeds = [path for path, score
+                     in table.top(fraction=options['popular'])] + seeds
+        crawler = Crawler(seeds,
+                          max_depth=options['depth'],
+                          concurrency=options['concurrency'],
+                          max_visited=options['max_visited'])
+        published = crawler.crawl()
+        self.stdout.write('Published %d pages, %d failed'
+                          % (published, crawler.failed))
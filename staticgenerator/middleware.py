@@ -1,10 +1,18 @@
 import re
 import logging
 import sys
+import time
 
 from staticgenerator import (
-    StaticGenerator, StaticGeneratorException, settings, bypass_request
+    StaticGenerator, StaticGeneratorException, popularity, settings, writer,
+    bypass_request
 )
+from staticgenerator.fragments import (
+    FRAGMENT_MARKER, strip_fragment_markers
+)
+from staticgenerator.negative import REDIRECT_STATUSES, get_request_uri
+from staticgenerator.purge import add_surrogate_keys, get_page_keys
+from staticgenerator.variants import get_request_variant
 
 
 logger = logging.getLogger('staticgenerator.middleware')
@@ -22,7 +30,8 @@ class StaticGeneratorMiddleware(object):
         )
         
     """
-    urls = tuple([re.compile(url) for url in settings.URLS])
+    urls = tuple([re.compile(url) for url in settings.URLS] +
+                 [re.compile('^%s' % re.escape(settings.FRAGMENT_PREFIX))])
     excluded_urls = tuple([re.compile(url) for url in settings.EXCLUDE_URLS])
     gen = StaticGenerator()
 
@@ -32,17 +41,52 @@ class StaticGeneratorMiddleware(object):
         if getattr(view_func, 'disable_static_generator', False):
             logger.debug('StaticGeneratorMiddleware: disabled')
             return None
-        
+
+        if self.is_cacheable(request):
+            path = request.path_info
+            if popularity.sampled():
+                self.record_popularity(request)
+            try:
+                logger.debug('StaticGeneratorMiddleware: '
+                             'Trying to publish stale path %s', path)
+                self.gen.publish_stale_path(
+                    path,
+                    request.META.get('QUERY_STRING', ''),
+                    variant=request._static_generator_variant)
+            except StaticGeneratorException:
+                logger.warning(
+                    'StaticGeneratorMiddleware: '
+                    'failed to publish stale content',
+                    exc_info=sys.exc_info(),
+                    extra={'request': request})
+        return None
+
+    def record_popularity(self, request):
+        """Counts a hit if the page is in the cache already, else a miss"""
+        path = request.path_info
+        query_string = request.META.get('QUERY_STRING', '')
+        fresh_filename = self.gen._get_publish_data(
+            path, query_string, False, request._static_generator_variant)[0]
+        popularity.record(popularity.get_key(path, query_string),
+                          fresh_filename is not None
+                          and self.gen.storage.exists(fresh_filename))
+
+    def is_cacheable(self, request):
+        """Checks whether the response to the request should be cached
+
+        Flags the request for caching and stores its cache variant.
+
+        """
         if request.COOKIES.has_key(settings.BYPASS_COOKIE):
             logger.debug('StaticGeneratorMiddleware: disabled by cookie')
-            return None
+            return False
         
         if (settings.ANONYMOUS_ONLY
              and hasattr(request, 'user')
              and not request.user.is_anonymous()):
             logger.debug('StaticGeneratorMiddleware: '
                          'disabled for logged in user')
-            return None
+            return False
 
         path = request.path_info
 
@@ -50,41 +94,89 @@ class StaticGeneratorMiddleware(object):
             if url.match(path):
                 logger.debug('StaticGeneratorMiddleware: '
                              'path %s excluded', path)
-                return None
+                return False
 
         for url in self.urls:
             if url.match(path):
                 request._static_generator = True
-                try:
-                    logger.debug('StaticGeneratorMiddleware: '
-                                 'Trying to publish stale path %s', path)
-                    self.gen.publish_stale_path(
-                        path,
-                        request.META.get('QUERY_STRING', ''),
-                        is_ajax=request.is_ajax())
-                except StaticGeneratorException:
-                    logger.warning(
-                        'StaticGeneratorMiddleware: '
-                        'failed to publish stale content',
-                        exc_info=sys.exc_info(),
-                        extra={'request': request})
-                return None
+                request._static_generator_started = time.time()
+                request._static_generator_variant = get_request_variant(
+                    request)
+                return True
 
         logger.debug('StaticGeneratorMiddleware: path %s not matched', path)
+        return False
+
+    def get_publish_call(self, request, response):
+        """Returns the method and arguments which cache the response
+
+        Returns ``None`` if the response isn't cached.
+
+        """
+        status_code = response.status_code
+        path = request.path_info
+        query_string = request.META.get('QUERY_STRING', '')
+        variant = request._static_generator_variant
+        if status_code == 200:
+            return (self.gen.publish_from_path,
+                    (path, query_string, response.content),
+                    {'variant': variant,
+                     'content_type': response.get('Content-Type'),
+                     'cache_control': response.get('Cache-Control')})
+        elif status_code == 404 and settings.CACHE_NOT_FOUND:
+            return (self.gen.publish_not_found_from_path,
+                    (path, query_string, response.content),
+                    {'variant': variant,
+                     'content_type': response.get('Content-Type')})
+        elif (status_code in REDIRECT_STATUSES
+              and settings.CACHE_REDIRECTS
+              and response.has_header('Location')):
+            return (self.gen.publish_redirect_from_path,
+                    (path, query_string, status_code, response['Location']),
+                    {'request_uri': get_request_uri(request)})
         return None
 
+    def publish_response(self, request, response):
+        """Writes a cacheable response into the cache
+
+        With ``STATIC_GENERATOR_ASYNC_WRITES`` the write is queued for the
+        background writer instead.
+
+        """
+        call = self.get_publish_call(request, response)
+        if call is None:
+            return
+        method, args, kwargs = call
+        async_writer = writer.get_writer()
+        if async_writer is None:
+            method(*args, **kwargs)
+        else:
+            key = (request.path_info, request.META.get('QUERY_STRING', ''),
+                   request._static_generator_variant)
+            # Content rendered before the page was deleted isn't written
+            async_writer.submit_since(
+                getattr(request, '_static_generator_started', None),
+                key, method, *args, **kwargs)
+
     def process_response(self, request, response):
         # pylint: disable=W0212
         #         Access to a protected member of a client class
 
-        if  (response.status_code == 200
-             and getattr(request, '_static_generator', False)):
+        status_code = response.status_code
+        cache = getattr(request, '_static_generator', None)
+        if (cache is None
+            and status_code == 404
+            and settings.CACHE_NOT_FOUND):
+            # The URL didn't resolve, so process_view wasn't called
+            cache = self.is_cacheable(request)
+
+        if cache and settings.SURROGATE_KEYS:
+            add_surrogate_keys(response,
+                               *get_page_keys(request.path_info))
+
+        if cache:
             try:
-                self.gen.publish_from_path(
-                    request.path_info,
-                    request.META.get('QUERY_STRING', ''),
-                    response.content,
-                    is_ajax=request.is_ajax())
+                self.publish_response(request, response)
             except StaticGeneratorException:
                 # Never throw a 500 page because of a failure in
                 # writing pages to the cache.  Remember to monitor
@@ -96,6 +188,18 @@ class StaticGeneratorMiddleware(object):
                     'failed to publish fresh content',
                     exc_info=sys.exc_info(),
                     extra={'request': request})
+
+        # Fragments are only split out of the cached file.  The client gets
+        # the assembled page, except for simulated requests from
+        # StaticGenerator.get_content_from_path which publish the content.
+        if (not getattr(response, 'streaming', False)
+            and not getattr(request, '_static_generator_internal', False)):
+            content = response.content
+            if FRAGMENT_MARKER in content:
+                content = strip_fragment_markers(content)
+                response.content = content
+                if response.has_header('Content-Length'):
+                    response['Content-Length'] = str(len(content))
         
         # Set or unset authenticated cookie
         if (settings.BYPASS_AUTHENTICATED and 
@@ -103,7 +207,10 @@ class StaticGeneratorMiddleware(object):
             and not request.user.is_anonymous()
         ):
             bypass_request(response)
-        else:
+        elif (settings.BYPASS_COOKIE in request.COOKIES
+              or settings.BYPASS_COOKIE in response.cookies):
+            # Responses without a Set-Cookie header stay cacheable in
+            # shared caches, so the cookie is only touched if it's there
             # Get count and decrement it
             # Catch all errors, including missing cookie and non-int value
             try:
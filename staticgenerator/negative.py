@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""Negative caching of 404 responses and caching of redirects
+
+With ``STATIC_GENERATOR_CACHE_NOT_FOUND`` the middleware writes the bodies
+of 404 responses into a separate ``negative`` tree, named like the files in
+the ``fresh`` tree.  With ``STATIC_GENERATOR_CACHE_REDIRECTS`` 301 and 302
+redirects are written into a ``redirects`` tree, which
+:func:`write_redirect_maps` collects into nginx map files.
+
+Entries expire after ``STATIC_GENERATOR_NEGATIVE_TTL`` seconds and at most
+``STATIC_GENERATOR_NEGATIVE_MAX_ENTRIES`` entries are kept; :func:`prune`
+enforces both.  It is run by the ``staticgenerator_negative`` management
+command, which should be run periodically together with an nginx reload to
+pick up new redirects, and every ``STATIC_GENERATOR_NEGATIVE_PRUNE_INTERVAL``
+writes in a background thread of each process.
+
+Entries are deleted when the resource is published or deleted, and when a
+model instance with a ``get_absolute_url`` method is saved.
+
+"""
+import heapq
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.encoding import iri_to_uri
+
+from staticgenerator import settings
+from staticgenerator.exceptions import StaticGeneratorException
+
+
+logger = logging.getLogger('staticgenerator.negative')
+
+TREES = ('negative', 'redirects')
+REDIRECT_STATUSES = (301, 302)
+
+_writes = [0]
+_writes_lock = threading.Lock()
+
+
+def get_request_uri(request):
+    """Returns the URI of a request as nginx's ``$request_uri`` has it
+
+    Django decodes the path, so it's encoded again unless the server passes
+    the raw URI.
+
+    """
+    for key in ('REQUEST_URI', 'RAW_URI'):
+        if request.META.get(key):
+            return request.META[key]
+    return iri_to_uri(request.get_full_path())
+
+
+def format_redirect(status, request_uri, location):
+    """Returns the content of a redirect entry file"""
+    if isinstance(request_uri, unicode):
+        request_uri = request_uri.encode('utf-8')
+    if isinstance(location, unicode):
+        location = location.encode('utf-8')
+    return '%d\t%s\t%s\n' % (status, request_uri, location)
+
+
+def parse_redirect(content):
+    """Returns the ``(status, request_uri, location)`` of a redirect entry"""
+    status, request_uri, location = content.rstrip('\n').split('\t', 2)
+    return int(status), request_uri, location
+
+
+def iter_entries(root=None):
+    """Yields ``(mtime, filename)`` for each negative and redirect entry"""
+    root = root or settings.ROOT
+    for tree in TREES:
+        for dirpath, dirnames, filenames in os.walk(os.path.join(root, tree)):
+            for name in filenames:
+                filename = os.path.join(dirpath, name)
+                try:
+                    yield os.stat(filename).st_mtime, filename
+                except OSError:
+                    pass  # removed concurrently
+
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        return False
+    try:
+        os.rmdir(os.path.dirname(filename))
+    except OSError:
+        pass  # directory not empty
+    return True
+
+
+def prune(root=None, ttl=None, max_entries=None, now=None):
+    """Removes expired entries and the oldest entries above the limit
+
+    Returns the number of entries removed.
+
+    """
+    ttl = settings.NEGATIVE_TTL if ttl is None else ttl
+    if max_entries is None:
+        max_entries = settings.NEGATIVE_MAX_ENTRIES
+    now = time.time() if now is None else now
+    removed = 0
+    kept = []
+    for mtime, filename in iter_entries(root):
+        if now - mtime > ttl:
+            removed += _remove(filename)
+        else:
+            kept.append((mtime, filename))
+    if len(kept) > max_entries:
+        for mtime, filename in heapq.nsmallest(len(kept) - max_entries, kept):
+            removed += _remove(filename)
+    logger.debug('Pruned %d negative cache entries', removed)
+    return removed
+
+
+class Pruner(object):
+    """Prunes the entries of the requested roots in a background thread
+
+    Pruning walks the whole ``negative`` and ``redirects`` trees, which
+    mustn't hold up the request writing an entry.
+
+    """
+
+    def __init__(self):
+        self.roots = set()
+        self.lock = threading.Lock()
+        self.requested = threading.Event()
+        self.thread_pid = None
+
+    def request(self, root):
+        with self.lock:
+            self.roots.add(root)
+            # Threads don't survive a fork, so each process starts its own
+            if self.thread_pid != os.getpid():
+                self.thread_pid = os.getpid()
+                thread = threading.Thread(target=self.run,
+                                          name='staticgenerator negative')
+                thread.daemon = True
+                thread.start()
+        self.requested.set()
+
+    def run(self):
+        while True:
+            self.requested.wait()
+            self.requested.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            roots, self.roots = self.roots, set()
+        for root in roots:
+            try:
+                prune(root)
+            except Exception:
+                logger.warning('Could not prune negative cache entries',
+                               exc_info=True)
+
+
+pruner = Pruner()
+
+
+def entry_published():
+    """Counts entry writes and requests a background prune every
+    ``NEGATIVE_PRUNE_INTERVAL``"""
+    with _writes_lock:
+        _writes[0] += 1
+        if _writes[0] < settings.NEGATIVE_PRUNE_INTERVAL:
+            return
+        _writes[0] = 0
+    pruner.request(settings.ROOT)
+
+
+def _quote(value):
+    return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def get_redirect_map_filename(status, root=None):
+    return os.path.join(root or settings.ROOT, 'redirects-%d.map' % status)
+
+
+def write_redirect_maps(root=None):
+    """Writes the cached redirects into one nginx map file per status
+
+    Returns the number of redirects written.
+
+    """
+    lines = dict((status, []) for status in REDIRECT_STATUSES)
+    root = root or settings.ROOT
+    for dirpath, dirnames, filenames in os.walk(os.path.join(root,
+                                                             'redirects')):
+        for name in filenames:
+            try:
+                with open(os.path.join(dirpath, name)) as entry:
+                    status, request_uri, location = parse_redirect(
+                        entry.read())
+            except (IOError, ValueError):
+                continue  # removed concurrently or incomplete
+            if status in lines:
+                lines[status].append('%s %s;\n' % (_quote(request_uri),
+                                                   _quote(location)))
+    for status, status_lines in lines.items():
+        filename = get_redirect_map_filename(status, root)
+        try:
+            f, tmpname = tempfile.mkstemp(dir=root)
+            os.write(f, ''.join(sorted(status_lines)))
+            os.close(f)
+            os.chmod(tmpname, 0644)
+            os.rename(tmpname, filename)
+        except Exception:
+            raise StaticGeneratorException('Could not write redirect map',
+                                           filename=filename)
+    return sum(len(status_lines) for status_lines in lines.values())
+
+
+_generators = {}
+_generators_lock = threading.Lock()
+
+
+def get_generator():
+    """Returns a process-wide generator for deleting entries
+
+    Constructing a generator looks up the server name, possibly in the
+    database, which isn't needed for deleting files.
+
+    """
+    from staticgenerator import StaticGenerator
+    key = (settings.ROOT, settings.STORAGE,
+           repr(sorted(settings.STORAGE_OPTIONS.items())))
+    with _generators_lock:
+        if key not in _generators:
+            _generators[key] = StaticGenerator()
+        return _generators[key]
+
+
+@receiver(post_save)
+def delete_entries_of_saved_instance(sender, instance, **kwargs):
+    """Deletes negative entries of the URL of a saved model instance"""
+    if not (settings.CACHE_NOT_FOUND or settings.CACHE_REDIRECTS):
+        return
+    get_absolute_url = getattr(instance, 'get_absolute_url', None)
+    if get_absolute_url is None:
+        return
+    try:
+        path = get_absolute_url()
+    except Exception:
+        return  # no URL for this instance
+    try:
+        get_generator().delete_negative_from_path(path)
+    except StaticGeneratorException:
+        logger.warning('Could not delete negative cache entries',
+                       exc_info=True, extra={'path': path})
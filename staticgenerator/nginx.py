@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""nginx configuration matching the staticgenerator settings
+
+Printed by the ``staticgenerator_nginx`` management command.  The output has
+an ``http`` block part and a ``server`` block part; the ``@generated``
+location expects an upstream called ``django``.
+
+"""
+import os
+
+from staticgenerator import settings
+from staticgenerator.headers import get_type_suffixes
+from staticgenerator.sharding import get_nginx_rules
+from staticgenerator.variants import get_nginx_maps
+
+
+GENERATED_LOCATION = '''location @generated {
+    root   %(root)s/fresh;
+    default_type  text/html;
+    ssi    on;
+%(types)s%(headers)s%(sharding)s
+    if ($cookie_%(bypass_cookie)s != "") {
+        proxy_pass http://django;
+        break;
+    }
+%(redirects)s
+    if (-f %(file)s/index.html%%3F$args$sg_variant) {
+        %(index_rewrite)s/index.html%%3F$args$sg_variant;
+        break;
+    }
+%(suffixes)s
+    if (!-f %(file)s%%3F$args$sg_variant) {
+        %(miss)s
+    }
+}'''
+
+# Cached files of other content types than HTML have the extension of the
+# type appended
+TYPES = '''    types {
+%s
+    }
+'''
+
+# Pages of other content types than HTML, in each sharded or unsharded
+# file name.  Only index pages have the %3F, other pages have the query
+# string appended directly, e.g. fresh/feed.json for /feed.
+SUFFIX = '''
+    if (-f %(file)s/index.html%%3F$args$sg_variant%(suffix)s) {
+        %(index_rewrite)s/index.html%%3F$args$sg_variant%(suffix)s;
+        break;
+    }
+    if (-f %(file)s$args$sg_variant%(suffix)s) {
+        %(plain_rewrite)s$args$sg_variant%(suffix)s;
+        break;
+    }
+'''
+
+HEADERS_MAPS = '''map $uri $sg_cache_control {
+    default "";
+    include %(root)s/cache-control.map;
+}
+map $uri $sg_etag {
+    default "";
+    include %(root)s/etag.map;
+}'''
+
+HEADERS = '''    etag   off;
+    add_header  Cache-Control $sg_cache_control;
+    add_header  ETag $sg_etag;
+'''
+
+MISS = '''proxy_pass http://django;
+        break;'''
+
+REDIRECTS_MAPS = '''map $request_uri $sg_redirect_301 {
+    default "";
+    include %(root)s/redirects-301.map;
+}
+map $request_uri $sg_redirect_302 {
+    default "";
+    include %(root)s/redirects-302.map;
+}'''
+
+REDIRECTS = '''
+    if ($sg_redirect_301) {
+        return 301 $sg_redirect_301;
+    }
+    if ($sg_redirect_302) {
+        return 302 $sg_redirect_302;
+    }
+'''
+
+# The body of a cached 404 response is served with the 404 status through
+# error_page, which keeps the original status.
+NEGATIVE_MISS = '''error_page 418 = @negative;
+        return 418;'''
+
+NEGATIVE_LOCATIONS = '''location @negative {
+    root   %(root)s/negative;
+    set $sg_negative $uri%%3F$args$sg_variant;
+    if ($uri ~ /$) {
+        set $sg_negative ${uri}index.html%%3F$args$sg_variant;
+    }
+    if (!-f $document_root$sg_negative) {
+        proxy_pass http://django;
+        break;
+    }
+    error_page 404 /__sg_negative$sg_negative;
+    return 404;
+}
+
+location /__sg_negative/ {
+    internal;
+    alias  %(root)s/negative/;
+    default_type  text/html;
+}'''
+
+
+def get_types():
+    """Returns the ``types`` block of the cached content types"""
+    types = {}
+    for content_type, suffix in sorted(settings.CONTENT_TYPES.items(),
+                                       reverse=True):
+        if suffix:
+            # The alphabetically first type of an extension is served
+            types[suffix[1:]] = content_type
+    if not types:
+        return ''
+    return TYPES % '\n'.join('        %s  %s;' % (content_type, extension)
+                              for extension, content_type
+                              in sorted(types.items()))
+
+
+def get_context():
+    context = {'root': os.path.abspath(settings.ROOT),
+               'bypass_cookie': settings.BYPASS_COOKIE,
+               'redirects': '',
+               'types': get_types(),
+               'headers': '',
+               'sharding': get_nginx_rules(),
+               'file': '$request_filename',
+               'index_rewrite': 'rewrite (.*)/ $1',
+               'plain_rewrite': 'rewrite (.*) $1',
+               'miss': MISS}
+    if settings.SHARDED_PREFIXES:
+        # The files are looked up at the sharded path set by the rules
+        context.update({'file': '$document_root$sg_base',
+                        'index_rewrite': 'rewrite ^ $sg_base',
+                        'plain_rewrite': 'rewrite ^ $sg_base'})
+    context['suffixes'] = ''.join(
+        SUFFIX % dict(context, suffix=suffix)
+        for suffix in get_type_suffixes())
+    if settings.HEADER_SIDECARS:
+        context['headers'] = HEADERS
+    if settings.CACHE_REDIRECTS:
+        context['redirects'] = REDIRECTS
+    if settings.CACHE_NOT_FOUND:
+        context['miss'] = NEGATIVE_MISS
+    return context
+
+
+def get_http_config():
+    """Returns the configuration for the ``http`` block"""
+    blocks = [get_nginx_maps()]
+    if settings.CACHE_REDIRECTS:
+        blocks.append(REDIRECTS_MAPS % get_context())
+    if settings.HEADER_SIDECARS:
+        blocks.append(HEADERS_MAPS % get_context())
+    return '\n'.join(blocks)
+
+
+def get_server_config():
+    """Returns the configuration for the ``server`` block"""
+    context = get_context()
+    blocks = [GENERATED_LOCATION % context]
+    if settings.CACHE_NOT_FOUND:
+        blocks.append(NEGATIVE_LOCATIONS % context)
+    return '\n\n'.join(blocks)
+
+
+def get_nginx_config():
+    return '\n'.join(['# In the http block:',
+                      get_http_config(),
+                      '',
+                      '# In the server block:',
+                      get_server_config(),
+                      ''])
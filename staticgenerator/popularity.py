@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""Popularity tracking of cached pages
+
+With ``STATIC_GENERATOR_POPULARITY_DB`` set, the middleware counts a sample
+(``STATIC_GENERATOR_POPULARITY_SAMPLE_RATE``) of the cacheable requests it
+sees: a miss if the page wasn't cached, a hit if it was.  Most hits are
+served by the front-end server and never reach Django, so
+:func:`ingest_log` also counts the requests of nginx access logs in the
+standard ``combined`` format.
+
+Paths are counted as the middleware sees them: the percent-decoded path
+followed by the raw query string, e.g. ``/café/?q=a%20b``.  The crawler
+renders the same form.
+
+The ``staticgenerator_popularity`` command ingests log files with
+:func:`ingest_file`, which remembers how far each file was counted, so
+ingesting a growing or rotated log again only counts the new requests.
+
+Counts are collected in memory and added to an SQLite table by a
+background thread every ``STATIC_GENERATOR_POPULARITY_FLUSH_INTERVAL``
+seconds, so requests never wait for the database.  Each path has a
+score which decays exponentially with a half-life of
+``STATIC_GENERATOR_POPULARITY_HALF_LIFE`` seconds, so recent requests weigh
+more than old ones.
+
+:func:`rebuild_popular` renders the most popular pages first, e.g. after a
+recursive invalidation; the ``warm_cache`` and ``recursive_delete``
+management commands use it with their ``--popular`` option.
+
+"""
+import atexit
+import calendar
+import hashlib
+import itertools
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import urllib
+
+from staticgenerator import settings
+
+
+logger = logging.getLogger('staticgenerator.popularity')
+
+SCHEMA = '''CREATE TABLE IF NOT EXISTS popularity (
+    path TEXT PRIMARY KEY,
+    score REAL NOT NULL,
+    updated REAL NOT NULL,
+    hits REAL NOT NULL,
+    misses REAL NOT NULL
+)'''
+
+LOGS_SCHEMA = '''CREATE TABLE IF NOT EXISTS ingested_logs (
+    log TEXT PRIMARY KEY,
+    position INTEGER NOT NULL
+)'''
+
+MONTHS = dict((month, number + 1) for number, month in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+     'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')))
+
+# $remote_addr - $remote_user [$time_local] "$request" $status
+# $body_bytes_sent "$http_referer" "$http_user_agent"
+COMBINED_RE = re.compile(
+    r'\S+ \S+ \S+ \[(?P<time>[^\]]+)\] '
+    r'"(?P<method>[A-Z]+) (?P<uri>\S+)[^"]*" (?P<status>\d{3}) ')
+
+TIME_RE = re.compile(r'(\d\d)/(\w{3})/(\d{4}):(\d\d):(\d\d):(\d\d) '
+                     r'([+-])(\d\d)(\d\d)')
+
+
+def parse_log_time(value):
+    """Returns the UNIX time of an nginx ``$time_local`` value"""
+    match = TIME_RE.match(value)
+    if not match:
+        raise ValueError('Invalid log time %r' % value)
+    (day, month, year, hour, minute, second,
+     sign, offset_hours, offset_minutes) = match.groups()
+    timestamp = calendar.timegm((int(year), MONTHS[month], int(day),
+                                 int(hour), int(minute), int(second)))
+    offset = int(offset_hours) * 3600 + int(offset_minutes) * 60
+    return timestamp - offset if sign == '+' else timestamp + offset
+
+
+def get_key(path, query_string=''):
+    """Returns the counted form of a decoded path and raw query string"""
+    if query_string:
+        return u'%s?%s' % (path, query_string)
+    return path
+
+
+def parse_log_line(line):
+    """Returns ``(key, time)`` of a successful GET or HEAD request in a
+    combined format log line, or ``None``
+
+    The key is the request URI with the path decoded, see :func:`get_key`.
+
+    """
+    match = COMBINED_RE.match(line)
+    if (not match
+            or match.group('method') not in ('GET', 'HEAD')
+            or match.group('status') not in ('200', '304')):
+        return None
+    path, _, query_string = match.group('uri').partition('?')
+    try:
+        path = urllib.unquote(path).decode('utf-8')
+        return (get_key(path, query_string.decode('ascii')),
+                parse_log_time(match.group('time')))
+    except (UnicodeDecodeError, ValueError, KeyError):
+        return None
+
+
+def decay(score, since, now, half_life):
+    return score * 0.5 ** ((now - since) / float(half_life))
+
+
+class PopularityTable(object):
+    """Decayed request counts per path, stored in an SQLite database"""
+
+    def __init__(self, filename, half_life=86400):
+        self.filename = filename
+        self.half_life = half_life
+
+    def connect(self):
+        connection = sqlite3.connect(self.filename, timeout=30)
+        connection.isolation_level = None
+        connection.execute(SCHEMA)
+        connection.execute(LOGS_SCHEMA)
+        half_life = self.half_life
+
+        def merge(score, updated, weight, now):
+            # Both scores are expressed at the later of the two times
+            latest = max(updated, now)
+            return (decay(score, updated, latest, half_life)
+                    + decay(weight, now, latest, half_life))
+
+        def current(score, updated, now):
+            return decay(score, updated, now, half_life)
+
+        connection.create_function('sg_merge', 4, merge)
+        connection.create_function('sg_current', 3, current)
+        return connection
+
+    def add(self, counts, now=None, position=None):
+        """Adds ``{path: (hits, misses)}`` counts observed at ``now``
+
+        ``position`` is a ``(log, offset)`` tuple of the ingested log file
+        stored in the same transaction, see :meth:`get_offset`.
+
+        """
+        now = time.time() if now is None else now
+        connection = self.connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            for path, (hits, misses) in counts.iteritems():
+                cursor = connection.execute(
+                    'UPDATE popularity SET '
+                    'score = sg_merge(score, updated, ?, ?), '
+                    'updated = max(updated, ?), '
+                    'hits = hits + ?, misses = misses + ? '
+                    'WHERE path = ?',
+                    (hits + misses, now, now, hits, misses, path))
+                if not cursor.rowcount:
+                    connection.execute(
+                        'INSERT INTO popularity VALUES (?, ?, ?, ?, ?)',
+                        (path, hits + misses, now, hits, misses))
+            if position is not None:
+                connection.execute(
+                    'INSERT OR REPLACE INTO ingested_logs VALUES (?, ?)',
+                    position)
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+
+    def get_offset(self, log):
+        """Returns the offset up to which a log file was ingested"""
+        connection = self.connect()
+        try:
+            row = connection.execute(
+                'SELECT position FROM ingested_logs WHERE log = ?',
+                (log,)).fetchone()
+        finally:
+            connection.close()
+        return row[0] if row else 0
+
+    def top(self, limit=None, fraction=None, prefix='', now=None):
+        """Returns ``(path, score)`` of the most popular paths
+
+        At most ``limit`` paths are returned, or ``fraction`` of the paths
+        starting with ``prefix``.
+
+        """
+        now = time.time() if now is None else now
+        connection = self.connect()
+        try:
+            condition = 'WHERE substr(path, 1, ?) = ?'
+            arguments = [len(prefix), prefix]
+            if fraction is not None:
+                count = connection.execute(
+                    'SELECT count(*) FROM popularity ' + condition,
+                    arguments).fetchone()[0]
+                fraction_limit = int(round(count * fraction)) or min(count, 1)
+                limit = (fraction_limit if limit is None
+                         else min(limit, fraction_limit))
+            return connection.execute(
+                'SELECT path, sg_current(score, updated, ?) AS current '
+                'FROM popularity %s ORDER BY current DESC, path LIMIT ?'
+                % condition,
+                [now] + arguments + [-1 if limit is None else limit]
+            ).fetchall()
+        finally:
+            connection.close()
+
+    def prune(self, min_score, now=None):
+        """Forgets paths whose score decayed below ``min_score``, returns
+        their number"""
+        now = time.time() if now is None else now
+        connection = self.connect()
+        try:
+            return connection.execute(
+                'DELETE FROM popularity WHERE sg_current(score, updated, ?) < ?',
+                (now, min_score)).rowcount
+        finally:
+            connection.close()
+
+
+def get_table():
+    """Returns the configured popularity table, or ``None``"""
+    if not settings.POPULARITY_DB:
+        return None
+    return PopularityTable(settings.POPULARITY_DB,
+                           settings.POPULARITY_HALF_LIFE)
+
+
+class Recorder(object):
+    """Collects counts in memory and adds them to the table periodically
+    in a background thread"""
+
+    def __init__(self):
+        self.counts = {}
+        self.lock = threading.Lock()
+        self.thread_pid = None
+
+    def record(self, path, hit, weight=1.0):
+        with self.lock:
+            counts = self.counts.setdefault(path, [0.0, 0.0])
+            counts[0 if hit else 1] += weight
+            # Threads don't survive a fork, so each process starts its own
+            if self.thread_pid != os.getpid():
+                self.thread_pid = os.getpid()
+                thread = threading.Thread(target=self.run,
+                                          name='staticgenerator popularity')
+                thread.daemon = True
+                thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(settings.POPULARITY_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                logger.warning('Could not flush popularity counts',
+                               exc_info=True)
+
+    def flush(self):
+        with self.lock:
+            counts, self.counts = self.counts, {}
+        table = get_table()
+        if not counts or table is None:
+            return
+        try:
+            table.add(counts)
+        except sqlite3.Error:
+            logger.warning('Could not record popularity of %d paths',
+                           len(counts), exc_info=True)
+
+
+recorder = Recorder()
+atexit.register(recorder.flush)
+
+
+def sampled():
+    """Decides whether to count the current request"""
+    return (bool(settings.POPULARITY_DB)
+            and random.random() < settings.POPULARITY_SAMPLE_RATE)
+
+
+def record(path, hit):
+    """Counts a sampled request, weighted by the inverse sample rate
+
+    ``path`` is in the form returned by :func:`get_key`.
+
+    """
+    recorder.record(path, hit, 1.0 / settings.POPULARITY_SAMPLE_RATE)
+
+
+def ingest_log(lines, table=None, is_cacheable=None, chunk_size=10000,
+               log=None, offset=0):
+    """Adds the requests of nginx ``combined`` format log lines to the
+    table
+
+    Only paths for which ``is_cacheable(path)`` is true are counted.  With
+    ``log`` the offset after the last complete line, starting from
+    ``offset``, is stored with the counts.  Returns the number of requests
+    counted.
+
+    """
+    table = table or get_table()
+    counted = 0
+    counts = {}
+    latest = None
+    events = []
+
+    def add_events():
+        counts.clear()
+        for request_uri, timestamp in events:
+            counts.setdefault(request_uri, [0.0, 0.0])[0] += decay(
+                1.0, timestamp, latest, table.half_life)
+        table.add(counts, now=latest,
+                  position=None if log is None else (log, offset))
+        del events[:]
+
+    for line in lines:
+        if log is not None:
+            if not line.endswith('\n'):
+                break  # still being written
+            offset += len(line)
+        parsed = parse_log_line(line)
+        if parsed is None:
+            continue
+        request_uri, timestamp = parsed
+        if is_cacheable and not is_cacheable(request_uri.split('?')[0]):
+            continue
+        events.append(parsed)
+        latest = timestamp if latest is None else max(latest, timestamp)
+        counted += 1
+        if len(events) >= chunk_size:
+            add_events()
+            latest = None
+    if events or log is not None:
+        add_events()
+    return counted
+
+
+def ingest_file(f, table=None, is_cacheable=None, chunk_size=10000):
+    """Adds the requests of an nginx log file to the table, skipping the
+    lines ingested before
+
+    The file is identified by the hash of its first line, so it's
+    recognized after being rotated or compressed too.  Returns the number
+    of requests counted.
+
+    """
+    table = table or get_table()
+    first = f.readline()
+    if not first.endswith('\n'):
+        return 0
+    log = hashlib.md5(first).hexdigest()
+    offset = table.get_offset(log)
+    if offset:
+        f.seek(offset)
+        lines = f
+    else:
+        lines = itertools.chain([first], f)
+    return ingest_log(lines, table, is_cacheable, chunk_size, log, offset)
+
+
+def rebuild_popular(prefix='/', fraction=None, limit=None, concurrency=1):
+    """Renders the most popular cacheable pages below ``prefix``
+
+    Returns the number of pages published.
+
+    """
+    from staticgenerator.crawler import Crawler
+    table = get_table()
+    if table is None:
+        return 0
+    if fraction is None and limit is None:
+        fraction = 0.01
+    paths = [path for path, score in table.top(limit, fraction, prefix)]
+    crawler = Crawler(paths, max_depth=0, concurrency=concurrency,
+                      max_visited=max(len(paths), 1000))
+    return crawler.crawl()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""Surrogate keys and purging of shared HTTP caches
+
+With ``STATIC_GENERATOR_SURROGATE_KEYS`` the middleware tags each cacheable
+response with the ``STATIC_GENERATOR_SURROGATE_KEY_HEADER`` header, which
+Varnish, Fastly (``Surrogate-Key``) or Cloudflare (``Cache-Tag``) use to
+purge groups of pages.  The keys of a page are:
+
+* ``path:<path>`` for the page itself, without its query string
+* ``tree:<prefix>`` for the directory prefix of the page and each of its
+  ancestors, e.g. ``tree:/``, ``tree:/blog/`` for ``/blog/post``
+* keys added by the view with :func:`add_surrogate_keys`, e.g.
+  ``model:blog.post`` and ``model:blog.post:42`` for a model instance
+
+When ``STATIC_GENERATOR_PURGE_PROXIES`` is set, :func:`quick_delete` purges
+the ``path`` and ``model`` keys of its resources and
+:func:`recursive_delete` the ``tree`` and ``model`` keys.  The keys of one
+call are sent to each proxy as ``STATIC_GENERATOR_PURGE_METHOD`` requests
+with up to ``STATIC_GENERATOR_PURGE_BATCH_SIZE`` keys in the key header.
+Use :func:`batch` to collect the keys of several calls::
+
+    from staticgenerator import purge, quick_delete
+
+    with purge.batch():
+        quick_delete(post)
+        quick_delete('/')
+
+The requests are sent by a background thread of each process, so saving or
+deleting a model doesn't wait for the proxies.  Call :func:`flush` to wait
+until the queued purges are sent, as the ``recursive_delete`` management
+command does.  Purges which fail are logged as warnings, the shared caches
+then serve the pages until they expire.
+
+"""
+import atexit
+from contextlib import contextmanager
+import hashlib
+import httplib
+import logging
+import os
+import Queue
+import socket
+import threading
+import urlparse
+
+from django.db.models import Model
+from django.db.models.base import ModelBase
+from django.db.models.manager import Manager
+from django.db.models.query import QuerySet
+from django.utils.http import urlquote
+
+from staticgenerator import settings
+
+
+logger = logging.getLogger('staticgenerator.purge')
+
+# Keys longer than this are replaced by a hash, proxies limit their length
+MAX_KEY_LENGTH = 256
+
+# Headers whose keys are separated by commas instead of spaces
+COMMA_SEPARATED_HEADERS = ('cache-tag',)
+
+
+def make_key(kind, value):
+    key = u'%s:%s' % (kind, value)
+    if len(key) > MAX_KEY_LENGTH:
+        key = u'%s:%s' % (kind, hashlib.md5(key.encode('utf-8')).hexdigest())
+    return key
+
+
+def get_path_keys(path):
+    """Returns the ``path`` key of a URL path"""
+    path = path.split('?', 1)[0] or u'/'
+    return [make_key('path', urlquote(path))]
+
+
+def get_tree_keys(path):
+    """Returns the ``tree`` keys of a URL path and its ancestors"""
+    path = urlquote(path.split('?', 1)[0])
+    prefix = path[:path.rfind('/') + 1] or u'/'
+    keys = []
+    end = 0
+    while end != -1:
+        keys.append(make_key('tree', prefix[:end + 1]))
+        end = prefix.find('/', end + 1)
+    return keys
+
+
+def get_page_keys(path):
+    """Returns the keys derived from the URL path of a page"""
+    return get_path_keys(path) + get_tree_keys(path)
+
+
+def get_model_label(model):
+    opts = model._meta
+    return u'%s.%s' % (opts.app_label, opts.model_name)
+
+
+def get_resource_keys(resource):
+    """Returns the ``model`` keys of a model instance, model, manager or
+    queryset, and no keys for other resources"""
+    if isinstance(resource, Model):
+        label = get_model_label(type(resource))
+        return [make_key('model', label),
+                make_key('model', u'%s:%s' % (label, resource.pk))]
+    if isinstance(resource, ModelBase):
+        return [make_key('model', get_model_label(resource))]
+    if isinstance(resource, (Manager, QuerySet)):
+        return [make_key('model', get_model_label(resource.model))]
+    return []
+
+
+def get_separator(header=None):
+    header = header or settings.SURROGATE_KEY_HEADER
+    return ',' if header.lower() in COMMA_SEPARATED_HEADERS else ' '
+
+
+def split_keys(value):
+    return value.replace(',', ' ').split()
+
+
+def unique(keys):
+    seen = set()
+    return [key for key in keys if not (key in seen or seen.add(key))]
+
+
+def add_surrogate_keys(response, *resources):
+    """Adds keys to the surrogate key header of a response
+
+    Resources are model instances, models, managers, querysets or key
+    strings.  Use it in views showing objects other than the one at the URL,
+    so deleting any of them purges the page::
+
+        response = render(request, 'blog/post.html', {'post': post})
+        add_surrogate_keys(response, post, post.author)
+
+    """
+    header = settings.SURROGATE_KEY_HEADER
+    keys = split_keys(response.get(header, ''))
+    for resource in resources:
+        if isinstance(resource, basestring):
+            keys.append(resource)
+        else:
+            keys.extend(get_resource_keys(resource))
+    response[header] = get_separator(header).join(unique(keys))
+    return response
+
+
+def get_delete_keys(resources, paths, recursive=False):
+    """Returns the keys to purge for deleting ``resources`` with the
+    extracted ``paths``"""
+    keys = []
+    for path in paths:
+        if recursive:
+            # The deleted directory is the last tree key of the path
+            keys.append(get_tree_keys(path)[-1])
+        else:
+            keys.extend(get_path_keys(path))
+    for resource in resources:
+        keys.extend(get_resource_keys(resource))
+    return unique(keys)
+
+
+class Purger(object):
+    """Sends purge requests for keys to proxies
+
+    Arguments:
+    * ``proxies``: URLs of the proxies, e.g. ``http://127.0.0.1:6081/``
+    * ``method``: request method, usually ``PURGE`` or ``BAN``
+    * ``header``: header carrying the keys
+    * ``batch_size``: maximum number of keys per request
+    * ``timeout``: socket timeout in seconds
+
+    """
+
+    def __init__(self, proxies, method='PURGE', header='Surrogate-Key',
+                 batch_size=100, timeout=2.0):
+        self.proxies = [urlparse.urlsplit(proxy) for proxy in proxies]
+        self.method = method
+        self.header = header
+        self.batch_size = max(1, batch_size)
+        self.timeout = timeout
+        self.local = threading.local()
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.thread_pid = None
+
+    def split(self, keys):
+        """Splits keys into the batches sent in one request each"""
+        return [keys[i:i + self.batch_size]
+                for i in range(0, len(keys), self.batch_size)]
+
+    def send(self, keys):
+        """Sends the keys to every proxy, returns the number of failed
+        requests"""
+        failed = 0
+        batches = self.split(unique(keys))
+        for proxy in self.proxies:
+            connection = None
+            try:
+                for batch in batches:
+                    if connection is None:
+                        connection = httplib.HTTPConnection(
+                            proxy.hostname, proxy.port, timeout=self.timeout)
+                    if not self._send_batch(connection, proxy, batch):
+                        failed += 1
+            except (httplib.HTTPException, socket.error):
+                failed += 1
+                logger.warning('Could not purge keys at %s', proxy.netloc,
+                               exc_info=True)
+            finally:
+                if connection is not None:
+                    connection.close()
+        return failed
+
+    def _send_batch(self, connection, proxy, keys):
+        separator = get_separator(self.header)
+        connection.request(self.method, proxy.path or '/', headers={
+            self.header: separator.join(keys).encode('utf-8'),
+            'Host': proxy.netloc})
+        response = connection.getresponse()
+        response.read()
+        if response.status >= 300:
+            logger.warning('Purge at %s failed with status %d',
+                           proxy.netloc, response.status)
+            return False
+        return True
+
+    def start(self):
+        with self.lock:
+            # Threads don't survive a fork, so each process starts its own
+            if self.thread_pid != os.getpid():
+                self.thread_pid = os.getpid()
+                thread = threading.Thread(target=self.run,
+                                          name='staticgenerator purge')
+                thread.daemon = True
+                thread.start()
+
+    def submit(self, keys):
+        """Queues keys for the background thread"""
+        self.queue.put(keys)
+        self.start()
+
+    def run(self):
+        while True:
+            submitted = [self.queue.get()]
+            # Keys queued while the last purge was sent go out together
+            while True:
+                try:
+                    submitted.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            try:
+                self.send([key for keys in submitted for key in keys])
+            except Exception:
+                logger.warning('Could not purge keys', exc_info=True)
+            finally:
+                for keys in submitted:
+                    self.queue.task_done()
+
+    def flush(self):
+        """Waits until the queued keys are sent"""
+        self.start()
+        self.queue.join()
+
+    def add(self, keys):
+        """Queues keys for sending, or collects them inside a batch"""
+        if not keys:
+            return
+        pending = getattr(self.local, 'pending', None)
+        if pending is not None:
+            pending.extend(keys)
+        else:
+            self.submit(keys)
+
+    @contextmanager
+    def batch(self):
+        outermost = getattr(self.local, 'pending', None) is None
+        if outermost:
+            self.local.pending = []
+        try:
+            yield
+        finally:
+            if outermost:
+                keys, self.local.pending = self.local.pending, None
+                if keys:
+                    self.submit(keys)
+
+
+_purgers = {}
+_purgers_lock = threading.Lock()
+
+
+def get_purger():
+    """Returns the process-wide purger, or ``None`` if no proxies are set"""
+    key = (tuple(settings.PURGE_PROXIES), settings.PURGE_METHOD,
+           settings.SURROGATE_KEY_HEADER, settings.PURGE_BATCH_SIZE,
+           settings.PURGE_TIMEOUT)
+    if not key[0]:
+        return None
+    with _purgers_lock:
+        if key not in _purgers:
+            _purgers[key] = Purger(*key)
+        return _purgers[key]
+
+
+def purge(keys):
+    """Purges keys from the proxies if any are set"""
+    purger = get_purger()
+    if purger is not None:
+        purger.add(keys)
+
+
+def flush():
+    """Waits until the purges queued in this process are sent"""
+    with _purgers_lock:
+        purgers = _purgers.values()
+    for purger in purgers:
+        purger.flush()
+
+
+atexit.register(flush)
+
+
+@contextmanager
+def batch():
+    """Collects the purges within the block into as few requests as
+    possible"""
+    purger = get_purger()
+    if purger is None:
+        yield
+    else:
+        with purger.batch():
+            yield
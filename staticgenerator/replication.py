@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""Push replication of published files to other document roots
+
+Instead of rendering each page on every node, a page can be rendered once
+and pushed to the other nodes.  Each target in
+``STATIC_GENERATOR_REPLICA_ROOTS`` is either a local directory (another disk
+or an NFS mount) or a ``push://host:port`` address of a node running the
+``staticgenerator_receive`` management command.
+
+Every file written by :class:`StaticGenerator` is queued for each target,
+together with the name of its stale hard link.  A writer thread per target
+drains its queue in batches; push targets pipeline a batch over one
+connection before reading the acknowledgements.  Targets write each file
+with the same temporary file and rename steps as the local cache.
+
+Deletes are not replicated; use the invalidation fan-out in
+``staticgenerator.fanout`` for those.
+
+The push protocol sends for each file a JSON header line with the
+``fresh`` and ``stale`` names relative to the root and the content ``size``,
+followed by the content.  The receiver answers each file with ``OK`` or
+``ERR <message>`` on its own line.
+
+With ``STATIC_GENERATOR_REPLICATION_SECRET`` each header carries an
+``hmac`` of the names, size, signing ``time``, a random ``nonce`` and the
+content, and receivers reject files without a valid one.  Receivers also
+reject files signed more than ``STATIC_GENERATOR_REPLICATION_MAX_AGE``
+seconds ago and nonces they have seen, so recorded pushes can't be
+replayed.  Without a secret the receiver only listens on the loopback
+interface.
+
+Receivers reject files larger than ``STATIC_GENERATOR_REPLICATION_MAX_SIZE``
+before reading them.
+
+"""
+import atexit
+from collections import deque
+import hashlib
+import hmac
+import json
+import logging
+import os
+import Queue
+import socket
+import SocketServer
+import threading
+import time
+
+from staticgenerator import settings
+from staticgenerator.exceptions import StaticGeneratorException
+from staticgenerator.utils import parse_address
+
+
+logger = logging.getLogger('staticgenerator.replication')
+
+LOOPBACK_HOSTS = ('127.0.0.1', '::1', 'localhost')
+
+
+def sign_item(secret, fresh, stale, content, timestamp, nonce):
+    """Returns the HMAC of a pushed file"""
+    message = '%s\n%s' % (
+        json.dumps([fresh, stale, len(content), timestamp, nonce]), content)
+    return hmac.new(secret, message, hashlib.sha256).hexdigest()
+
+
+def apply_item(root, fresh, stale, content):
+    """Writes one replicated file under ``root``"""
+    from staticgenerator.storage import hardlink, write_file
+    if isinstance(fresh, unicode):
+        fresh = fresh.encode('utf-8')
+    if isinstance(stale, unicode):
+        stale = stale.encode('utf-8')
+    for name in (fresh, stale):
+        if name is not None and (os.path.isabs(name)
+                                 or '..' in name.split(os.sep)):
+            raise StaticGeneratorException('Invalid replicated file name',
+                                           name=name)
+    fresh_filename = os.path.join(root, fresh)
+    if write_file(fresh_filename, content) and stale is not None:
+        hardlink(fresh_filename, os.path.join(root, stale),
+                 remove_dst=True, ignore_dst=True)
+
+
+class FilesystemTarget(object):
+    """Replicates into another local directory"""
+
+    def __init__(self, root):
+        self.root = root
+        self.name = root
+
+    def write(self, items):
+        for fresh, stale, content in items:
+            apply_item(self.root, fresh, stale, content)
+
+    def close(self):
+        pass
+
+
+class PushTarget(object):
+    """Pushes files to a ``staticgenerator_receive`` process"""
+
+    def __init__(self, host, port, timeout=10, secret=None):
+        self.address = (host, port)
+        self.name = 'push://%s:%d' % self.address
+        self.timeout = timeout
+        self.secret = secret
+        self.sock = None
+        self.reader = None
+
+    def connect(self):
+        if self.sock is None:
+            self.sock = socket.create_connection(self.address, self.timeout)
+            self.reader = self.sock.makefile('rb')
+
+    def close(self):
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
+        self.sock = self.reader = None
+
+    def write(self, items):
+        frames = []
+        for fresh, stale, content in items:
+            header = {'fresh': fresh, 'stale': stale, 'size': len(content)}
+            if self.secret:
+                header['time'] = int(time.time())
+                header['nonce'] = os.urandom(16).encode('hex')
+                header['hmac'] = sign_item(self.secret, fresh, stale, content,
+                                           header['time'], header['nonce'])
+            frames.append(json.dumps(header))
+            frames.append('\n')
+            frames.append(content)
+        try:
+            self.connect()
+            self.sock.sendall(''.join(frames))
+            errors = []
+            for fresh, stale, content in items:
+                reply = self.reader.readline()
+                if not reply:
+                    raise socket.error('Connection closed by receiver')
+                if not reply.startswith('OK'):
+                    errors.append((fresh, reply.strip()))
+        except socket.error:
+            self.close()
+            raise
+        if errors:
+            raise StaticGeneratorException('Receiver could not write files',
+                                           errors=errors)
+
+
+def get_target(target):
+    """Returns the target object of a ``STATIC_GENERATOR_REPLICA_ROOTS``
+    entry"""
+    if target.startswith('push://'):
+        host, port = parse_address(target[len('push://'):])
+        return PushTarget(host, port, secret=settings.REPLICATION_SECRET)
+    return FilesystemTarget(target)
+
+
+class TargetWriter(object):
+    """Drains the queue of one target in a background thread"""
+
+    def __init__(self, target, queue_size=10000, batch_size=100):
+        self.target = target
+        self.queue = Queue.Queue(queue_size)
+        self.batch_size = batch_size
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_error = None
+        self.last_success = None
+        self.oldest_pending = None
+        self.thread = threading.Thread(target=self.run,
+                                       name='replication %s' % target.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait((time.time(), item))
+        except Queue.Full:
+            self.dropped += 1
+            logger.warning('Replication queue of %s full, dropping %s',
+                           self.target.name, item[0])
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            self.oldest_pending = batch[0][0]
+            try:
+                self.target.write([item for queued, item in batch])
+            except Exception as exc:
+                self.failed += len(batch)
+                self.last_error = repr(exc)
+                logger.warning('Could not replicate %d files to %s',
+                               len(batch), self.target.name, exc_info=True)
+            else:
+                self.written += len(batch)
+                self.last_success = time.time()
+            finally:
+                self.oldest_pending = None
+                for _ in batch:
+                    self.queue.task_done()
+
+    def stats(self):
+        """Returns counters and the lag in seconds of the oldest pending
+        file"""
+        oldest = self.oldest_pending
+        if oldest is None:
+            try:
+                oldest = self.queue.queue[0][0]
+            except IndexError:
+                pass
+        return {'queued': self.queue.qsize(),
+                'written': self.written,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'last_error': self.last_error,
+                'last_success': self.last_success,
+                'lag': time.time() - oldest if oldest else 0.0}
+
+    def flush(self, timeout=None):
+        """Waits until the queue is empty, or ``timeout`` seconds"""
+        deadline = None if timeout is None else time.time() + timeout
+        while self.queue.unfinished_tasks:
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+
+class Replicator(object):
+    """Queues published files for each replication target"""
+
+    def __init__(self, targets, queue_size=10000, batch_size=100):
+        self.writers = [TargetWriter(get_target(target)
+                                     if isinstance(target, basestring)
+                                     else target,
+                                     queue_size, batch_size)
+                        for target in targets]
+
+    def replicate(self, fresh, stale, content):
+        """Queues a file for all targets
+
+        ``fresh`` and ``stale`` are names relative to the cache root.
+
+        """
+        for writer in self.writers:
+            writer.put((fresh, stale, content))
+
+    def stats(self):
+        return dict((writer.target.name, writer.stats())
+                    for writer in self.writers)
+
+    def flush(self, timeout=None):
+        return all([writer.flush(timeout) for writer in self.writers])
+
+
+_replicators = {}
+_replicators_lock = threading.Lock()
+
+
+def get_replicator():
+    """Returns the process-wide replicator, or ``None`` if not configured"""
+    key = tuple(settings.REPLICA_ROOTS)
+    if not key:
+        return None
+    with _replicators_lock:
+        if key not in _replicators:
+            _replicators[key] = Replicator(
+                key, settings.REPLICATION_QUEUE_SIZE,
+                settings.REPLICATION_BATCH_SIZE)
+        return _replicators[key]
+
+
+def replicate(root, fresh_filename, stale_filename, content):
+    """Queues a published file for the configured targets"""
+    replicator = get_replicator()
+    if replicator is None:
+        return
+    replicator.replicate(
+        os.path.relpath(fresh_filename, root),
+        stale_filename and os.path.relpath(stale_filename, root),
+        content)
+
+
+@atexit.register
+def _flush_on_exit():
+    for replicator in _replicators.values():
+        replicator.flush(timeout=settings.REPLICATION_EXIT_TIMEOUT)
+
+
+class ReceiverHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        while True:
+            header = self.rfile.readline()
+            if not header:
+                return
+            try:
+                item = json.loads(header)
+                size = int(item['size'])
+            except (ValueError, KeyError, TypeError):
+                size = -1
+            if size < 0:
+                self.wfile.write('ERR invalid header\n')
+                return
+            if size > self.server.max_size:
+                # The content isn't read, so the connection can't be reused
+                logger.warning('Rejected replicated file of %d bytes from %s',
+                               size, self.client_address[0])
+                self.wfile.write('ERR too large\n')
+                return
+            content = self.rfile.read(size)
+            if len(content) != size:
+                # The sender's connection dropped within the content
+                self.wfile.write('ERR short read\n')
+                return
+            if not self.check_signature(item, content):
+                logger.warning('Rejected replicated file with invalid '
+                               'signature from %s', self.client_address[0])
+                self.wfile.write('ERR invalid signature\n')
+                continue
+            if not self.check_replay(item):
+                logger.warning('Rejected expired or replayed file from %s',
+                               self.client_address[0])
+                self.wfile.write('ERR expired or replayed\n')
+                continue
+            try:
+                apply_item(self.server.root, item['fresh'], item.get('stale'),
+                           content)
+            except StaticGeneratorException as exc:
+                logger.warning('Could not write replicated file',
+                               exc_info=True)
+                self.wfile.write('ERR %s\n' % exc)
+            else:
+                self.wfile.write('OK\n')
+
+    def check_signature(self, item, content):
+        secret = self.server.secret
+        if not secret:
+            return True
+        signature = item.get('hmac')
+        if not isinstance(signature, basestring):
+            return False
+        expected = sign_item(secret, item['fresh'], item.get('stale'),
+                             content, item.get('time'), item.get('nonce'))
+        return hmac.compare_digest(expected, signature.encode('ascii',
+                                                              'replace'))
+
+    def check_replay(self, item):
+        """Returns ``False`` for signed files signed too long ago or
+        received before"""
+        if not self.server.secret:
+            return True
+        timestamp = item.get('time')
+        if not isinstance(timestamp, (int, long)):
+            return False
+        if abs(time.time() - timestamp) > self.server.max_age:
+            return False
+        return self.server.add_nonce(item.get('nonce'), timestamp)
+
+
+class Receiver(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """Receives pushed files into ``root``
+
+    Files are only accepted with a valid HMAC of ``secret``, signed at
+    most ``max_age`` seconds ago and with a nonce not seen before.  Without
+    a secret anyone reaching the port can write pages into the cache, so
+    only loopback addresses are allowed.  Files larger than ``max_size``
+    bytes are rejected.
+
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, root, secret=None, max_size=None,
+                 max_age=None):
+        if not secret and address[0] not in LOOPBACK_HOSTS:
+            raise StaticGeneratorException(
+                'Receiving on a public address requires '
+                'STATIC_GENERATOR_REPLICATION_SECRET', address=address[0])
+        SocketServer.TCPServer.__init__(self, address, ReceiverHandler)
+        self.root = root
+        self.secret = secret
+        self.max_size = (settings.REPLICATION_MAX_SIZE if max_size is None
+                         else max_size)
+        self.max_age = (settings.REPLICATION_MAX_AGE if max_age is None
+                        else max_age)
+        self.nonces = set()
+        self.nonce_times = deque()
+        self.nonces_lock = threading.Lock()
+
+    def add_nonce(self, nonce, timestamp):
+        """Records the nonce of a file, returns ``False`` if it was seen
+        already
+
+        Nonces are forgotten once their files would be rejected as expired.
+
+        """
+        if not isinstance(nonce, basestring):
+            return False
+        expired = time.time() - self.max_age
+        with self.nonces_lock:
+            while self.nonce_times and self.nonce_times[0][0] < expired:
+                self.nonces.discard(self.nonce_times.popleft()[1])
+            if nonce in self.nonces:
+                return False
+            self.nonces.add(nonce)
+            self.nonce_times.append((timestamp, nonce))
+        return True
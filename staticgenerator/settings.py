@@ -58,6 +58,336 @@ def load_settings():
     # Default: []
     g['EXCLUDE_URLS'] = getattr(settings, 'STATIC_GENERATOR_EXCLUDE_URLS', [])
 
+    # STATIC_GENERATOR_FRAGMENT_PREFIX
+    # URL prefix under which cached fragments are published and served.
+    # Include staticgenerator.urls in your URLconf at this prefix.
+    # Default: "/_sgfragments/"
+    g['FRAGMENT_PREFIX'] = getattr(
+        settings, 'STATIC_GENERATOR_FRAGMENT_PREFIX', '/_sgfragments/'
+    )
+
+    # STATIC_GENERATOR_FRAGMENT_TEMPLATE_DIR
+    # Template directory of fragments rendered with {% staticfragment %}.
+    # Only templates in this directory can be rendered as fragments.
+    # Default: "fragments/"
+    g['FRAGMENT_TEMPLATE_DIR'] = getattr(
+        settings, 'STATIC_GENERATOR_FRAGMENT_TEMPLATE_DIR', 'fragments/'
+    )
+
+    # STATIC_GENERATOR_VARIANTS
+    # Callables (or their dotted paths) which take the request and return a
+    # cache file name suffix.  Built-in variants are
+    # staticgenerator.variants.ajax, .language and .mobile.
+    # Default: ['staticgenerator.variants.ajax']
+    g['VARIANTS'] = getattr(
+        settings, 'STATIC_GENERATOR_VARIANTS',
+        ['staticgenerator.variants.ajax']
+    )
+
+    # STATIC_GENERATOR_MOBILE_USER_AGENTS
+    # Regular expression matching User-Agents of the mobile variant.  Used
+    # both in Python and in the generated nginx configuration.
+    g['MOBILE_USER_AGENTS'] = getattr(
+        settings, 'STATIC_GENERATOR_MOBILE_USER_AGENTS',
+        r'Mobile|Android|iPhone|iPod|BlackBerry|Opera Mini|IEMobile'
+    )
+
+    # STATIC_GENERATOR_CACHE_NOT_FOUND
+    # Cache the bodies of 404 responses in a separate "negative" tree
+    # Default: False
+    g['CACHE_NOT_FOUND'] = getattr(
+        settings, 'STATIC_GENERATOR_CACHE_NOT_FOUND', False
+    )
+
+    # STATIC_GENERATOR_CACHE_REDIRECTS
+    # Cache 301 and 302 redirects for generated nginx map files
+    # Default: False
+    g['CACHE_REDIRECTS'] = getattr(
+        settings, 'STATIC_GENERATOR_CACHE_REDIRECTS', False
+    )
+
+    # STATIC_GENERATOR_NEGATIVE_TTL
+    # Seconds after which cached 404 responses and redirects are pruned
+    # Default: 300
+    g['NEGATIVE_TTL'] = getattr(settings, 'STATIC_GENERATOR_NEGATIVE_TTL', 300)
+
+    # STATIC_GENERATOR_NEGATIVE_MAX_ENTRIES
+    # Maximum number of cached 404 responses and redirects
+    # Default: 10000
+    g['NEGATIVE_MAX_ENTRIES'] = getattr(
+        settings, 'STATIC_GENERATOR_NEGATIVE_MAX_ENTRIES', 10000
+    )
+
+    # STATIC_GENERATOR_NEGATIVE_PRUNE_INTERVAL
+    # Prune the negative entries every this many writes in each process
+    # Default: 100
+    g['NEGATIVE_PRUNE_INTERVAL'] = getattr(
+        settings, 'STATIC_GENERATOR_NEGATIVE_PRUNE_INTERVAL', 100
+    )
+
+    # STATIC_GENERATOR_DEDUPE
+    # Store identical content only once in a content-addressed "blobs" tree
+    # and hard link the cached files to the blobs
+    # Default: False
+    g['DEDUPE'] = getattr(settings, 'STATIC_GENERATOR_DEDUPE', False)
+
+    # STATIC_GENERATOR_CONTENT_TYPES
+    # Content types of cached non-HTML responses and the extensions appended
+    # to their file names.  Responses of other types aren't cached.
+    # Default: JSON, XML, RSS, Atom, plain text, CSS and JavaScript
+    g['CONTENT_TYPES'] = getattr(settings, 'STATIC_GENERATOR_CONTENT_TYPES', {
+        'application/json': '.json',
+        'application/xml': '.xml',
+        'text/xml': '.xml',
+        'application/rss+xml': '.rss',
+        'application/atom+xml': '.atom',
+        'text/plain': '.txt',
+        'text/css': '.css',
+        'application/javascript': '.js',
+        'text/javascript': '.js',
+    })
+
+    # STATIC_GENERATOR_HEADER_SIDECARS
+    # Write the content type, Cache-Control header and ETag of each cached
+    # page into a .sgmeta sidecar file
+    # Default: False
+    g['HEADER_SIDECARS'] = getattr(
+        settings, 'STATIC_GENERATOR_HEADER_SIDECARS', False
+    )
+
+    # STATIC_GENERATOR_SHARDED_PREFIXES
+    # URL prefixes below which the next path segment is placed into shard
+    # directories named after its hash, e.g. ['/articles/']
+    # Default: []
+    g['SHARDED_PREFIXES'] = getattr(
+        settings, 'STATIC_GENERATOR_SHARDED_PREFIXES', []
+    )
+
+    # STATIC_GENERATOR_SHARD_LEVELS
+    # Number of shard directory levels, each with up to 256 directories
+    # Default: 2
+    g['SHARD_LEVELS'] = getattr(settings, 'STATIC_GENERATOR_SHARD_LEVELS', 2)
+
+    # STATIC_GENERATOR_STORAGE
+    # Storage backend class (or its dotted path) of the cached files, e.g.
+    # "staticgenerator.storage.MemcachedStorage"
+    # Default: "staticgenerator.storage.FilesystemStorage"
+    g['STORAGE'] = getattr(settings, 'STATIC_GENERATOR_STORAGE',
+                           'staticgenerator.storage.FilesystemStorage')
+
+    # STATIC_GENERATOR_STORAGE_OPTIONS
+    # Keyword arguments for the storage backend class
+    # Default: {}
+    g['STORAGE_OPTIONS'] = getattr(
+        settings, 'STATIC_GENERATOR_STORAGE_OPTIONS', {}
+    )
+
+    # STATIC_GENERATOR_WSGI_FILE_CACHE_SIZE
+    # Number of cached files staticgenerator.wsgi keeps open
+    # Default: 64
+    g['WSGI_FILE_CACHE_SIZE'] = getattr(
+        settings, 'STATIC_GENERATOR_WSGI_FILE_CACHE_SIZE', 64
+    )
+
+    # STATIC_GENERATOR_WSGI_INCLUDES
+    # Whether staticgenerator.wsgi assembles the SSI includes of cached
+    # fragments into HTML pages.  Disable it only if a server in front
+    # processes the SSI directives.
+    # Default: True
+    g['WSGI_INCLUDES'] = getattr(
+        settings, 'STATIC_GENERATOR_WSGI_INCLUDES', True
+    )
+
+    # STATIC_GENERATOR_SURROGATE_KEYS
+    # Whether the middleware tags cacheable responses with surrogate keys
+    # for shared HTTP caches
+    # Default: False
+    g['SURROGATE_KEYS'] = getattr(
+        settings, 'STATIC_GENERATOR_SURROGATE_KEYS', False
+    )
+
+    # STATIC_GENERATOR_SURROGATE_KEY_HEADER
+    # Header carrying the surrogate keys, e.g. 'Cache-Tag' for Cloudflare
+    # Default: 'Surrogate-Key'
+    g['SURROGATE_KEY_HEADER'] = getattr(
+        settings, 'STATIC_GENERATOR_SURROGATE_KEY_HEADER', 'Surrogate-Key'
+    )
+
+    # STATIC_GENERATOR_PURGE_PROXIES
+    # URLs of the shared HTTP caches quick_delete and recursive_delete send
+    # purge requests to, e.g. ['http://127.0.0.1:6081/']
+    # Default: []
+    g['PURGE_PROXIES'] = getattr(settings, 'STATIC_GENERATOR_PURGE_PROXIES',
+                                 [])
+
+    # STATIC_GENERATOR_PURGE_METHOD
+    # Method of the purge requests, e.g. 'PURGE' or 'BAN'
+    # Default: 'PURGE'
+    g['PURGE_METHOD'] = getattr(settings, 'STATIC_GENERATOR_PURGE_METHOD',
+                                'PURGE')
+
+    # STATIC_GENERATOR_PURGE_BATCH_SIZE
+    # Maximum number of surrogate keys sent in one purge request
+    # Default: 100
+    g['PURGE_BATCH_SIZE'] = getattr(
+        settings, 'STATIC_GENERATOR_PURGE_BATCH_SIZE', 100
+    )
+
+    # STATIC_GENERATOR_PURGE_TIMEOUT
+    # Socket timeout of purge requests in seconds
+    # Default: 2.0
+    g['PURGE_TIMEOUT'] = getattr(settings, 'STATIC_GENERATOR_PURGE_TIMEOUT',
+                                 2.0)
+
+    # STATIC_GENERATOR_FILTERS
+    # Output filter classes (or their dotted paths) applied to content before
+    # it is written, e.g. 'staticgenerator.filters.HTMLMinifyFilter'
+    # Default: []
+    g['FILTERS'] = getattr(settings, 'STATIC_GENERATOR_FILTERS', [])
+
+    # STATIC_GENERATOR_POPULARITY_DB
+    # SQLite database file of the popularity table, enables popularity
+    # tracking in the middleware
+    # Default: None
+    g['POPULARITY_DB'] = getattr(settings, 'STATIC_GENERATOR_POPULARITY_DB',
+                                 None)
+
+    # STATIC_GENERATOR_POPULARITY_SAMPLE_RATE
+    # Fraction of the cacheable requests counted by the middleware
+    # Default: 0.01
+    g['POPULARITY_SAMPLE_RATE'] = getattr(
+        settings, 'STATIC_GENERATOR_POPULARITY_SAMPLE_RATE', 0.01
+    )
+
+    # STATIC_GENERATOR_POPULARITY_HALF_LIFE
+    # Seconds after which the weight of a counted request is halved
+    # Default: 86400
+    g['POPULARITY_HALF_LIFE'] = getattr(
+        settings, 'STATIC_GENERATOR_POPULARITY_HALF_LIFE', 86400
+    )
+
+    # STATIC_GENERATOR_POPULARITY_FLUSH_INTERVAL
+    # Seconds between writes of the counts of each process to the database
+    # Default: 10
+    g['POPULARITY_FLUSH_INTERVAL'] = getattr(
+        settings, 'STATIC_GENERATOR_POPULARITY_FLUSH_INTERVAL', 10
+    )
+
+    # STATIC_GENERATOR_ASYNC_WRITES
+    # Write the cached files of the middleware in a background thread
+    # Default: False
+    g['ASYNC_WRITES'] = getattr(settings, 'STATIC_GENERATOR_ASYNC_WRITES',
+                                False)
+
+    # STATIC_GENERATOR_ASYNC_QUEUE_SIZE
+    # Maximum number of queued writes in each process
+    # Default: 1000
+    g['ASYNC_QUEUE_SIZE'] = getattr(
+        settings, 'STATIC_GENERATOR_ASYNC_QUEUE_SIZE', 1000
+    )
+
+    # STATIC_GENERATOR_ASYNC_FULL_POLICY
+    # What to do with writes when the queue is full: 'drop' or 'block'
+    # Default: 'drop'
+    g['ASYNC_FULL_POLICY'] = getattr(
+        settings, 'STATIC_GENERATOR_ASYNC_FULL_POLICY', 'drop'
+    )
+
+    # STATIC_GENERATOR_ASYNC_BLOCK_TIMEOUT
+    # Seconds to wait for room in a full queue with the 'block' policy
+    # before dropping the write, or None to wait indefinitely
+    # Default: 1.0
+    g['ASYNC_BLOCK_TIMEOUT'] = getattr(
+        settings, 'STATIC_GENERATOR_ASYNC_BLOCK_TIMEOUT', 1.0
+    )
+
+    # STATIC_GENERATOR_ASYNC_EXIT_TIMEOUT
+    # Seconds to wait at exit for the queued writes
+    # Default: 10
+    g['ASYNC_EXIT_TIMEOUT'] = getattr(
+        settings, 'STATIC_GENERATOR_ASYNC_EXIT_TIMEOUT', 10
+    )
+
+    # STATIC_GENERATOR_INVALIDATION_TRANSPORT
+    # Transport class (or its dotted path) used to broadcast invalidations to
+    # other nodes, e.g. "staticgenerator.fanout.UDPTransport" or
+    # "staticgenerator.fanout.SpoolTransport"
+    # Default: None
+    g['INVALIDATION_TRANSPORT'] = getattr(
+        settings, 'STATIC_GENERATOR_INVALIDATION_TRANSPORT', None
+    )
+
+    # STATIC_GENERATOR_INVALIDATION_OPTIONS
+    # Keyword arguments for the transport class
+    # Default: {}
+    g['INVALIDATION_OPTIONS'] = getattr(
+        settings, 'STATIC_GENERATOR_INVALIDATION_OPTIONS', {}
+    )
+
+    # STATIC_GENERATOR_INVALIDATION_ON_GAP
+    # What listeners do when they detect missed messages: "warn" only logs a
+    # warning, "flush" also invalidates the whole local cache
+    # Default: "warn"
+    g['INVALIDATION_ON_GAP'] = getattr(
+        settings, 'STATIC_GENERATOR_INVALIDATION_ON_GAP', 'warn'
+    )
+
+    # STATIC_GENERATOR_NODE_NAME
+    # Name of this node in invalidation messages.  Nodes sharing a name
+    # share a cache and ignore each other's messages.
+    # Default: the host name
+    g['NODE_NAME'] = getattr(settings, 'STATIC_GENERATOR_NODE_NAME', None)
+
+    # STATIC_GENERATOR_REPLICA_ROOTS
+    # Targets each published file is replicated to: local directories or
+    # "push://host:port" addresses of staticgenerator_receive processes
+    # Default: []
+    g['REPLICA_ROOTS'] = getattr(settings, 'STATIC_GENERATOR_REPLICA_ROOTS', [])
+
+    # STATIC_GENERATOR_REPLICATION_QUEUE_SIZE
+    # Maximum number of files queued per target before dropping files
+    # Default: 10000
+    g['REPLICATION_QUEUE_SIZE'] = getattr(
+        settings, 'STATIC_GENERATOR_REPLICATION_QUEUE_SIZE', 10000
+    )
+
+    # STATIC_GENERATOR_REPLICATION_BATCH_SIZE
+    # Maximum number of files written to a target in one batch
+    # Default: 100
+    g['REPLICATION_BATCH_SIZE'] = getattr(
+        settings, 'STATIC_GENERATOR_REPLICATION_BATCH_SIZE', 100
+    )
+
+    # STATIC_GENERATOR_REPLICATION_SECRET
+    # Shared secret signing pushed files, required by receivers listening
+    # on other than loopback addresses
+    # Default: None
+    g['REPLICATION_SECRET'] = getattr(
+        settings, 'STATIC_GENERATOR_REPLICATION_SECRET', None
+    )
+
+    # STATIC_GENERATOR_REPLICATION_MAX_SIZE
+    # Largest pushed file in bytes a receiver accepts
+    # Default: 67108864 (64 MB)
+    g['REPLICATION_MAX_SIZE'] = getattr(
+        settings, 'STATIC_GENERATOR_REPLICATION_MAX_SIZE', 64 * 1024 * 1024
+    )
+
+    # STATIC_GENERATOR_REPLICATION_MAX_AGE
+    # Seconds after signing within which a receiver accepts a signed file.
+    # Bounds the clock difference between the nodes too.
+    # Default: 300
+    g['REPLICATION_MAX_AGE'] = getattr(
+        settings, 'STATIC_GENERATOR_REPLICATION_MAX_AGE', 300
+    )
+
+    # STATIC_GENERATOR_REPLICATION_EXIT_TIMEOUT
+    # Seconds to wait for the replication queues to drain on exit
+    # Default: 10
+    g['REPLICATION_EXIT_TIMEOUT'] = getattr(
+        settings, 'STATIC_GENERATOR_REPLICATION_EXIT_TIMEOUT', 10
+    )
+
 load_settings()
 
 @receiver(setting_changed)
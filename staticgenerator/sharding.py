@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""Sharded directory layout below URL prefixes with many children
+
+A URL space like ``/articles/<slug>/`` puts one directory per article into
+``fresh/articles``.  For each prefix in
+``STATIC_GENERATOR_SHARDED_PREFIXES`` the path segment following the prefix
+is placed below ``STATIC_GENERATOR_SHARD_LEVELS`` levels of directories
+named after the MD5 hash of the segment::
+
+    /articles/hello-world/  ->  fresh/articles/~5d/~41/hello-world/
+
+Sharding applies to the ``fresh`` and ``stale`` trees.  The ``negative`` and
+``redirects`` trees are bounded by ``STATIC_GENERATOR_NEGATIVE_MAX_ENTRIES``
+and aren't sharded.  The nginx configuration printed by the
+``staticgenerator_nginx`` command computes the same directories with the
+``set_md5`` directive of the set-misc module.  The
+``staticgenerator_reshard`` command moves the files of an existing tree into
+their shards.
+
+"""
+import hashlib
+import logging
+import os
+import re
+import shutil
+
+from staticgenerator import settings
+
+
+logger = logging.getLogger('staticgenerator.sharding')
+
+SHARD_PREFIX = '~'
+
+
+def get_shards(key, levels=None):
+    """Returns the shard directory names of a path segment"""
+    levels = settings.SHARD_LEVELS if levels is None else levels
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    digest = hashlib.md5(key).hexdigest()
+    return ['%s%s' % (SHARD_PREFIX, digest[level * 2:level * 2 + 2])
+            for level in range(levels)]
+
+
+def split_sharded_path(path):
+    """Returns ``(prefix, key, rest)`` if ``path`` is below a sharded prefix,
+    otherwise ``None``"""
+    for prefix in settings.SHARDED_PREFIXES:
+        if path.startswith(prefix) and len(path) > len(prefix):
+            key, slash, rest = path[len(prefix):].partition('/')
+            if key:
+                return prefix, key, slash + rest
+    return None
+
+
+def shard_path(path):
+    """Returns the URL path with the shard directories inserted"""
+    parts = split_sharded_path(path)
+    if parts is None:
+        return path
+    prefix, key, rest = parts
+    return u'{0}{1}/{2}{3}'.format(prefix, u'/'.join(get_shards(key)),
+                                   key, rest)
+
+
+def get_key_of_name(name, suffixes=(), is_directory=False):
+    """Returns the path segment of a file or directory name in the cache
+
+    Cache variants, content type suffixes and sidecars, as in
+    ``hello,ajax.json.sgmeta``, are removed from file names.  Directory
+    names are the path segment as is, e.g. ``a,b`` or ``data.json``.
+
+    """
+    if is_directory:
+        return name
+    key = name.split(',', 1)[0]
+    for suffix in suffixes:
+        if key.endswith(suffix):
+            return key[:-len(suffix)]
+    return key
+
+
+def reshard(root=None, prefixes=None, levels=None):
+    """Moves unsharded files below the sharded prefixes into their shards
+
+    Entries which exist in their shard already are newer and replace the
+    unsharded ones.  Returns the number of entries moved.
+
+    """
+    from staticgenerator.headers import META_SUFFIX, get_type_suffixes
+    root = root or settings.ROOT
+    prefixes = settings.SHARDED_PREFIXES if prefixes is None else prefixes
+    suffixes = sorted([META_SUFFIX] + [suffix + extra
+                                      for suffix in get_type_suffixes()
+                                      for extra in ('', META_SUFFIX)],
+                      key=len, reverse=True)
+    moved = 0
+    for tree in ('fresh', 'stale'):
+        for prefix in prefixes:
+            directory = os.path.join(root, tree, prefix.strip('/'))
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            for name in names:
+                if name.startswith(SHARD_PREFIX):
+                    continue
+                source = os.path.join(directory, name)
+                key = get_key_of_name(name, suffixes, os.path.isdir(source))
+                target_directory = os.path.join(directory,
+                                                *get_shards(key, levels))
+                target = os.path.join(target_directory, name)
+                if os.path.lexists(target):
+                    logger.debug('%s exists already, removing %s',
+                                 target, source)
+                    if os.path.isdir(source):
+                        shutil.rmtree(source, True)
+                    else:
+                        os.remove(source)
+                    continue
+                if not os.path.isdir(target_directory):
+                    os.makedirs(target_directory)
+                os.rename(source, target)
+                moved += 1
+    return moved
+
+
+def get_nginx_rules():
+    """Returns nginx directives which set ``$sg_base`` to the sharded URI
+    without trailing slashes
+
+    Requires the set-misc module for ``set_md5``.
+
+    """
+    if not settings.SHARDED_PREFIXES:
+        return ''
+    lines = ['', '    set $sg_path $uri;', '    set $sg_shard_md5 "";']
+    capture = ''.join('(.{2})' for level in range(settings.SHARD_LEVELS))
+    shards = '/'.join('%s$%d' % (SHARD_PREFIX, level + 1)
+                      for level in range(settings.SHARD_LEVELS))
+    # The last matching condition wins in nginx, the first prefix in Python
+    for prefix in reversed(settings.SHARDED_PREFIXES):
+        lines.extend([
+            '    if ($uri ~ "^(%s)([^/]+)(.*)$") {' % re.escape(prefix),
+            '        set $sg_shard_prefix $1;',
+            '        set $sg_shard_key $2;',
+            '        set $sg_shard_rest $3;',
+            '        set_md5 $sg_shard_md5 $sg_shard_key;',
+            '    }',
+        ])
+    lines.extend([
+        '    if ($sg_shard_md5 ~ "^%s") {' % capture,
+        '        set $sg_path $sg_shard_prefix%s/$sg_shard_key$sg_shard_rest;'
+        % shards,
+        '    }',
+        '    set $sg_base "";',
+        '    if ($sg_path ~ "^(.*[^/])/*$") {',
+        '        set $sg_base $1;',
+        '    }',
+    ])
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,734 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""Storage backends of the cached files
+
+:class:`StaticGenerator` reads and writes the cache through the backend
+configured with ``STATIC_GENERATOR_STORAGE``:
+
+* :class:`FilesystemStorage` (the default) writes files below
+  ``STATIC_GENERATOR_ROOT`` for nginx to serve
+* :class:`MemoryStorage` keeps the files in a dictionary of the process,
+  e.g. for fast tests
+* :class:`MemcachedStorage` stores the files in memcached, for nginx's
+  ``memcached_pass``
+
+Backends are constructed with the document root and the keyword arguments
+in ``STATIC_GENERATOR_STORAGE_OPTIONS``.  They get file names below the
+document root as computed by ``StaticGenerator.get_filename_from_path``.
+Other backends subclass :class:`Storage` and implement:
+
+* ``write(filename, content, stale_filename=None)`` atomically writing the
+  file, and a stale copy of it if ``stale_filename`` is given.  Returns
+  ``False`` if the write lost a race with an invalidation.
+* ``read(filename)`` returning the content, or ``None`` if the file doesn't
+  exist
+* ``listdir(directory)`` returning the names in a directory, or ``[]`` if it
+  doesn't exist
+* ``delete(filenames)`` deleting files, ignoring missing ones
+* ``delete_prefix(directory)`` deleting a directory and everything below it
+
+The negative cache maps, header maps, blob deduplication, replication and
+the ``staticgenerator_fsck`` and ``staticgenerator_reshard`` commands work
+on the filesystem only.  :func:`get_storage` refuses other backends when
+replication, deduplication or negative caching is enabled.
+
+"""
+import binascii
+import errno
+import logging
+import os
+import re
+import shutil
+import socket
+import stat
+import tempfile
+import threading
+
+from django.utils.importlib import import_module
+
+from staticgenerator import settings
+from staticgenerator.blobs import get_blob_filename
+from staticgenerator.exceptions import StaticGeneratorException
+from staticgenerator.utils import parse_address
+
+
+logger = logging.getLogger('staticgenerator.storage')
+
+# Prefix of temporary file names; paths with segments starting with it
+# aren't cached, so the names of cached pages never have it
+TMP_PREFIX = '.sgtmp'
+
+
+def create_directory(directory):
+    """Creates the given directory and missing intermediate directories
+
+    Does nothing if the directory already exists.
+
+    """
+    if os.path.exists(directory):
+        return
+    try:
+        os.makedirs(directory)
+    except OSError as exc:
+        if exc.errno == 17:  # OSError 17 = 'File exists'
+            return
+    except Exception as exc:
+        raise StaticGeneratorException('Could not create directory',
+                                       directory=directory)
+
+
+def hardlink(src, dst, remove_dst=False, ignore_src=False, ignore_dst=False):
+    """Hard links the ``src`` file to the ``dst`` file path.
+
+    Arguments:
+    * ``src``: the source file
+    * ``dst``: the destination hard link path
+    * ``remove_dst``: if a true value, first attempts to remove the destination
+      file if it exists
+    * ``ignore_src``: if a true value, ignores missing source file silently
+    * ``ignore_dst``: if a true value, ignores existing destination file
+      silently
+
+    """
+    create_directory(os.path.dirname(dst))
+    if remove_dst:
+        try:
+            os.remove(dst)
+        except OSError as exc:
+            if exc.errno != 2:  # 2 = existing destination file not found
+                raise StaticGeneratorException('Could not delete file',
+                                               dst=dst)
+    try:
+        os.link(src, dst)
+        logger.debug('Linked %s to %s', src, dst)
+    except OSError as exc:
+        if exc.errno == 2 and ignore_src:
+            logger.debug('Source file not found, ignoring',
+                         exc_info=True,
+                         extra={'src': src})
+            return
+        if exc.errno == 17 and ignore_dst:
+            logger.debug('Destination file already exists, ignoring',
+                         exc_info=True,
+                         extra={'dst': dst})
+            return
+        logger.debug('Cannot link file',
+                     exc_info=True,
+                     extra={'src': src, 'dst': dst})
+        raise StaticGeneratorException('Could not link file', src=src, dst=dst)
+    except Exception as exc:
+        logger.debug('Cannot link file',
+                     exc_info=True,
+                     extra={'src': src, 'dst': dst})
+        raise StaticGeneratorException('Could not link file', src=src, dst=dst)
+
+
+def write_file(fresh_filename, content):
+    """Atomically writes content into a file
+
+    Writes a temporary file in the same directory and renames it.  Returns
+    ``False`` if the temporary file couldn't be renamed.
+
+    """
+    fresh_directory = os.path.dirname(fresh_filename)
+    create_directory(fresh_directory)
+    try:
+        f, tmpname = tempfile.mkstemp(prefix=TMP_PREFIX,
+                                      dir=fresh_directory)
+        os.write(f, content)
+        os.close(f)
+    except Exception as exc:
+        raise StaticGeneratorException(
+            'Could not write temporary fresh file',
+            fresh_directory=fresh_directory)
+    try:
+        os.chmod(tmpname,
+                 stat.S_IREAD |
+                 stat.S_IWRITE |
+                 stat.S_IWUSR |
+                 stat.S_IRUSR |
+                 stat.S_IRGRP |
+                 stat.S_IROTH)
+        os.rename(tmpname, fresh_filename)
+    except Exception:
+        logger.warning(
+            'Could not chmod or rename fresh file. '
+            'Temporary file probably removed by invalidation.',
+            exc_info=True,
+            extra={'fresh_filename': fresh_filename})
+        return False
+    return True
+
+
+class Storage(object):
+    """Base class of the storage backends
+
+    Subclasses implement the methods listed in the module docstring.  The
+    base class provides ``exists`` and ``link_stale`` on top of them, which
+    backends override with cheaper operations.
+
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def exists(self, filename):
+        return self.read(filename) is not None
+
+    def link_stale(self, stale_filename, filename):
+        """Publishes the stale copy as the file unless the file exists
+
+        Does nothing if there is no stale copy.
+
+        """
+        if self.exists(filename):
+            return
+        content = self.read(stale_filename)
+        if content is not None:
+            self.write(filename, content)
+
+
+class FilesystemStorage(Storage):
+    """Stores the cache as files below the document root
+
+    Stale copies are hard links to the fresh files.  With
+    ``STATIC_GENERATOR_DEDUPE`` the files are hard links to blobs, see
+    ``staticgenerator.blobs``.
+
+    """
+
+    def write(self, filename, content, stale_filename=None):
+        if settings.DEDUPE:
+            if not self._write_blob(filename, content):
+                return False
+        elif not write_file(filename, content):
+            return False
+
+        if stale_filename is not None:
+            # The fresh version of the cached file is now on the disk.  Now
+            # create a hard link to it in the stale cache directory.
+            hardlink(filename, stale_filename,
+                     remove_dst=True, ignore_dst=True)
+        return True
+
+    def _write_blob(self, filename, content):
+        """Atomically replaces the file with a hard link to a blob
+
+        The content is written into the content-addressed blob store unless
+        an identical blob exists already.  Returns ``False`` if the link
+        couldn't be renamed.
+
+        """
+        blob_filename = get_blob_filename(self.root, content)
+        directory = os.path.dirname(filename)
+        create_directory(directory)
+        tmpname = os.path.join(directory, TMP_PREFIX +
+                               binascii.hexlify(os.urandom(3)))
+        for attempt in range(2):
+            if not os.path.exists(blob_filename):
+                write_file(blob_filename, content)
+            try:
+                os.link(blob_filename, tmpname)
+                break
+            except OSError as exc:
+                if exc.errno == 2 and not attempt:
+                    continue  # blob garbage collected meanwhile, rewrite
+                raise StaticGeneratorException('Could not link file',
+                                               src=blob_filename,
+                                               dst=tmpname)
+        try:
+            os.rename(tmpname, filename)
+        except Exception:
+            logger.warning(
+                'Could not rename fresh file. '
+                'Temporary file probably removed by invalidation.',
+                exc_info=True,
+                extra={'fresh_filename': filename})
+            return False
+        return True
+
+    def link_stale(self, stale_filename, filename):
+        if os.path.isfile(filename):
+            # We already have a fresh version of the resource. Don't
+            # overwrite.
+            logger.debug('FilesystemStorage.link_stale: %s already exists',
+                         filename)
+            return
+        hardlink(stale_filename, filename, ignore_src=True, ignore_dst=True)
+
+    def exists(self, filename):
+        return os.path.exists(filename)
+
+    def read(self, filename):
+        try:
+            with open(filename, 'rb') as f:
+                return f.read()
+        except IOError as exc:
+            if exc.errno == errno.ENOENT:
+                return None
+            raise
+
+    def listdir(self, directory):
+        try:
+            return os.listdir(directory)
+        except OSError:
+            return []
+
+    def delete(self, filenames):
+        """Deletes files and then their directories if they're empty"""
+        directories = []
+        for filename in filenames:
+            try:
+                os.remove(filename)
+            except OSError as exc:
+                if exc.errno != 2:  # 2 = file not found
+                    raise StaticGeneratorException('Could not delete file',
+                                                   filename=filename)
+            except Exception:
+                raise StaticGeneratorException('Could not delete file',
+                                               filename=filename)
+            directory = os.path.dirname(filename)
+            if directory not in directories:
+                directories.append(directory)
+        for directory in directories:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                # Will fail if a directory is not empty, in which case we
+                # don't want to delete it anyway
+                pass
+
+    def delete_prefix(self, directory):
+        shutil.rmtree(directory, True)
+
+
+class MemoryStorage(Storage):
+    """Keeps the cache in a dictionary of the process"""
+
+    def __init__(self, root):
+        super(MemoryStorage, self).__init__(root)
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def write(self, filename, content, stale_filename=None):
+        with self.lock:
+            self.files[filename] = content
+            if stale_filename is not None:
+                self.files[stale_filename] = content
+        return True
+
+    def link_stale(self, stale_filename, filename):
+        with self.lock:
+            if filename not in self.files and stale_filename in self.files:
+                self.files[filename] = self.files[stale_filename]
+
+    def exists(self, filename):
+        return filename in self.files
+
+    def read(self, filename):
+        return self.files.get(filename)
+
+    def listdir(self, directory):
+        prefix = directory.rstrip('/') + '/'
+        with self.lock:
+            return sorted(set(filename[len(prefix):].split('/', 1)[0]
+                              for filename in self.files
+                              if filename.startswith(prefix)))
+
+    def delete(self, filenames):
+        with self.lock:
+            for filename in filenames:
+                self.files.pop(filename, None)
+
+    def delete_prefix(self, directory):
+        prefix = directory.rstrip('/') + '/'
+        with self.lock:
+            for filename in list(self.files):
+                if filename.startswith(prefix):
+                    del self.files[filename]
+
+    def clear(self):
+        with self.lock:
+            self.files.clear()
+
+
+# Characters which nginx escapes in $memcached_key
+MEMCACHED_ESCAPE_RE = re.compile(r'[\x00-\x20%]')
+
+
+def escape_memcached_key(key):
+    """Escapes a key like nginx's memcached module does"""
+    return MEMCACHED_ESCAPE_RE.sub(lambda m: '%%%02X' % ord(m.group()), key)
+
+
+class MemcachedConnection(object):
+    """A connection speaking the memcached text protocol"""
+
+    def __init__(self, address, timeout):
+        self.address = address
+        self.sock = socket.create_connection(address, timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = ''
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+    def readline(self):
+        while '\r\n' not in self.buffer:
+            self._receive()
+        line, self.buffer = self.buffer.split('\r\n', 1)
+        return line
+
+    def read(self, length):
+        while len(self.buffer) < length + 2:
+            self._receive()
+        data, self.buffer = self.buffer[:length], self.buffer[length + 2:]
+        return data
+
+    def _receive(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise socket.error('Connection closed by server')
+        self.buffer += data
+
+    def close(self):
+        self.sock.close()
+
+
+class MemcachedClient(object):
+    """A pool of connections to one memcached server
+
+    :meth:`execute` pipelines a list of commands: all of them are sent at
+    once and then all replies are read.
+
+    """
+
+    def __init__(self, server='127.0.0.1:11211', pool_size=4, timeout=1.0,
+                 expire=0):
+        self.address = parse_address(server)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.expire = expire
+        self.pool = []
+        self.lock = threading.Lock()
+
+    def _acquire(self):
+        with self.lock:
+            if self.pool:
+                return self.pool.pop()
+        return MemcachedConnection(self.address, self.timeout)
+
+    def _release(self, connection):
+        with self.lock:
+            if len(self.pool) < self.pool_size:
+                self.pool.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """Closes the idle connections"""
+        with self.lock:
+            connections, self.pool = self.pool, []
+        for connection in connections:
+            connection.close()
+
+    def execute(self, commands):
+        """Runs ``(command, key[, value[, cas]])`` tuples and returns their
+        results
+
+        Storage commands and ``delete`` return the reply line, e.g.
+        ``'STORED'``.  ``get`` returns the value or ``None``, ``gets`` a
+        ``(value, cas)`` tuple or ``None``.
+
+        """
+        if not commands:
+            return []
+        request = []
+        for command in commands:
+            name, key = command[:2]
+            if name in ('get', 'gets', 'delete', 'mg'):
+                request.append('%s %s\r\n' % (name, key))
+            else:
+                value = command[2]
+                request.append('%s %s 0 %d %d%s\r\n%s\r\n' % (
+                    name, key, self.expire, len(value),
+                    ' %s' % command[3] if name == 'cas' else '', value))
+        try:
+            connection = self._acquire()
+        except socket.error:
+            raise StaticGeneratorException('Could not connect to memcached',
+                                           server=self.address)
+        try:
+            connection.send(''.join(request))
+            results = [self._read_reply(connection, command[0])
+                       for command in commands]
+        except (socket.error, ValueError):
+            connection.close()
+            raise StaticGeneratorException('Memcached request failed',
+                                           server=self.address)
+        self._release(connection)
+        return results
+
+    def _read_reply(self, connection, name):
+        if name not in ('get', 'gets'):
+            return connection.readline()
+        result = None
+        while True:
+            line = connection.readline()
+            if line == 'END':
+                return result
+            parts = line.split()
+            if parts[0] != 'VALUE':
+                raise ValueError(line)
+            value = connection.read(int(parts[3]))
+            result = value if name == 'get' else (value, parts[4])
+
+
+class MemcachedStorage(Storage):
+    """Stores the cache in memcached for nginx's ``memcached_pass``
+
+    The key of a file is ``key_prefix`` followed by its name relative to the
+    document root, e.g. ``/fresh/about/index.html%3F``, escaped like nginx
+    escapes ``$memcached_key``.  Stale copies are stored under their own
+    keys in the same round trip.
+
+    memcached can't list keys, so each directory has an index item with the
+    names written into it.  Names are appended when writing, and the index
+    of a new directory is registered in the index of its parent.  Indexes
+    may name deleted items, and names appear repeatedly until the index is
+    compacted or deleted.
+
+    Arguments:
+    * ``server``: ``host:port`` of the memcached server
+    * ``pool_size``: number of idle connections kept open
+    * ``timeout``: socket timeout in seconds
+    * ``expire``: expiration time of the items in seconds, 0 for none
+    * ``key_prefix``: prefix of all keys
+
+    """
+    index_prefix = 'index:'
+    max_key_length = 250
+
+    def __init__(self, root, server='127.0.0.1:11211', pool_size=4,
+                 timeout=1.0, expire=0, key_prefix=''):
+        super(MemcachedStorage, self).__init__(root)
+        self.client = MemcachedClient(server, pool_size, timeout, expire)
+        self.key_prefix = key_prefix
+        # memcached 1.6 tests existence with the meta get command
+        self.meta_commands = True
+
+    def _get_name(self, filename):
+        """Returns the name of a file relative to the root with a leading
+        slash"""
+        root = self.root.rstrip('/')
+        if filename != root and not filename.startswith(root + '/'):
+            raise StaticGeneratorException('File outside of the root',
+                                           filename=filename)
+        return filename[len(root):]
+
+    def _get_key(self, name, prefix=''):
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        key = escape_memcached_key('%s%s%s' % (self.key_prefix, prefix, name))
+        if len(key) > self.max_key_length:
+            return None
+        return key
+
+    def _get_index_key(self, directory):
+        return self._get_key(directory, self.index_prefix)
+
+    def close(self):
+        self.client.close()
+
+    def get_key(self, filename):
+        """Returns the memcached key of a file, or ``None`` if it's too
+        long"""
+        return self._get_key(self._get_name(filename))
+
+    def write(self, filename, content, stale_filename=None):
+        names = [self._get_name(filename)]
+        if stale_filename is not None:
+            names.append(self._get_name(stale_filename))
+        keys = [self._get_key(name) for name in names]
+        entries = self._get_index_entries(names)
+        if None in keys + [self._get_index_key(directory)
+                           for directory, name in entries]:
+            logger.debug('Key of %s too long, not cached', filename)
+            return False
+        results = self.client.execute(
+            [('set', key, content) for key in keys] +
+            self._get_index_commands(entries))
+        if results[0] != 'STORED':
+            logger.warning('Could not store %s in memcached: %s',
+                           filename, results[0])
+            return False
+        if len(keys) > 1 and results[1] != 'STORED':
+            logger.warning('Could not store %s in memcached: %s',
+                           stale_filename, results[1])
+        self._handle_index_results(entries, results[len(keys):])
+        return True
+
+    def _get_index_entries(self, names):
+        """Returns the ``(directory, name)`` index entries of files"""
+        return [os.path.split(name) for name in names]
+
+    def _get_index_commands(self, entries):
+        return [('append', self._get_index_key(directory), '%s\n' % name)
+                for directory, name in entries]
+
+    def _handle_index_results(self, entries, results):
+        """Creates missing indexes and compacts full ones
+
+        A new index is registered with a trailing slash in the index of its
+        parent directory.
+
+        """
+        while entries:
+            missing = []
+            for entry, result in zip(entries, results):
+                if result == 'NOT_STORED':
+                    missing.append(entry)
+                elif result != 'STORED':
+                    # The index probably exceeds the item size limit
+                    self._compact_index(entry[0])
+                    self.client.execute(self._get_index_commands([entry]))
+            if not missing:
+                return
+            results = self.client.execute(
+                [('add', self._get_index_key(directory), '%s\n' % name)
+                 for directory, name in missing])
+            created, concurrent = [], []
+            for (directory, name), result in zip(missing, results):
+                if result == 'STORED':
+                    if directory != '/':
+                        created.append(os.path.split(directory))
+                elif result == 'NOT_STORED':
+                    concurrent.append((directory, name))
+            self.client.execute(self._get_index_commands(concurrent))
+            entries = [(directory, '%s/' % name)
+                       for directory, name in created]
+            results = self.client.execute(self._get_index_commands(entries))
+
+    def _parse_index(self, value):
+        """Returns the distinct names in an index"""
+        names, seen = [], set()
+        for name in value.splitlines():
+            if name and name not in seen:
+                names.append(name)
+                seen.add(name)
+        return names
+
+    def _read_index(self, directory):
+        key = self._get_index_key(directory)
+        if key is None:
+            return []
+        return self._parse_index(
+            self.client.execute([('get', key)])[0] or '')
+
+    def _compact_index(self, directory):
+        """Removes repeated names from an index"""
+        key = self._get_index_key(directory)
+        result = self.client.execute([('gets', key)])[0]
+        if result is None:
+            return
+        value, cas = result
+        names = self._parse_index(value)
+        result = self.client.execute(
+            [('cas', key, ''.join('%s\n' % name for name in names), cas)])[0]
+        if result != 'STORED':
+            logger.warning('Could not compact memcached index %s: %s',
+                           directory, result)
+
+    def link_stale(self, stale_filename, filename):
+        name = self._get_name(filename)
+        key = self._get_key(name)
+        stale_key = self.get_key(stale_filename)
+        if key is None or stale_key is None:
+            return
+        content = self.client.execute([('get', stale_key)])[0]
+        if content is None:
+            return
+        entries = self._get_index_entries([name])
+        results = self.client.execute([('add', key, content)] +
+                                      self._get_index_commands(entries))
+        self._handle_index_results(entries, results[1:])
+
+    def exists(self, filename):
+        key = self.get_key(filename)
+        if key is None:
+            return False
+        if self.meta_commands:
+            # A meta get without flags doesn't return the value
+            result = self.client.execute([('mg', key)])[0]
+            if result in ('HD', 'EN'):
+                return result == 'HD'
+            logger.debug('memcached has no meta commands: %s', result)
+            self.meta_commands = False
+        return self.client.execute([('get', key)])[0] is not None
+
+    def read(self, filename):
+        key = self.get_key(filename)
+        if key is None:
+            return None
+        return self.client.execute([('get', key)])[0]
+
+    def listdir(self, directory):
+        return [name.rstrip('/')
+                for name in self._read_index(self._get_name(directory))]
+
+    def delete(self, filenames):
+        keys = filter(None, [self.get_key(filename)
+                             for filename in filenames])
+        self.client.execute([('delete', key) for key in keys])
+
+    def delete_prefix(self, directory):
+        keys = []
+        directories = [self._get_name(directory.rstrip('/'))]
+        while directories:
+            directory = directories.pop()
+            keys.append(self._get_index_key(directory))
+            for name in self._read_index(directory):
+                if name.endswith('/'):
+                    directories.append(os.path.join(directory, name[:-1]))
+                else:
+                    keys.append(self._get_key(os.path.join(directory, name)))
+        self.client.execute([('delete', key) for key in keys if key])
+
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def get_storage():
+    """Returns the process-wide storage backend configured in the
+    settings"""
+    key = (settings.STORAGE, settings.ROOT,
+           repr(sorted(settings.STORAGE_OPTIONS.items())))
+    with _storages_lock:
+        if key not in _storages:
+            storage = settings.STORAGE
+            if isinstance(storage, basestring):
+                module_name, _, name = storage.rpartition('.')
+                try:
+                    storage = getattr(import_module(module_name), name)
+                except (ImportError, AttributeError, ValueError):
+                    raise StaticGeneratorException(
+                        'Could not import storage backend', storage=storage)
+            storage = storage(settings.ROOT, **settings.STORAGE_OPTIONS)
+            if not isinstance(storage, FilesystemStorage):
+                check_filesystem_settings()
+            _storages[key] = storage
+        return _storages[key]
+
+
+def check_filesystem_settings():
+    """Raises an exception if features which only work with the
+    filesystem backend are enabled"""
+    enabled = [name for name in ('REPLICA_ROOTS', 'DEDUPE',
+                                 'CACHE_NOT_FOUND', 'CACHE_REDIRECTS')
+               if getattr(settings, name)]
+    if enabled:
+        raise StaticGeneratorException(
+            'STATIC_GENERATOR_%s require the filesystem storage backend'
+            % ', STATIC_GENERATOR_'.join(enabled), storage=settings.STORAGE)
@@ -0,0 +1,42 @@
+from django import template
+from django.template.loader import get_template
+
+from staticgenerator.fragments import (
+    get_fragment_template_name, wrap_fragment
+)
+
+
+register = template.Library()
+
+
+class StaticFragmentNode(template.Node):
+    def __init__(self, name):
+        self.name = name
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        content = get_template(get_fragment_template_name(name)).render(
+            context)
+        return wrap_fragment(name, content)
+
+
+@register.tag
+def staticfragment(parser, token):
+    """Renders a fragment template as a separately cached region
+
+    The fragment template is looked up from
+    ``STATIC_GENERATOR_FRAGMENT_TEMPLATE_DIR``.  Fragments are shared between
+    all pages including them, so their content must not depend on the
+    page's context.
+
+    Example::
+
+        {% load staticgenerator_tags %}
+        {% staticfragment "sidebar.html" %}
+
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError(
+            '%r tag requires exactly one argument' % bits[0])
+    return StaticFragmentNode(parser.compile_filter(bits[1]))
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""Synthetic site used by the benchmarks
+
+``BENCHMARK_URL_PATTERNS`` URL patterns of the form ``/s<n>/<slug>/`` all
+render the same kind of page, about ``BENCHMARK_PAGE_SIZE`` bytes of HTML.
+:func:`create_objects` creates model instances whose absolute URLs are
+spread over the patterns.
+
+"""
+from django.conf import settings
+from django.conf.urls import patterns, url
+from django.http import HttpResponse
+
+from staticgenerator.tests.models import Model
+
+
+ROW = '''    <li class="item">
+      <a href="/s%(section)d/%(n)d/">Item %(n)d</a>
+      <!-- item %(n)d -->
+    </li>
+'''
+
+
+def render_page(section, slug, size=None):
+    size = size or getattr(settings, 'BENCHMARK_PAGE_SIZE', 8192)
+    rows = []
+    length = 0
+    n = 0
+    while length < size:
+        row = ROW % {'section': section, 'n': n}
+        rows.append(row)
+        length += len(row)
+        n += 1
+    return ('<!DOCTYPE html>\n<html>\n  <head><title>%s</title></head>\n'
+            '  <body>\n  <ul>\n%s  </ul>\n  </body>\n</html>\n'
+            % (slug, ''.join(rows)))
+
+
+def page(request, section, slug):
+    return HttpResponse(render_page(int(section), slug))
+
+
+def get_url(n, patterns_count=None):
+    patterns_count = patterns_count or settings.BENCHMARK_URL_PATTERNS
+    return '/s%d/%d/' % (n % patterns_count, n)
+
+
+def create_objects(count, patterns_count=None):
+    Model.objects.all().delete()
+    Model.objects.bulk_create([Model(url=get_url(n, patterns_count))
+                               for n in xrange(count)])
+
+
+urlpatterns = patterns(
+    '',
+    *[url(r'^s(?P<section>%d)/(?P<slug>[^/]+)/$' % n, page)
+      for n in range(getattr(settings, 'BENCHMARK_URL_PATTERNS', 50))])
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""Benchmarks of the caching hot paths
+
+Run from the repository root::
+
+    PYTHONPATH=. python staticgenerator/tests/benchmarks/run.py \\
+        --output bench.json --baseline baseline.json
+
+Each benchmark is repeated ``--repeat`` times and reports the best time per
+operation in ``per_op`` (seconds).  Results are written as JSON; with
+``--baseline`` every benchmark whose ``per_op`` grew by more than
+``--threshold`` (a fraction) compared to the baseline file is reported as a
+regression and the exit status is 1.
+
+The delete benchmarks run on cache trees of each of the ``--tree-sizes``.
+Trees of 10^5 and more files take a while to build; pass e.g.
+``--tree-sizes 1000,10000,100000,1000000`` to include them.
+
+"""
+import json
+import optparse
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from django.conf import settings as django_settings
+
+
+def configure(root, options):
+    django_settings.configure(
+        DEBUG=False,
+        SECRET_KEY='benchmark',
+        SERVER_NAME='localhost',
+        INSTALLED_APPS=('staticgenerator.tests',),
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3',
+                               'NAME': ':memory:'}},
+        MIDDLEWARE_CLASSES=(),
+        ROOT_URLCONF='staticgenerator.tests.benchmarks.fixture',
+        STATIC_GENERATOR_ROOT=root,
+        STATIC_GENERATOR_URLS=[r'^/s\d+/'],
+        BENCHMARK_URL_PATTERNS=options.patterns,
+        BENCHMARK_PAGE_SIZE=options.page_size)
+    from django.core.management import call_command
+    call_command('syncdb', interactive=False, verbosity=0)
+
+
+def timed(run, ops, repeat, setup=None):
+    """Runs ``setup()`` and times ``run()`` ``repeat`` times
+
+    ``run`` performs ``ops`` operations.  Returns the best and median time
+    per operation.
+
+    """
+    durations = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.time()
+        run()
+        durations.append(time.time() - start)
+    durations.sort()
+    return {'ops': ops,
+            'repeat': repeat,
+            'per_op': durations[0] / ops,
+            'median_per_op': durations[len(durations) // 2] / ops}
+
+
+def clear(root):
+    shutil.rmtree(root, ignore_errors=True)
+    os.makedirs(root)
+
+
+def build_tree(root, size):
+    """Writes ``size`` cached pages with their stale links into ``root``
+
+    Returns the paths of the pages.  Pages are spread over directories of at
+    most 1000 pages.
+
+    """
+    paths = []
+    for n in xrange(size):
+        path = '/tree/d%d/%d/' % (n // 1000, n)
+        for tree in ('fresh', 'stale'):
+            directory = os.path.join(root, tree + path)
+            os.makedirs(directory)
+            filename = os.path.join(directory, 'index.html%3F')
+            if tree == 'fresh':
+                with open(filename, 'w') as f:
+                    f.write('x')
+                fresh_filename = filename
+            else:
+                os.link(fresh_filename, filename)
+        paths.append(path)
+    return paths
+
+
+def bench_middleware(options, root):
+    from django.http import HttpResponse
+    from django.test.client import RequestFactory
+    from staticgenerator.middleware import StaticGeneratorMiddleware
+    from staticgenerator.tests.benchmarks import fixture
+
+    middleware = StaticGeneratorMiddleware()
+    factory = RequestFactory()
+    content = fixture.render_page(0, 'page')
+    results = {}
+
+    for name, prefix in (('middleware_cached', '/s0/'),
+                         ('middleware_not_cached', '/other/')):
+        paths = ['%s%d/' % (prefix, n) for n in xrange(options.requests)]
+
+        def run():
+            for path in paths:
+                request = factory.get(path)
+                middleware.process_view(request, fixture.page, (), {})
+                middleware.process_response(request, HttpResponse(content))
+
+        results[name] = timed(run, len(paths), options.repeat,
+                              lambda: clear(root))
+    return results
+
+
+def bench_publish(options, root):
+    from staticgenerator import StaticGenerator
+    from staticgenerator.tests.benchmarks.fixture import get_url, render_page
+
+    generator = StaticGenerator()
+    content = render_page(0, 'page')
+    paths = [get_url(n) for n in xrange(options.publishes)]
+
+    def run():
+        for path in paths:
+            generator.publish_from_path(path, content=content)
+
+    result = timed(run, len(paths), options.repeat, lambda: clear(root))
+    result['pages_per_second'] = 1 / result['per_op']
+    return {'publish_from_path': result}
+
+
+def bench_publish_stale(options, root):
+    from staticgenerator import StaticGenerator
+    from staticgenerator.tests.benchmarks.fixture import get_url
+
+    generator = StaticGenerator()
+    paths = [get_url(n) for n in xrange(options.publishes)]
+
+    def run():
+        for path in paths:
+            generator.publish_stale_path(path)
+
+    def setup_hits():
+        clear(root)
+        for path in paths:
+            generator.publish_from_path(path, content='x')
+            generator.delete_from_path(path)
+
+    return {
+        'publish_stale_path_hit': timed(run, len(paths), options.repeat,
+                                        setup_hits),
+        'publish_stale_path_miss': timed(run, len(paths), options.repeat,
+                                         lambda: clear(root)),
+    }
+
+
+def bench_delete(options, root):
+    from staticgenerator import StaticGenerator
+
+    generator = StaticGenerator()
+    results = {}
+    for size in options.tree_sizes:
+        paths = []
+
+        def setup():
+            clear(root)
+            paths[:] = build_tree(root, size)
+
+        sample = []
+
+        def setup_sample():
+            setup()
+            sample[:] = random.Random(size).sample(paths, min(100, size))
+
+        def run_delete():
+            for path in sample:
+                generator.delete_from_path(path)
+
+        def run_recursive_delete():
+            generator.recursive_delete_from_path('/tree/')
+
+        results['delete_from_path_%d' % size] = timed(
+            run_delete, min(100, size), options.repeat, setup_sample)
+        result = timed(run_recursive_delete, 1, options.repeat, setup)
+        result['files'] = size
+        results['recursive_delete_from_path_%d' % size] = result
+    return results
+
+
+def bench_extract_resources(options, root):
+    from staticgenerator import StaticGenerator
+    from staticgenerator.tests.benchmarks.fixture import create_objects
+    from staticgenerator.tests.models import Model
+
+    create_objects(options.objects)
+
+    def measure():
+        # A forked child starts from the parent's peak memory usage, so only
+        # the growth is reported
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if not pid:
+            os.close(read_fd)
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            start = time.time()
+            paths = StaticGenerator().extract_resources([Model])
+            duration = time.time() - start
+            after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            os.write(write_fd, json.dumps({'seconds': duration,
+                                           'paths': len(paths),
+                                           'maxrss_kb': after - before}))
+            os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as f:
+            output = f.read()
+        os.waitpid(pid, 0)
+        return json.loads(output)
+
+    measurements = sorted((measure() for _ in range(options.repeat)),
+                          key=lambda m: m['seconds'])
+    best = measurements[0]
+    return {'extract_resources': {
+        'ops': best['paths'],
+        'repeat': options.repeat,
+        'per_op': best['seconds'] / max(best['paths'], 1),
+        'median_per_op': (measurements[len(measurements) // 2]['seconds']
+                          / max(best['paths'], 1)),
+        'maxrss_kb': max(m['maxrss_kb'] for m in measurements),
+    }}
+
+
+BENCHMARKS = [
+    ('middleware', bench_middleware),
+    ('publish', bench_publish),
+    ('publish_stale', bench_publish_stale),
+    ('delete', bench_delete),
+    ('extract_resources', bench_extract_resources),
+]
+
+
+def compare(results, baseline, threshold):
+    """Returns ``(name, baseline per_op, per_op)`` of each regression"""
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base and result['per_op'] > base['per_op'] * (1 + threshold):
+            regressions.append((name, base['per_op'], result['per_op']))
+    return regressions
+
+
+def get_parser():
+    parser = optparse.OptionParser(
+        usage='%prog [options] [benchmark ...]',
+        description='Benchmarks: %s' % ', '.join(name for name, _
+                                                 in BENCHMARKS))
+    parser.add_option('--objects', type='int', default=10000,
+                      help='Model instances of the fixture site')
+    parser.add_option('--patterns', type='int', default=50,
+                      help='URL patterns of the fixture site')
+    parser.add_option('--page-size', type='int', default=8192,
+                      help='Approximate size of the pages in bytes')
+    parser.add_option('--requests', type='int', default=1000,
+                      help='Requests per middleware benchmark')
+    parser.add_option('--publishes', type='int', default=1000,
+                      help='Pages per publish benchmark')
+    parser.add_option('--tree-sizes', default='1000,10000',
+                      help='Comma-separated cache tree sizes')
+    parser.add_option('--repeat', type='int', default=3)
+    parser.add_option('--output', help='Write the results into this file')
+    parser.add_option('--baseline', help='Compare against this results file')
+    parser.add_option('--threshold', type='float', default=0.2,
+                      help='Allowed slowdown against the baseline')
+    return parser
+
+
+def main(argv=None):
+    parser = get_parser()
+    options, names = parser.parse_args(argv)
+    options.tree_sizes = [int(size) for size in options.tree_sizes.split(',')]
+    unknown = set(names) - set(name for name, _ in BENCHMARKS)
+    if unknown:
+        parser.error('Unknown benchmarks: %s' % ', '.join(sorted(unknown)))
+
+    workdir = tempfile.mkdtemp(prefix='staticgenerator-bench')
+    root = os.path.join(workdir, 'root')
+    try:
+        configure(root, options)
+        results = {}
+        for name, benchmark in BENCHMARKS:
+            if names and name not in names:
+                continue
+            results.update(benchmark(options, root))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for name, result in sorted(results.items()):
+        print '%-40s %12.1f us/op' % (name, result['per_op'] * 1e6)
+
+    import django
+    output = {'meta': {'time': time.time(),
+                       'python': platform.python_version(),
+                       'django': django.get_version(),
+                       'platform': platform.platform(),
+                       'options': dict((key, value) for key, value
+                                       in vars(options).items()
+                                       if key not in ('output', 'baseline'))},
+              'results': results}
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, options.threshold)
+        for name, before, after in regressions:
+            print 'REGRESSION %s: %.1f -> %.1f us/op (+%d%%)' % (
+                name, before * 1e6, after * 1e6, (after / before - 1) * 100)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+from django.test.utils import override_settings
+from django.test import TestCase
+import os
+import shutil
+import time
+from staticgenerator import StaticGenerator
+from staticgenerator.blobs import gc_blobs, get_blob_filename
+
+
+@override_settings(STATIC_GENERATOR_ROOT='test_web_root',
+                   SERVER_NAME='localhost',
+                   STATIC_GENERATOR_DEDUPE=True)
+class Blobs_Tests(TestCase):
+    def tearDown(self):
+        shutil.rmtree('test_web_root', ignore_errors=True)
+
+    def test_identical_content_is_stored_once(self):
+        instance = StaticGenerator()
+
+        instance.publish_from_path('/foo/', content='same')
+        instance.publish_from_path('/foo/', content='same', variant=',ajax')
+
+        blob = get_blob_filename('test_web_root', 'same')
+        self.assertEqual(5, os.stat(blob).st_nlink)
+        self.assertEqual(
+            os.stat(blob).st_ino,
+            os.stat('test_web_root/fresh/foo/index.html%3F,ajax').st_ino)
+        self.assertEqual(
+            'same', open('test_web_root/stale/foo/index.html%3F').read())
+
+    def test_republishing_replaces_link(self):
+        instance = StaticGenerator()
+        instance.publish_from_path('/foo/', content='old')
+
+        instance.publish_from_path('/foo/', content='new')
+
+        self.assertEqual(
+            'new', open('test_web_root/fresh/foo/index.html%3F').read())
+        self.assertEqual(
+            ['index.html%3F'], os.listdir('test_web_root/fresh/foo'))
+        self.assertEqual(
+            1, os.stat(get_blob_filename('test_web_root', 'old')).st_nlink)
+
+    def test_gc_removes_unreferenced_blobs_only(self):
+        instance = StaticGenerator()
+        instance.publish_from_path('/foo/', content='old')
+        instance.publish_from_path('/foo/', content='new')
+
+        removed, reclaimed = gc_blobs('test_web_root', now=time.time() + 61)
+
+        self.assertEqual((1, 3), (removed, reclaimed))
+        self.assertFalse(
+            os.path.exists(get_blob_filename('test_web_root', 'old')))
+        self.assertTrue(
+            os.path.exists(get_blob_filename('test_web_root', 'new')))
+
+    def test_gc_keeps_recent_blobs(self):
+        instance = StaticGenerator()
+        instance.publish_from_path('/foo/', content='old')
+        instance.publish_from_path('/foo/', content='new')
+
+        self.assertEqual((0, 0), gc_blobs('test_web_root'))
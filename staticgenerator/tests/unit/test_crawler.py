@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+from django.test.utils import override_settings
+from django.test import TestCase
+from mock import call, Mock, patch
+import shutil
+from staticgenerator.crawler import BoundedVisitedSet, Crawler
+
+
+PAGES = {
+    '/': ('<a href="/blog/">blog</a>'
+          '<a href="http://localhost/about/">about</a>'
+          '<a href="http://elsewhere.com/">off-site</a>'
+          '<a href="mailto:me@example.com">mail</a>'),
+    '/blog/': ('<a href="first/">first</a>'
+               '<a href="/blog/search/">search</a>'
+               '<a href="/">home</a>'),
+    '/blog/first/': '<a href="/blog/second/">second</a>',
+    '/blog/second/': '',
+    '/about/': '',
+}
+
+
+@override_settings(STATIC_GENERATOR_ROOT='test_web_root',
+                   SERVER_NAME='localhost',
+                   STATIC_GENERATOR_URLS=[r'^/$', r'^/blog', r'^/about'],
+                   STATIC_GENERATOR_EXCLUDE_URLS=[r'^/blog/search'])
+class Crawler_Tests(TestCase):
+    def tearDown(self):
+        shutil.rmtree('test_web_root', ignore_errors=True)
+
+    def crawl(self, **kwargs):
+        crawler = Crawler(['/'], **kwargs)
+        crawler.gen.get_content_from_path = Mock(side_effect=PAGES.get)
+        crawler.gen.publish_from_path = Mock()
+        crawler.crawl()
+        return crawler
+
+    def test_extract_links_keeps_same_site_links_only(self):
+        crawler = Crawler(['/'], chunk_size=7)
+
+        result = crawler.extract_links('/', PAGES['/'])
+
+        self.assertEqual(['/blog/', '/about/'], result)
+
+    def test_crawl_publishes_cacheable_pages_breadth_first(self):
+        crawler = self.crawl()
+
+        self.assertEqual(
+            [call('/', content=PAGES['/']),
+             call('/blog/', content=PAGES['/blog/']),
+             call('/about/', content=PAGES['/about/']),
+             call('/blog/first/', content=PAGES['/blog/first/'])],
+            crawler.gen.publish_from_path.call_args_list[:4])
+
+    def test_crawl_skips_excluded_pages(self):
+        crawler = self.crawl()
+
+        rendered = [args[0] for args, kwargs
+                    in crawler.gen.get_content_from_path.call_args_list]
+        self.assertNotIn('/blog/search/', rendered)
+
+    def test_crawl_renders_each_page_once(self):
+        crawler = self.crawl()
+
+        rendered = [args[0] for args, kwargs
+                    in crawler.gen.get_content_from_path.call_args_list]
+        self.assertEqual(len(set(rendered)), len(rendered))
+
+    def test_crawl_respects_depth_limit(self):
+        crawler = self.crawl(max_depth=1)
+
+        rendered = [args[0] for args, kwargs
+                    in crawler.gen.get_content_from_path.call_args_list]
+        self.assertEqual(['/', '/blog/', '/about/'], rendered)
+
+    def test_crawl_with_concurrency(self):
+        crawler = self.crawl(concurrency=3)
+
+        self.assertEqual(5, crawler.published)
+
+
+class BoundedVisitedSet_Tests(TestCase):
+    def test_add_returns_false_for_seen_items(self):
+        visited = BoundedVisitedSet(capacity=100)
+
+        self.assertTrue(visited.add('/foo/'))
+        self.assertFalse(visited.add('/foo/'))
+        self.assertIn('/foo/', visited)
+        self.assertNotIn('/bar/', visited)
+
+    def test_size_does_not_grow(self):
+        visited = BoundedVisitedSet(capacity=1000)
+        size = len(visited.bits)
+
+        for i in range(5000):
+            visited.add('/page/%d/' % i)
+
+        self.assertEqual(size, len(visited.bits))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+from django.test.utils import override_settings
+from django.test import TestCase
+from mock import call, Mock, patch
+import json
+import os
+import shutil
+import socket
+import tempfile
+import staticgenerator
+from staticgenerator import fanout
+from staticgenerator.fanout import (
+    Broadcaster, Listener, SpoolTransport, Transport, UDPTransport
+)
+
+
+class MemoryTransport(Transport):
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.sent = []
+
+    def send(self, payload):
+        self.sent.append(payload)
+
+    def receive(self, timeout=None):
+        sent, self.sent = self.sent, []
+        return sent
+
+
+def free_udp_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@override_settings(STATIC_GENERATOR_ROOT='test_web_root',
+                   SERVER_NAME='localhost')
+class Fanout_Tests(TestCase):
+    def setUp(self):
+        self.spool = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.spool, ignore_errors=True)
+        shutil.rmtree('test_web_root', ignore_errors=True)
+
+    def test_batch_sends_one_message(self):
+        broadcaster = Broadcaster(MemoryTransport(), node='a')
+
+        with broadcaster.batch():
+            broadcaster.add('delete', ['/1/', '/2/'])
+            broadcaster.add('recursive_delete', ['/3/'])
+
+        messages = [json.loads(m) for m in broadcaster.transport.sent]
+        self.assertEqual(1, len(messages))
+        self.assertEqual([['delete', '/1/'], ['delete', '/2/'],
+                          ['recursive_delete', '/3/']],
+                         messages[0]['events'])
+
+    def test_oversized_batches_are_split(self):
+        broadcaster = Broadcaster(MemoryTransport(max_size=1000), node='a')
+
+        broadcaster.add('delete', ['/%s/' % ('x' * 90) for i in range(20)])
+
+        messages = [json.loads(m) for m in broadcaster.transport.sent]
+        self.assertTrue(len(messages) > 1)
+        self.assertEqual(range(1, len(messages) + 1),
+                         [message['seq'] for message in messages])
+        self.assertEqual(20, sum(len(m['events']) for m in messages))
+
+    def test_listener_applies_events(self):
+        generator = Mock()
+        transport = MemoryTransport()
+        Broadcaster(transport, node='a').add('delete', ['/1/'])
+        listener = Listener(transport, generator, node='b')
+
+        self.assertEqual(1, listener.poll())
+
+        generator.delete_from_path.assert_called_once_with('/1/')
+
+    def test_listener_ignores_messages_from_own_node(self):
+        generator = Mock()
+        transport = MemoryTransport()
+        Broadcaster(transport, node='a').add('delete', ['/1/'])
+
+        Listener(transport, generator, node='a').poll()
+
+        self.assertFalse(generator.delete_from_path.called)
+
+    @override_settings(STATIC_GENERATOR_INVALIDATION_ON_GAP='flush')
+    def test_listener_detects_dropped_messages(self):
+        generator = Mock()
+        transport = MemoryTransport()
+        broadcaster = Broadcaster(transport, node='a')
+        listener = Listener(transport, generator, node='b')
+        broadcaster.add('delete', ['/1/'])
+        listener.poll()
+        broadcaster.add('delete', ['/2/'])
+        transport.sent = []  # dropped
+        broadcaster.add('delete', ['/3/'])
+
+        listener.poll()
+
+        self.assertEqual(1, listener.dropped)
+        generator.recursive_delete_from_path.assert_called_once_with(u'/')
+        generator.delete_from_path.assert_has_calls([call('/1/'),
+                                                     call('/3/')])
+
+    def test_udp_transport(self):
+        address = '127.0.0.1:%d' % free_udp_port()
+        sender = UDPTransport(peers=[address])
+        receiver = UDPTransport(bind=address)
+        try:
+            receiver.receive(timeout=0)  # binds the socket
+
+            sender.send('message')
+
+            self.assertEqual(['message'], receiver.receive(timeout=5))
+        finally:
+            sender.close()
+            receiver.close()
+
+    def test_spool_transport(self):
+        sender = SpoolTransport(self.spool)
+        receiver = SpoolTransport(self.spool)
+
+        sender.send('first')
+        sender.send('second')
+
+        self.assertEqual(['first', 'second'], receiver.receive(timeout=0))
+        self.assertEqual([], receiver.receive(timeout=0))
+
+    def test_spool_receiver_skips_applied_messages_after_restart(self):
+        sender = SpoolTransport(self.spool)
+        receiver = SpoolTransport(self.spool)
+        sender.send('first')
+        self.assertEqual(['first'], receiver.receive(timeout=0))
+        receiver.acknowledge()
+
+        sender.send('second')
+        restarted = SpoolTransport(self.spool)
+
+        self.assertEqual(['second'], restarted.receive(timeout=0))
+
+    def test_spool_transport_removes_old_applied_messages(self):
+        sender = SpoolTransport(self.spool)
+        receiver = SpoolTransport(self.spool, retention=10)
+        sender.send('old')
+        self.assertEqual(['old'], receiver.receive(timeout=0))
+        receiver.acknowledge()
+
+        with patch('time.time', Mock(return_value=2e9)):
+            self.assertEqual([], receiver.receive(timeout=0))
+            self.assertEqual([], SpoolTransport(self.spool).receive(timeout=0))
+
+        self.assertEqual([], [name for name in os.listdir(self.spool)
+                              if name.endswith('.json')])
+
+    def test_spool_transport_removes_old_messages(self):
+        sender = SpoolTransport(self.spool)
+        receiver = SpoolTransport(self.spool, retention=10)
+        sender.send('old')
+
+        with patch('time.time', Mock(return_value=2e9)):
+            self.assertEqual([], receiver.receive(timeout=0))
+
+        self.assertEqual([], receiver.receive(timeout=0))
+
+    def test_quick_delete_broadcasts(self):
+        with override_settings(
+                STATIC_GENERATOR_INVALIDATION_TRANSPORT=SpoolTransport,
+                STATIC_GENERATOR_INVALIDATION_OPTIONS={
+                    'directory': self.spool}):
+            staticgenerator.quick_delete('/1/')
+            with fanout.batch():
+                staticgenerator.recursive_delete('/2/')
+                staticgenerator.quick_delete('/3/')
+
+        messages = [json.loads(payload) for payload
+                    in SpoolTransport(self.spool).receive(timeout=0)]
+        self.assertEqual(
+            [[['delete', '/1/']],
+             [['recursive_delete', '/2/'], ['delete', '/3/']]],
+            [message['events'] for message in messages])
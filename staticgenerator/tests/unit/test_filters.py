@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+from django.test.utils import override_settings
+from django.test import TestCase
+import shutil
+from staticgenerator import StaticGenerator
+from staticgenerator.filters import (Filter, FilterChain, HTMLMinifyFilter,
+                                     apply_filters, get_stats)
+
+
+PAGE = '''<!DOCTYPE html>
+<html>
+  <head>
+    <!-- page head -->
+    <!--[if IE]><link rel="stylesheet" href="ie.css"><![endif]-->
+    <script>
+      var a  =  "<!-- not a comment -->";
+    </script>
+  </head>
+  <body>
+    <p>Hello,
+       world</p>
+    <!--# include virtual="/_sgfragments/menu/" -->
+    <PRE class="code">  keep
+    this  </pre>
+    <textarea>  a
+b </textarea>
+  </body>
+</html>
+'''
+
+MINIFIED = ('<!DOCTYPE html> <html> <head> '
+            '<!--[if IE]><link rel="stylesheet" href="ie.css"><![endif]--> '
+            '<script>\n      var a  =  "<!-- not a comment -->";\n    '
+            '</script> </head> <body> <p>Hello, world</p> '
+            '<!--# include virtual="/_sgfragments/menu/" --> '
+            '<PRE class="code">  keep\n    this  </pre> '
+            '<textarea>  a\nb </textarea> </body> </html> ')
+
+
+def minify(content, chunk_size):
+    return FilterChain([HTMLMinifyFilter()]).filter(content, chunk_size)
+
+
+class UpperFilter(Filter):
+    content_types = ('text/plain',)
+
+    def feed(self, chunk):
+        return chunk.upper()
+
+
+class HTMLMinifyFilter_Tests(TestCase):
+    def test_minifies_page(self):
+        self.assertEqual(MINIFIED, minify(PAGE, 65536))
+
+    def test_output_does_not_depend_on_chunk_boundaries(self):
+        for chunk_size in (1, 2, 3, 5, 7, 16):
+            self.assertEqual(MINIFIED, minify(PAGE, chunk_size))
+
+    def test_unterminated_comment_is_kept(self):
+        self.assertEqual('<p>a</p> <!-- b', minify('<p>a</p>\n<!-- b', 4))
+
+
+@override_settings(STATIC_GENERATOR_ROOT='test_web_root',
+                   SERVER_NAME='localhost',
+                   STATIC_GENERATOR_FILTERS=[
+                       'staticgenerator.filters.HTMLMinifyFilter'])
+class Filters_Tests(TestCase):
+    def tearDown(self):
+        shutil.rmtree('test_web_root', ignore_errors=True)
+
+    def test_published_content_is_filtered(self):
+        before = get_stats()
+
+        StaticGenerator().publish_from_path('/foo/', content=PAGE)
+
+        self.assertEqual(
+            MINIFIED, open('test_web_root/fresh/foo/index.html%3F').read())
+        after = get_stats()
+        self.assertEqual(before['files'] + 1, after['files'])
+        self.assertEqual(len(PAGE) - len(MINIFIED),
+                         after['bytes_saved'] - before['bytes_saved'])
+
+    def test_filters_apply_to_their_content_types_only(self):
+        with self.settings(STATIC_GENERATOR_FILTERS=[UpperFilter]):
+            self.assertEqual(' a ', apply_filters(' a '))
+            self.assertEqual(' A ', apply_filters(' a ', 'text/plain; a=b'))
+
+    def test_filters_are_chained(self):
+        chain = FilterChain([HTMLMinifyFilter(), UpperFilter()])
+
+        self.assertEqual('<P> A <!-- B', chain.filter('<p>  a <!-- b', 3))
+        self.assertEqual(13, chain.bytes_in)
+        self.assertEqual(12, chain.bytes_out)
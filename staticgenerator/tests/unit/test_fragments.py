@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+from django.http import Http404
+from django.template import Context, Template
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.test import TestCase
+from mock import Mock, patch
+import shutil
+from staticgenerator import StaticGenerator
+from staticgenerator.exceptions import StaticGeneratorException
+from staticgenerator.fragments import (
+    split_fragments, strip_fragment_markers, wrap_fragment
+)
+from staticgenerator.templatetags.staticgenerator_tags import (
+    StaticFragmentNode
+)
+from staticgenerator.views import fragment
+
+
+PAGE = ('<body><!--sg-fragment:sidebar.html--><ul>'
+        '<!--sg-fragment:menu.html--><li/><!--/sg-fragment:menu.html-->'
+        '</ul><!--/sg-fragment:sidebar.html--><p>page</p></body>')
+
+
+@override_settings(STATIC_GENERATOR_ROOT='test_web_root',
+                   SERVER_NAME='localhost')
+class Fragments_Tests(TestCase):
+    def tearDown(self):
+        shutil.rmtree('test_web_root', ignore_errors=True)
+
+    def test_wrap_fragment_rejects_unsafe_names(self):
+        self.assertRaises(StaticGeneratorException,
+                          wrap_fragment, '../settings.py', '')
+
+    def test_split_fragments_replaces_fragments_with_includes(self):
+        skeleton, fragments = split_fragments(PAGE)
+
+        self.assertEqual(
+            '<body><!--# include virtual="/_sgfragments/sidebar.html/" -->'
+            '<p>page</p></body>',
+            skeleton)
+        self.assertEqual(
+            [('sidebar.html',
+              '<ul><!--sg-fragment:menu.html--><li/>'
+              '<!--/sg-fragment:menu.html--></ul>')],
+            fragments)
+
+    def test_strip_fragment_markers_strips_nested_markers(self):
+        self.assertEqual('<body><ul><li/></ul><p>page</p></body>',
+                         strip_fragment_markers(PAGE))
+
+    def test_publish_from_path_publishes_fragments_separately(self):
+        instance = StaticGenerator()
+
+        instance.publish_from_path('/some_path/', content=PAGE)
+
+        self.assertEqual(
+            '<body><!--# include virtual="/_sgfragments/sidebar.html/" -->'
+            '<p>page</p></body>',
+            open('test_web_root/fresh/some_path/index.html%3F').read())
+        self.assertEqual(
+            '<ul><!--# include virtual="/_sgfragments/menu.html/" --></ul>',
+            open('test_web_root/fresh/_sgfragments/sidebar.html/'
+                 'index.html%3F').read())
+        self.assertEqual(
+            '<li/>',
+            open('test_web_root/stale/_sgfragments/menu.html/'
+                 'index.html%3F').read())
+
+    def test_template_tag_wraps_fragment(self):
+        node = StaticFragmentNode(Mock(resolve=lambda context: 'menu.html'))
+        with patch('staticgenerator.templatetags.staticgenerator_tags'
+                   '.get_template') as get_template:
+            get_template.return_value = Template('<li>{{ item }}</li>')
+
+            result = node.render(Context({'item': 'x'}))
+
+        get_template.assert_called_once_with('fragments/menu.html')
+        self.assertEqual('<!--sg-fragment:menu.html--><li>x</li>'
+                         '<!--/sg-fragment:menu.html-->',
+                         result)
+
+    def test_fragment_view_raises_404_for_unsafe_names(self):
+        request = RequestFactory().get('/_sgfragments/../secret/')
+
+        self.assertRaises(Http404, fragment, request, '../secret')
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+from django.test.utils import override_settings
+from django.test import TestCase
+import os
+import shutil
+import time
+from staticgenerator import StaticGenerator
+from staticgenerator.fsck import fsck
+
+
+DAY = 86400
+
+
+def write(filename, content, age=0):
+    directory = os.path.dirname(filename)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    open(filename, 'w').write(content)
+    mtime = time.time() - age
+    os.utime(filename, (mtime, mtime))
+
+
+def age_directories(root, age):
+    mtime = time.time() - age
+    for dirpath, dirnames, filenames in os.walk(root):
+        os.utime(dirpath, (mtime, mtime))
+
+
+@override_settings(STATIC_GENERATOR_ROOT='test_web_root',
+                   SERVER_NAME='localhost',
+                   STATIC_GENERATOR_SHARDED_PREFIXES=['/articles/'])
+class Fsck_Tests(TestCase):
+    def tearDown(self):
+        shutil.rmtree('test_web_root', ignore_errors=True)
+
+    def test_removes_old_temporary_files(self):
+        write('test_web_root/fresh/foo/.sgtmpAb_12x', 'old', age=7200)
+        write('test_web_root/fresh/foo/.sgtmpZZZZZZ', 'new')
+        write('test_web_root/fresh/foo/index.html%3F', 'page', age=7200)
+        write('test_web_root/fresh/foo/tmpabcdef', 'page', age=7200)
+        age_directories('test_web_root', 7200)
+
+        counts = fsck('test_web_root')
+
+        self.assertEqual(['.sgtmpZZZZZZ', 'index.html%3F', 'tmpabcdef'],
+                         sorted(os.listdir('test_web_root/fresh/foo')))
+        self.assertEqual({'tmp_files': 1, 'stale_files': 0, 'directories': 0,
+                          'bytes': 3, 'inodes': 1}, counts)
+
+    def test_pages_named_like_temporary_files_are_not_cached(self):
+        instance = StaticGenerator()
+
+        self.assertEqual(None, instance.get_filename_from_path(
+            u'fresh/foo/.sgtmpabcdef', ''))
+        self.assertEqual(None, instance.get_filename_from_path(
+            u'fresh/.sgtmpabcdef/', ''))
+
+    def test_prunes_stale_files_of_deleted_pages(self):
+        instance = StaticGenerator()
+        instance.publish_from_path('/kept/', content='kept')
+        instance.publish_from_path('/deleted/', content='deleted')
+        instance.publish_from_path('/recent/', content='recent')
+        instance.delete_from_path('/deleted/')
+        instance.delete_from_path('/recent/')
+        for path in ('kept', 'deleted'):
+            filename = 'test_web_root/stale/%s/index.html%%3F' % path
+            mtime = time.time() - 3 * DAY
+            os.utime(filename, (mtime, mtime))
+        age_directories('test_web_root', 7200)
+
+        counts = fsck('test_web_root', stale_age=2 * DAY)
+
+        self.assertEqual(['kept', 'recent'],
+                         sorted(os.listdir('test_web_root/stale')))
+        self.assertEqual(1, counts['stale_files'])
+        self.assertEqual(7, counts['bytes'])
+        self.assertEqual('kept',
+                         open('test_web_root/stale/kept/index.html%3F').read())
+
+    def test_keeps_stale_files_without_stale_age(self):
+        instance = StaticGenerator()
+        instance.publish_from_path('/deleted/', content='deleted')
+        instance.delete_from_path('/deleted/')
+
+        self.assertEqual(0, fsck('test_web_root', now=time.time() + 365 * DAY)
+                         ['stale_files'])
+
+    def test_removes_empty_shard_directories(self):
+        instance = StaticGenerator()
+        instance.publish_from_path('/articles/hello/', content='hello')
+        instance.publish_from_path('/articles/bye/', content='bye')
+        instance.recursive_delete_from_path('/articles/hello/')
+        instance.delete_from_path('/articles/bye/')
+        os.makedirs('test_web_root/fresh/new')
+        age_directories('test_web_root/fresh/articles', 7200)
+
+        counts = fsck('test_web_root')
+
+        self.assertEqual(['new'], os.listdir('test_web_root/fresh'))
+        self.assertEqual(5, counts['directories'])
+        self.assertEqual(5, counts['inodes'])
+
+    def test_dry_run_removes_nothing(self):
+        write('test_web_root/fresh/foo/.sgtmpAb_12x', 'old', age=7200)
+        age_directories('test_web_root', 7200)
+
+        counts = fsck('test_web_root', dry_run=True)
+
+        self.assertEqual(1, counts['tmp_files'])
+        self.assertEqual(1, counts['directories'])
+        self.assertTrue(os.path.exists('test_web_root/fresh/foo/.sgtmpAb_12x'))
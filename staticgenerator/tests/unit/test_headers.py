@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.test import TestCase
+from hashlib import md5
+from mock import patch
+import os
+import re
+import shutil
+from staticgenerator import StaticGenerator, headers
+from staticgenerator.middleware import StaticGeneratorMiddleware
+from staticgenerator.nginx import get_nginx_config
+
+
+@override_settings(STATIC_GENERATOR_ROOT='test_web_root',
+                   SERVER_NAME='localhost',
+                   STATIC_GENERATOR_HEADER_SIDECARS=True)
+class Headers_Tests(TestCase):
+    def setUp(self):
+        self.middleware = StaticGeneratorMiddleware()
+        self.middleware.gen = StaticGenerator()
+        self.middleware.urls = (re.compile(r'^/'),)
+
+    def tearDown(self):
+        shutil.rmtree('test_web_root', ignore_errors=True)
+
+    def publish(self, path, response):
+        request = RequestFactory().get(path)
+        self.middleware.process_view(request, lambda r: None, (), {})
+        self.middleware.process_response(request, response)
+
+    def test_type_suffixes(self):
+        self.assertEqual('', headers.get_type_suffix(None))
+        self.assertEqual('', headers.get_type_suffix('text/html; charset=a'))
+        self.assertEqual('.json',
+                         headers.get_type_suffix('Application/JSON'))
+        self.assertEqual(None, headers.get_type_suffix('image/png'))
+
+    def test_middleware_caches_json_with_sidecar(self):
+        response = HttpResponse('{"a": 1}', content_type='application/json')
+        response['Cache-Control'] = 'max-age=60'
+
+        self.publish('/api/', response)
+
+        self.assertEqual(
+            '{"a": 1}',
+            open('test_web_root/fresh/api/index.html%3F.json').read())
+        self.assertEqual(
+            {'content_type': 'application/json',
+             'cache_control': 'max-age=60',
+             'etag': headers.compute_etag('{"a": 1}')},
+            headers.read_metadata(
+                'test_web_root/fresh/api/index.html%3F.json'))
+        self.assertTrue(os.path.exists(
+            'test_web_root/stale/api/index.html%3F.json.sgmeta'))
+        self.assertFalse(
+            os.path.exists('test_web_root/fresh/api/index.html%3F'))
+
+    def test_middleware_does_not_cache_unknown_types(self):
+        self.publish('/image/', HttpResponse('png', content_type='image/png'))
+
+        self.assertEqual([], [files for _, _, files
+                              in os.walk('test_web_root/fresh') if files])
+
+    def test_stale_files_of_all_types_are_published(self):
+        instance = StaticGenerator()
+        instance.publish_from_path('/feed/', content='<rss/>',
+                                   content_type='application/rss+xml')
+        instance.delete_from_path('/feed/')
+        self.assertEqual([], os.listdir('test_web_root/fresh'))
+
+        instance.publish_stale_path('/feed/', '')
+
+        self.assertEqual(['index.html%3F.rss', 'index.html%3F.rss.sgmeta'],
+                         sorted(os.listdir('test_web_root/fresh/feed')))
+
+    def test_stale_html_page_is_published_without_listing(self):
+        instance = StaticGenerator()
+        instance.publish_from_path('/page/', content='<p/>')
+        instance.delete_from_path('/page/')
+
+        with patch.object(instance.storage, 'listdir') as listdir:
+            instance.publish_stale_path('/page/', '')
+
+        self.assertFalse(listdir.called)
+        self.assertEqual(['index.html%3F', 'index.html%3F.sgmeta'],
+                         sorted(os.listdir('test_web_root/fresh/page')))
+
+    def test_delete_removes_types_and_sidecars_only(self):
+        instance = StaticGenerator()
+        instance.publish_from_path('/a', content='<p/>')
+        instance.publish_from_path('/a', content='{}', variant=',ajax',
+                                   content_type='application/json')
+        instance.publish_from_path('/a.html', content='<p/>')
+
+        instance.delete_from_path('/a')
+
+        self.assertEqual(['a.html', 'a.html.sgmeta'],
+                         sorted(os.listdir('test_web_root/fresh')))
+
+    def test_write_header_maps(self):
+        instance = StaticGenerator()
+        instance.publish_from_path('/a/', content='a',
+                                   cache_control='no-cache')
+        instance.publish_from_path('/b/', content='b')
+
+        self.assertEqual(2, headers.write_header_maps())
+
+        self.assertEqual(
+            '"/a/index.html%3F" "no-cache";\n',
+            open('test_web_root/cache-control.map').read())
+        self.assertEqual(
+            '"/a/index.html%%3F" "\\"%s\\"";\n'
+            '"/b/index.html%%3F" "\\"%s\\"";\n' % (md5('a').hexdigest(),
+                                                   md5('b').hexdigest()),
+            open('test_web_root/etag.map').read())
+
+    def test_nginx_config_restores_types_and_headers(self):
+        config = get_nginx_config()
+
+        self.assertIn('application/json  json;', config)
+        self.assertIn('$sg_variant.json;', config)
+        # Non-index pages have no %3F in their file names, e.g. feed.json
+        self.assertIn('if (-f $request_filename$args$sg_variant.json)',
+                      config)
+        self.assertIn('add_header  Cache-Control $sg_cache_control;', config)
+        self.assertIn('include %s/etag.map;'
+                      % os.path.abspath('test_web_root'), config)
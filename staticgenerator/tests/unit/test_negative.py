@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+from django.http import HttpResponse, HttpResponseNotFound
+from django.http import HttpResponsePermanentRedirect
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.test import TestCase
+import os
+import re
+import shutil
+import threading
+import time
+from mock import patch
+from staticgenerator import StaticGenerator, negative
+from staticgenerator.middleware import StaticGeneratorMiddleware
+from staticgenerator.nginx import get_nginx_config
+from staticgenerator.tests.models import Model
+
+
+@override_settings(STATIC_GENERATOR_ROOT='test_web_root',
+                   SERVER_NAME='localhost',
+                   STATIC_GENERATOR_CACHE_NOT_FOUND=True,
+                   STATIC_GENERATOR_CACHE_REDIRECTS=True)
+class Negative_Tests(TestCase):
+    def setUp(self):
+        self.middleware = StaticGeneratorMiddleware()
+        self.middleware.gen = StaticGenerator()
+        self.middleware.urls = (re.compile(r'^/'),)
+
+    def tearDown(self):
+        shutil.rmtree('test_web_root', ignore_errors=True)
+
+    def test_middleware_caches_unresolved_not_found(self):
+        request = RequestFactory().get('/dead/')
+
+        self.middleware.process_response(request,
+                                         HttpResponseNotFound('gone'))
+
+        self.assertEqual(
+            'gone', open('test_web_root/negative/dead/index.html%3F').read())
+        self.assertFalse(os.path.exists('test_web_root/stale/dead'))
+
+    @override_settings(STATIC_GENERATOR_CACHE_NOT_FOUND=False)
+    def test_middleware_does_not_cache_not_found_by_default(self):
+        request = RequestFactory().get('/dead/')
+
+        self.middleware.process_response(request,
+                                         HttpResponseNotFound('gone'))
+
+        self.assertFalse(os.path.exists('test_web_root/negative'))
+
+    @override_settings(STATIC_GENERATOR_FILTERS=[
+        'staticgenerator.filters.HTMLMinifyFilter'])
+    def test_middleware_filters_not_found_by_content_type(self):
+        request = RequestFactory().get('/dead/')
+        self.middleware.process_view(request, lambda r: None, (), {})
+        body = '<p>  gone  </p>'
+
+        self.middleware.process_response(
+            request, HttpResponseNotFound(body, content_type='text/plain'))
+
+        self.assertEqual(
+            body, open('test_web_root/negative/dead/index.html%3F').read())
+
+    def test_middleware_caches_redirects(self):
+        request = RequestFactory().get('/old/', {'a': 'b'})
+        self.middleware.process_view(request, lambda r: None, (), {})
+
+        self.middleware.process_response(
+            request, HttpResponsePermanentRedirect('/new/'))
+
+        self.assertEqual(
+            (301, '/old/?a=b', '/new/'),
+            negative.parse_redirect(
+                open('test_web_root/redirects/old/index.html%3Fa%3Db')
+                .read()))
+
+    def test_redirects_are_keyed_by_raw_request_uri(self):
+        request = RequestFactory().get(u'/caf\xe9/a%20b/')
+        self.middleware.process_view(request, lambda r: None, (), {})
+
+        self.middleware.process_response(
+            request, HttpResponsePermanentRedirect('/new/'))
+        negative.write_redirect_maps()
+
+        self.assertEqual('"/caf%C3%A9/a%20b/" "/new/";\n',
+                         open('test_web_root/redirects-301.map').read())
+
+    def test_saving_model_does_not_construct_generators(self):
+        negative.get_generator()
+        with patch('staticgenerator.StaticGenerator.get_server_name') as name:
+            Model(url='/dead/').save()
+            Model(url='/dead/').save()
+
+        self.assertFalse(name.called)
+
+    def test_write_redirect_maps(self):
+        StaticGenerator().publish_redirect_from_path(
+            '/old/', 'a=b', 302, '/ne"w/')
+
+        self.assertEqual(1, negative.write_redirect_maps())
+
+        self.assertEqual('',
+                         open('test_web_root/redirects-301.map').read())
+        self.assertEqual('"/old/?a=b" "/ne\\"w/";\n',
+                         open('test_web_root/redirects-302.map').read())
+
+    def test_publishing_resource_deletes_negative_entry(self):
+        instance = StaticGenerator()
+        instance.publish_not_found_from_path('/dead/', '', 'gone')
+
+        instance.publish_from_path('/dead/', '', 'alive')
+
+        self.assertFalse(os.path.exists(
+            'test_web_root/negative/dead/index.html%3F'))
+
+    def test_saving_model_deletes_negative_entries(self):
+        instance = StaticGenerator()
+        instance.publish_not_found_from_path('/dead/', '', 'gone',
+                                             variant=',ajax')
+        instance.publish_redirect_from_path('/dead/', '', 301, '/new/')
+
+        Model(url='/dead/').save()
+
+        self.assertFalse(os.path.exists(
+            'test_web_root/negative/dead/index.html%3F,ajax'))
+        self.assertFalse(os.path.exists(
+            'test_web_root/redirects/dead/index.html%3F'))
+
+    def test_prune_removes_expired_and_oldest_entries(self):
+        instance = StaticGenerator()
+        for i in range(4):
+            instance.publish_not_found_from_path('/dead/%d/' % i, '', '')
+            filename = 'test_web_root/negative/dead/%d/index.html%%3F' % i
+            os.utime(filename, (1000 + i, 1000 + i))
+
+        removed = negative.prune(ttl=10, max_entries=2, now=1012)
+
+        self.assertEqual(2, removed)
+        self.assertEqual(
+            ['2', '3'], sorted(os.listdir('test_web_root/negative/dead')))
+
+    @override_settings(STATIC_GENERATOR_NEGATIVE_PRUNE_INTERVAL=1)
+    def test_entries_are_pruned_in_background(self):
+        pruned = threading.Event()
+        threads = []
+
+        def prune(root):
+            threads.append(threading.current_thread())
+            pruned.set()
+
+        with patch('staticgenerator.negative.prune', side_effect=prune):
+            StaticGenerator().publish_not_found_from_path('/dead/', '', '')
+            self.assertTrue(pruned.wait(5))
+
+        self.assertNotEqual(threading.current_thread(), threads[0])
+
+    def test_nginx_config_serves_negative_entries(self):
+        config = get_nginx_config()
+
+        self.assertIn('include %s/redirects-301.map;'
+                      % os.path.abspath('test_web_root'), config)
+        self.assertIn('error_page 418 = @negative;', config)
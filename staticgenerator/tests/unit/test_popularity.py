@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.test import TestCase
+from mock import patch
+import gzip
+import os
+import re
+import shutil
+import time
+from staticgenerator import StaticGenerator, popularity
+from staticgenerator.middleware import StaticGeneratorMiddleware
+
+
+DB = 'test_web_root/popularity.db'
+
+LOG = '''\
+127.0.0.1 - - [10/Oct/2014:13:55:36 +0000] "GET /a/ HTTP/1.1" 200 12 "-" "UA"
+127.0.0.1 - - [10/Oct/2014:13:55:37 +0000] "GET /a/ HTTP/1.1" 304 0 "-" "UA"
+127.0.0.1 - - [10/Oct/2014:13:55:38 +0000] "GET /b/?c=d HTTP/1.1" 200 5 "-" "-"
+127.0.0.1 - - [10/Oct/2014:13:55:38 +0000] "POST /a/ HTTP/1.1" 200 5 "-" "-"
+127.0.0.1 - - [10/Oct/2014:13:55:39 +0000] "GET /a/ HTTP/1.1" 404 5 "-" "-"
+127.0.0.1 - - [10/Oct/2014:13:55:39 +0000] "GET /admin/ HTTP/1.1" 200 5 "-" "-"
+garbage
+'''
+
+
+@override_settings(STATIC_GENERATOR_ROOT='test_web_root',
+                   SERVER_NAME='localhost',
+                   STATIC_GENERATOR_POPULARITY_DB=DB,
+                   STATIC_GENERATOR_POPULARITY_SAMPLE_RATE=1.0,
+                   STATIC_GENERATOR_POPULARITY_HALF_LIFE=100)
+class Popularity_Tests(TestCase):
+    def setUp(self):
+        os.makedirs('test_web_root')
+        self.table = popularity.get_table()
+
+    def tearDown(self):
+        popularity.recorder.counts.clear()
+        shutil.rmtree('test_web_root', ignore_errors=True)
+
+    def test_parse_log_time(self):
+        self.assertEqual(
+            1412949336, popularity.parse_log_time('10/Oct/2014:15:55:36 +0200'))
+
+    def test_scores_decay(self):
+        self.table.add({'/old/': (8, 0)}, now=1000)
+        self.table.add({'/new/': (2, 1), '/old/': (0, 2)}, now=1200)
+
+        self.assertEqual([('/old/', 4.0), ('/new/', 3.0)],
+                         self.table.top(now=1200))
+        self.assertEqual([('/old/', 2.0)], self.table.top(limit=1, now=1300))
+
+    def test_top_fraction_and_prefix(self):
+        self.table.add(dict(('/a/%d/' % n, (n, 0)) for n in range(1, 201)),
+                       now=1000)
+        self.table.add({'/b/': (1000, 0)}, now=1000)
+
+        self.assertEqual(['/b/', '/a/200/'],
+                         [path for path, score
+                          in self.table.top(fraction=0.01, now=1000)])
+        self.assertEqual(['/a/200/', '/a/199/'],
+                         [path for path, score
+                          in self.table.top(fraction=0.01, prefix='/a/',
+                                            now=1000)])
+
+    def test_prune(self):
+        self.table.add({'/old/': (1, 0), '/new/': (1, 0)}, now=1000)
+        self.table.add({'/new/': (1, 0)}, now=1500)
+
+        self.assertEqual(1, self.table.prune(0.5, now=1500))
+        self.assertEqual(['/new/'],
+                         [path for path, score in self.table.top(now=1500)])
+
+    def test_ingest_log(self):
+        is_cacheable = lambda path: not path.startswith('/admin/')
+
+        counted = popularity.ingest_log(LOG.splitlines(True), self.table,
+                                        is_cacheable, chunk_size=2)
+
+        self.assertEqual(3, counted)
+        self.assertEqual(['/a/', '/b/?c=d'],
+                         [path for path, score
+                          in self.table.top(now=1412949339)])
+
+    def test_ingest_file_skips_ingested_lines(self):
+        is_cacheable = lambda path: not path.startswith('/admin/')
+        lines = LOG.splitlines(True)
+        with open('test_web_root/access.log', 'w') as f:
+            f.writelines(lines[:2] + ['127.0.0.1 - - [10/Oct/2014:13:55:38'])
+
+        with open('test_web_root/access.log') as f:
+            self.assertEqual(2, popularity.ingest_file(f, self.table,
+                                                       is_cacheable))
+        with open('test_web_root/access.log', 'w') as f:
+            f.writelines(lines)
+        with open('test_web_root/access.log') as f:
+            self.assertEqual(1, popularity.ingest_file(f, self.table,
+                                                       is_cacheable))
+        # Compressed after rotation
+        with open('test_web_root/access.log') as f:
+            gzip.open('test_web_root/access.log.1.gz', 'wb').write(f.read())
+        with gzip.open('test_web_root/access.log.1.gz') as f:
+            self.assertEqual(0, popularity.ingest_file(f, self.table,
+                                                       is_cacheable))
+
+        self.assertEqual([('/a/', 2), ('/b/?c=d', 1)],
+                         [(path, round(score)) for path, score
+                          in self.table.top(now=1412949338)])
+
+    def test_log_and_middleware_count_the_same_path(self):
+        middleware = StaticGeneratorMiddleware()
+        middleware.gen = StaticGenerator()
+        middleware.urls = (re.compile(r'^/'),)
+        request = RequestFactory().get('/caf%C3%A9/?q=a%20b')
+        middleware.process_view(request, lambda r: None, (), {})
+        line = ('127.0.0.1 - - [10/Oct/2014:13:55:36 +0000] '
+                '"GET /caf%C3%A9/?q=a%20b HTTP/1.1" 200 12 "-" "UA"\n')
+
+        self.assertEqual([u'/caf\xe9/?q=a%20b'],
+                         popularity.recorder.counts.keys())
+        self.assertEqual(u'/caf\xe9/?q=a%20b',
+                         popularity.parse_log_line(line)[0])
+
+    def test_middleware_records_misses_and_hits(self):
+        middleware = StaticGeneratorMiddleware()
+        middleware.gen = StaticGenerator()
+        middleware.urls = (re.compile(r'^/'),)
+        factory = RequestFactory()
+
+        for _ in range(2):
+            request = factory.get('/page/', {'a': 'b'})
+            middleware.process_view(request, lambda r: None, (), {})
+            middleware.process_response(request, HttpResponse('page'))
+
+        self.assertEqual({'/page/?a=b': [1.0, 1.0]},
+                         popularity.recorder.counts)
+        popularity.recorder.flush()
+        self.assertEqual([u'/page/?a=b'],
+                         [path for path, score in self.table.top()])
+        self.assertEqual({}, popularity.recorder.counts)
+
+    @override_settings(STATIC_GENERATOR_POPULARITY_FLUSH_INTERVAL=0.01)
+    def test_counts_are_flushed_in_background(self):
+        recorder = popularity.Recorder()
+        with patch.object(recorder, 'flush', wraps=recorder.flush) as flush:
+            recorder.record('/a/', hit=True)
+            self.assertFalse(flush.called)
+
+            for _ in range(500):
+                if self.table.top():
+                    break
+                time.sleep(0.01)
+
+        self.assertEqual([u'/a/'], [path for path, score in self.table.top()])
+
+    @patch('staticgenerator.crawler.Crawler.crawl')
+    def test_rebuild_popular(self, crawl):
+        crawl.return_value = 1
+        self.table.add({'/a/': (2, 0), '/a/b/': (1, 0), '/c/': (3, 0)})
+
+        with patch('staticgenerator.crawler.Crawler.__init__') as init:
+            init.return_value = None
+            self.assertEqual(
+                1, popularity.rebuild_popular('/a/', fraction=0.5))
+
+        self.assertEqual(['/a/'], init.call_args[0][0])
+        self.assertEqual(0, init.call_args[1]['max_depth'])
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+import BaseHTTPServer
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.test import TestCase
+from mock import patch
+import re
+import shutil
+import threading
+import staticgenerator
+from staticgenerator import StaticGenerator, purge
+from staticgenerator.middleware import StaticGeneratorMiddleware
+from staticgenerator.tests.models import Model
+
+
+class PurgeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Records purge requests and answers with the server's status"""
+    protocol_version = 'HTTP/1.1'
+
+    def handle_one_request(self):
+        self.raw_requestline = self.rfile.readline(65537)
+        if not self.raw_requestline:
+            self.close_connection = 1
+            return
+        if not self.parse_request():
+            return
+        self.server.requests.append(
+            (self.command, self.path, dict(self.headers.items())))
+        self.send_response(self.server.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PurgeStandIn(BaseHTTPServer.HTTPServer):
+    allow_reuse_address = True
+
+    def __init__(self, status=200):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           PurgeHandler)
+        self.requests = []
+        self.status = status
+        thread = threading.Thread(target=self.serve_forever,
+                                  kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/' % self.server_address[1]
+
+    def keys(self):
+        return [request[2]['surrogate-key'].split()
+                for request in self.requests]
+
+
+class Keys_Tests(TestCase):
+    def test_page_keys(self):
+        self.assertEqual([u'path:/blog/post', u'tree:/', u'tree:/blog/'],
+                         purge.get_page_keys('/blog/post?page=2'))
+        self.assertEqual([u'path:/', u'tree:/'], purge.get_page_keys('/'))
+        self.assertEqual([u'path:/a%20b/', u'tree:/', u'tree:/a%20b/'],
+                         purge.get_page_keys(u'/a b/'))
+
+    def test_long_keys_are_hashed(self):
+        key = purge.get_path_keys('/' + 'a' * 300)[0]
+
+        self.assertTrue(re.match(r'^path:[0-9a-f]{32}$', key))
+
+    def test_resource_keys(self):
+        instance = Model(pk=3, url='/3/')
+
+        self.assertEqual([u'model:tests.model', u'model:tests.model:3'],
+                         purge.get_resource_keys(instance))
+        self.assertEqual([u'model:tests.model'],
+                         purge.get_resource_keys(Model.objects))
+        self.assertEqual([], purge.get_resource_keys('/3/'))
+
+    def test_add_surrogate_keys_merges_keys(self):
+        response = HttpResponse()
+        purge.add_surrogate_keys(response, Model(pk=3), 'custom')
+        purge.add_surrogate_keys(response, Model(pk=4), 'custom')
+
+        self.assertEqual('model:tests.model model:tests.model:3 custom '
+                         'model:tests.model:4', response['Surrogate-Key'])
+
+    @override_settings(STATIC_GENERATOR_SURROGATE_KEY_HEADER='Cache-Tag')
+    def test_cache_tag_keys_are_comma_separated(self):
+        response = purge.add_surrogate_keys(HttpResponse(), 'a', 'b')
+
+        self.assertEqual('a,b', response['Cache-Tag'])
+
+
+@override_settings(STATIC_GENERATOR_ROOT='test_web_root',
+                   SERVER_NAME='localhost',
+                   STATIC_GENERATOR_SURROGATE_KEYS=True)
+class Middleware_Tests(TestCase):
+    def setUp(self):
+        self.middleware = StaticGeneratorMiddleware()
+        self.middleware.gen = StaticGenerator()
+        self.middleware.urls = (re.compile(r'^/'),)
+
+    def tearDown(self):
+        shutil.rmtree('test_web_root', ignore_errors=True)
+
+    def process(self, path, response, **cookies):
+        request = RequestFactory().get(path)
+        request.COOKIES.update(cookies)
+        self.middleware.process_view(request, lambda r: None, (), {})
+        return self.middleware.process_response(request, response)
+
+    def test_cacheable_responses_are_tagged(self):
+        response = HttpResponse('post')
+        purge.add_surrogate_keys(response, Model(pk=3))
+
+        response = self.process('/blog/post', response)
+
+        self.assertEqual('model:tests.model model:tests.model:3 '
+                         'path:/blog/post tree:/ tree:/blog/',
+                         response['Surrogate-Key'])
+
+    def test_excluded_responses_are_not_tagged(self):
+        self.middleware.urls = ()
+
+        response = self.process('/blog/post', HttpResponse('post'))
+
+        self.assertFalse(response.has_header('Surrogate-Key'))
+
+    def test_bypass_cookie_is_only_touched_if_sent(self):
+        response = self.process('/a/', HttpResponse('a'))
+        self.assertEqual({}, response.cookies)
+
+        response = self.process('/b/', HttpResponse('b'), _sgb='1')
+        self.assertEqual('', response.cookies['_sgb'].value)
+
+
+@override_settings(STATIC_GENERATOR_ROOT='test_web_root',
+                   SERVER_NAME='localhost',
+                   STATIC_GENERATOR_PURGE_BATCH_SIZE=2)
+class Purge_Tests(TestCase):
+    def setUp(self):
+        self.server = PurgeStandIn()
+        self.settings = override_settings(
+            STATIC_GENERATOR_PURGE_PROXIES=[self.server.url])
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree('test_web_root', ignore_errors=True)
+
+    def test_quick_delete_purges_path_and_model_keys(self):
+        staticgenerator.quick_delete('/1/', Model(pk=2, url='/2/'))
+        purge.flush()
+
+        self.assertEqual(['PURGE', 'PURGE'],
+                         [request[0] for request in self.server.requests])
+        self.assertEqual([[u'path:/1/', u'path:/2/'],
+                          [u'model:tests.model', u'model:tests.model:2']],
+                         self.server.keys())
+
+    def test_recursive_delete_purges_tree_keys(self):
+        with override_settings(STATIC_GENERATOR_PURGE_METHOD='BAN'):
+            staticgenerator.recursive_delete('/blog/', '/news/item')
+            purge.flush()
+
+        self.assertEqual([('BAN', '/')],
+                         [request[:2] for request in self.server.requests])
+        self.assertEqual([[u'tree:/blog/', u'tree:/news/']],
+                         self.server.keys())
+
+    def test_batch_collects_keys(self):
+        with purge.batch():
+            staticgenerator.quick_delete('/1/')
+            staticgenerator.quick_delete('/1/', '/2/')
+        purge.flush()
+
+        self.assertEqual([[u'path:/1/', u'path:/2/']], self.server.keys())
+
+    def test_every_proxy_is_purged(self):
+        other = PurgeStandIn(status=500)
+        try:
+            with override_settings(STATIC_GENERATOR_PURGE_PROXIES=[
+                    other.url, 'http://127.0.0.1:1/', self.server.url]):
+                staticgenerator.quick_delete('/1/')
+                purge.flush()
+        finally:
+            other.shutdown()
+            other.server_close()
+
+        self.assertEqual([[u'path:/1/']], other.keys())
+        self.assertEqual([[u'path:/1/']], self.server.keys())
+
+    def test_purges_are_sent_in_background(self):
+        threads = []
+
+        def send(keys):
+            threads.append(threading.current_thread())
+            return 0
+
+        with patch.object(purge.get_purger(), 'send', side_effect=send):
+            staticgenerator.quick_delete('/1/')
+            purge.flush()
+
+        self.assertEqual(1, len(threads))
+        self.assertNotEqual(threading.current_thread(), threads[0])
+
+    def test_failed_purges_are_counted(self):
+        purger = purge.Purger([self.server.url, 'http://127.0.0.1:1/'],
+                              batch_size=1, timeout=1)
+
+        self.assertEqual(1, purger.send(['a', 'b', 'a']))
+        self.assertEqual([['a'], ['b']], self.server.keys())
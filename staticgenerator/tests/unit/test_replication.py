@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+from django.test.utils import override_settings
+from django.test import TestCase
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from staticgenerator import StaticGenerator, StaticGeneratorException
+from staticgenerator.replication import (
+    FilesystemTarget, PushTarget, Receiver, Replicator, get_replicator,
+    sign_item
+)
+
+
+@override_settings(STATIC_GENERATOR_ROOT='test_web_root',
+                   SERVER_NAME='localhost')
+class Replication_Tests(TestCase):
+    def setUp(self):
+        self.replica = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree('test_web_root', ignore_errors=True)
+        shutil.rmtree(self.replica, ignore_errors=True)
+
+    def assertReplicated(self, root, name, content):
+        self.assertEqual(
+            content, open(os.path.join(root, 'fresh', name)).read())
+        self.assertEqual(
+            os.stat(os.path.join(root, 'fresh', name)).st_ino,
+            os.stat(os.path.join(root, 'stale', name)).st_ino)
+
+    def test_publish_from_path_replicates_to_local_roots(self):
+        with override_settings(STATIC_GENERATOR_REPLICA_ROOTS=[self.replica]):
+            StaticGenerator().publish_from_path('/foo/', content='content')
+            self.assertTrue(get_replicator().flush(timeout=5))
+            stats = get_replicator().stats()[self.replica]
+
+        self.assertReplicated(self.replica, 'foo/index.html%3F', 'content')
+        self.assertEqual(1, stats['written'])
+
+    def start_receiver(self, secret=None, **kwargs):
+        server = Receiver(('127.0.0.1', 0), self.replica, secret, **kwargs)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+    def test_push_target_writes_through_receiver(self):
+        server = self.start_receiver()
+        target = PushTarget(*server.server_address)
+        try:
+            target.write([('fresh/a/index.html%3F', 'stale/a/index.html%3F',
+                           'first'),
+                          ('fresh/b', None, 'second\nline')])
+        finally:
+            target.close()
+            server.shutdown()
+            server.server_close()
+
+        self.assertReplicated(self.replica, 'a/index.html%3F', 'first')
+        self.assertEqual('second\nline',
+                         open(os.path.join(self.replica, 'fresh/b')).read())
+        self.assertFalse(os.path.exists(os.path.join(self.replica, 'stale/b')))
+
+    def test_failures_are_counted(self):
+        replicator = Replicator([PushTarget('127.0.0.1', 1, timeout=1)])
+
+        replicator.replicate('fresh/a', 'stale/a', 'content')
+        replicator.flush(timeout=5)
+
+        stats = replicator.stats()['push://127.0.0.1:1']
+        self.assertEqual(1, stats['failed'])
+        self.assertEqual(0, stats['queued'])
+        self.assertTrue(stats['last_error'])
+
+    def test_target_rejects_names_outside_root(self):
+        replicator = Replicator([FilesystemTarget(self.replica)])
+
+        replicator.replicate('fresh/../../escape', None, 'content')
+        replicator.flush(timeout=5)
+
+        self.assertEqual(1, replicator.stats()[self.replica]['failed'])
+
+    def test_receiver_rejects_short_reads(self):
+        server = self.start_receiver()
+        sock = socket.create_connection(server.server_address)
+        try:
+            sock.sendall(json.dumps({'fresh': 'fresh/a', 'stale': None,
+                                     'size': 10}) + '\ncut')
+            sock.shutdown(socket.SHUT_WR)
+            reply = sock.makefile('rb').readline()
+        finally:
+            sock.close()
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual('ERR short read\n', reply)
+        self.assertFalse(os.path.exists(os.path.join(self.replica, 'fresh')))
+
+    def test_receiver_checks_signatures(self):
+        server = self.start_receiver(secret='secret')
+        try:
+            with self.assertRaises(StaticGeneratorException):
+                PushTarget(*server.server_address).write(
+                    [('fresh/a', None, 'unsigned')])
+            with self.assertRaises(StaticGeneratorException):
+                PushTarget(*server.server_address, secret='wrong').write(
+                    [('fresh/a', None, 'forged')])
+            PushTarget(*server.server_address, secret='secret').write(
+                [('fresh/b', None, 'signed')])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertFalse(os.path.exists(os.path.join(self.replica, 'fresh/a')))
+        self.assertEqual('signed',
+                         open(os.path.join(self.replica, 'fresh/b')).read())
+
+    def test_receiver_rejects_large_files_before_reading(self):
+        server = self.start_receiver(max_size=5)
+        sock = socket.create_connection(server.server_address, 5)
+        try:
+            # Without the content, reading it would block until the timeout
+            sock.sendall(json.dumps({'fresh': 'fresh/a', 'stale': None,
+                                     'size': 6}) + '\n')
+            reply = sock.makefile('rb').readline()
+        finally:
+            sock.close()
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual('ERR too large\n', reply)
+
+    def test_receiver_rejects_replayed_and_expired_files(self):
+        def frame(content, timestamp, nonce):
+            return json.dumps({
+                'fresh': 'fresh/a', 'stale': None, 'size': len(content),
+                'time': timestamp, 'nonce': nonce,
+                'hmac': sign_item('secret', 'fresh/a', None, content,
+                                  timestamp, nonce)}) + '\n' + content
+
+        server = self.start_receiver(secret='secret', max_age=60)
+        now = int(time.time())
+        sock = socket.create_connection(server.server_address, 5)
+        try:
+            sock.sendall(frame('new', now, 'a') + frame('old', now, 'a') +
+                         frame('old', now - 61, 'b'))
+            reader = sock.makefile('rb')
+            replies = [reader.readline() for i in range(3)]
+        finally:
+            sock.close()
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(['OK\n', 'ERR expired or replayed\n',
+                          'ERR expired or replayed\n'], replies)
+        self.assertEqual('new',
+                         open(os.path.join(self.replica, 'fresh/a')).read())
+
+    def test_public_receiver_requires_secret(self):
+        with self.assertRaises(StaticGeneratorException):
+            Receiver(('0.0.0.0', 0), self.replica)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+from django.test.utils import override_settings
+from django.test import TestCase
+import hashlib
+import os
+import shutil
+from staticgenerator import StaticGenerator, sharding
+from staticgenerator.nginx import get_nginx_config
+
+
+def sharded(key):
+    digest = hashlib.md5(key).hexdigest()
+    return '~%s/~%s/%s' % (digest[:2], digest[2:4], key)
+
+
+@override_settings(STATIC_GENERATOR_ROOT='test_web_root',
+                   SERVER_NAME='localhost',
+                   STATIC_GENERATOR_SHARDED_PREFIXES=['/articles/'])
+class Sharding_Tests(TestCase):
+    def tearDown(self):
+        shutil.rmtree('test_web_root', ignore_errors=True)
+
+    def test_shard_path(self):
+        self.assertEqual('/articles/%s/' % sharded('hello'),
+                         sharding.shard_path('/articles/hello/'))
+        self.assertEqual('/articles/%s/comments/' % sharded('hello'),
+                         sharding.shard_path('/articles/hello/comments/'))
+        self.assertEqual('/articles/%s' % sharded('hello'),
+                         sharding.shard_path('/articles/hello'))
+        self.assertEqual('/articles/', sharding.shard_path('/articles/'))
+        self.assertEqual('/other/hello/',
+                         sharding.shard_path('/other/hello/'))
+
+    @override_settings(STATIC_GENERATOR_SHARD_LEVELS=1)
+    def test_shard_levels(self):
+        self.assertEqual(
+            '/articles/~%s/hello/' % hashlib.md5('hello').hexdigest()[:2],
+            sharding.shard_path('/articles/hello/'))
+
+    def test_publish_and_delete_use_shards(self):
+        instance = StaticGenerator()
+        instance.publish_from_path('/articles/hello/', content='hello')
+        fresh = 'test_web_root/fresh/articles/%s/index.html%%3F' % (
+            sharded('hello'))
+        stale = 'test_web_root/stale/articles/%s/index.html%%3F' % (
+            sharded('hello'))
+        self.assertEqual('hello', open(fresh).read())
+        self.assertEqual('hello', open(stale).read())
+
+        instance.delete_from_path('/articles/hello/')
+        self.assertFalse(os.path.exists(fresh))
+
+        instance.publish_stale_path('/articles/hello/', '')
+        self.assertEqual('hello', open(fresh).read())
+
+        instance.recursive_delete_from_path('/articles/hello/')
+        self.assertFalse(os.path.exists(os.path.dirname(fresh)))
+
+    def test_reshard_moves_entries_into_shards(self):
+        os.makedirs('test_web_root/fresh/articles/hello')
+        open('test_web_root/fresh/articles/hello/index.html%3F',
+             'w').write('hello')
+        open('test_web_root/fresh/articles/bye,ajax.json', 'w').write('{}')
+        os.makedirs('test_web_root/fresh/articles/%s' % sharded('old'))
+        os.makedirs('test_web_root/fresh/articles/old')
+
+        self.assertEqual(2, sharding.reshard())
+
+        self.assertEqual(
+            'hello',
+            open('test_web_root/fresh/articles/%s/index.html%%3F'
+                 % sharded('hello')).read())
+        self.assertTrue(os.path.exists(
+            'test_web_root/fresh/articles/%s,ajax.json' % sharded('bye')))
+        self.assertEqual(
+            sorted(set(name[:3] for name in (sharded('hello'), sharded('bye'),
+                                             sharded('old')))),
+            sorted(os.listdir('test_web_root/fresh/articles')))
+
+    def test_reshard_keeps_directory_names_whole(self):
+        for slug in ('a,b', 'data.json'):
+            os.makedirs('test_web_root/fresh/articles/%s' % slug)
+            open('test_web_root/fresh/articles/%s/index.html%%3F' % slug,
+                 'w').write(slug)
+
+        self.assertEqual(2, sharding.reshard())
+
+        for slug in ('a,b', 'data.json'):
+            instance = StaticGenerator()
+            self.assertEqual(slug, open(
+                instance.get_filename_from_path(
+                    u'fresh' + sharding.shard_path(u'/articles/%s/' % slug),
+                    '')).read())
+
+    def test_nginx_config_looks_up_sharded_files(self):
+        config = get_nginx_config()
+
+        self.assertIn('if ($uri ~ "^(\\/articles\\/)([^/]+)(.*)$") {', config)
+        self.assertIn('set_md5 $sg_shard_md5 $sg_shard_key;', config)
+        self.assertIn('if ($sg_shard_md5 ~ "^(.{2})(.{2})") {', config)
+        self.assertIn('if (-f $document_root$sg_base/index.html%3F', config)
+        self.assertIn('rewrite ^ $sg_base/index.html%3F', config)
@@ -297,6 +297,13 @@ class StaticGeneratorWithWebRootSetting_Tests(TestCase):
         self.assertNotIn(call('test_web_root/stale/some_path'),
                          remove.call_args_list)
 
+    def test_delete_from_path_ignores_uncacheable_paths(self):
+        instance = StaticGenerator()
+        long_path = '/%s/' % ('a' * 300)
+
+        instance.delete_from_path(long_path)
+        instance.recursive_delete_from_path(long_path)
+
     def test_publish_loops_through_all_resources(self):
         instance = StaticGenerator('/some_path_1', '/some_path_2')
         rename = Mock(wraps=os.rename)
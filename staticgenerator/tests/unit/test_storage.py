@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+from django.test.utils import override_settings
+from django.test import TestCase
+import SocketServer
+import socket
+import threading
+from staticgenerator import StaticGenerator, StaticGeneratorException
+from staticgenerator.storage import (
+    Storage, escape_memcached_key, get_storage
+)
+
+
+class MemcachedHandler(SocketServer.StreamRequestHandler):
+    """Speaks the subset of the memcached text protocol used by the
+    storage"""
+
+    def handle(self):
+        self.server.connections += 1
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.split()
+            command, key = parts[0], parts[1]
+            self.server.commands.append(command)
+            with self.server.lock:
+                if command == 'mg' and self.server.meta_commands:
+                    self.reply('HD' if key in self.server.items else 'EN')
+                elif command == 'mg':
+                    self.reply('ERROR')
+                elif command in ('get', 'gets'):
+                    self.get(command, key)
+                elif command == 'delete':
+                    found = self.server.items.pop(key, None) is not None
+                    self.reply('DELETED' if found else 'NOT_FOUND')
+                else:
+                    value = self.rfile.read(int(parts[4]) + 2)[:-2]
+                    self.store(command, key, value, parts[5:])
+
+    def get(self, command, key):
+        if key in self.server.items:
+            value, cas = self.server.items[key]
+            self.wfile.write('VALUE %s 0 %d%s\r\n%s\r\n' % (
+                key, len(value), ' %d' % cas if command == 'gets' else '',
+                value))
+        self.reply('END')
+
+    def store(self, command, key, value, extra):
+        items = self.server.items
+        if command == 'append':
+            if key not in items:
+                return self.reply('NOT_STORED')
+            value = items[key][0] + value
+        elif command == 'add' and key in items:
+            return self.reply('NOT_STORED')
+        elif command == 'cas':
+            if key not in items:
+                return self.reply('NOT_FOUND')
+            if items[key][1] != int(extra[0]):
+                return self.reply('EXISTS')
+        if len(value) > self.server.max_item_size:
+            return self.reply('SERVER_ERROR object too large for cache')
+        self.server.cas += 1
+        items[key] = (value, self.server.cas)
+        self.reply('STORED')
+
+    def reply(self, line):
+        self.wfile.write(line + '\r\n')
+
+
+class MemcachedStandIn(SocketServer.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, max_item_size=1024 * 1024):
+        SocketServer.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0),
+                                                 MemcachedHandler)
+        self.items = {}
+        self.cas = 0
+        self.connections = 0
+        self.commands = []
+        self.meta_commands = True
+        self.max_item_size = max_item_size
+        self.lock = threading.Lock()
+        thread = threading.Thread(target=self.serve_forever,
+                                  kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+
+    def get(self, key):
+        return self.items.get(key, (None,))[0]
+
+
+class DictStorage(Storage):
+    """Implements only the methods a backend has to"""
+
+    def __init__(self, root):
+        super(DictStorage, self).__init__(root)
+        self.files = {}
+
+    def write(self, filename, content, stale_filename=None):
+        self.files[filename] = content
+        return True
+
+    def read(self, filename):
+        return self.files.get(filename)
+
+    def listdir(self, directory):
+        return []
+
+    def delete(self, filenames):
+        for filename in filenames:
+            self.files.pop(filename, None)
+
+    def delete_prefix(self, directory):
+        self.files.clear()
+
+
+class Storage_Tests(TestCase):
+    def test_default_methods(self):
+        storage = DictStorage('root')
+        storage.write('root/stale/a', 'old')
+        storage.write('root/fresh/b', 'new')
+
+        self.assertTrue(storage.exists('root/stale/a'))
+        self.assertFalse(storage.exists('root/fresh/a'))
+        storage.link_stale('root/stale/a', 'root/fresh/a')
+        storage.link_stale('root/stale/a', 'root/fresh/b')
+        storage.link_stale('root/stale/c', 'root/fresh/c')
+
+        self.assertEqual({'root/stale/a': 'old', 'root/fresh/a': 'old',
+                          'root/fresh/b': 'new'}, storage.files)
+
+
+@override_settings(STATIC_GENERATOR_ROOT='test_web_root',
+                   SERVER_NAME='localhost',
+                   STATIC_GENERATOR_STORAGE=
+                   'staticgenerator.storage.MemoryStorage')
+class MemoryStorage_Tests(TestCase):
+    def tearDown(self):
+        get_storage().clear()
+
+    @override_settings(STATIC_GENERATOR_REPLICA_ROOTS=['/replica'])
+    def test_filesystem_features_are_refused(self):
+        with self.assertRaises(StaticGeneratorException):
+            get_storage()
+
+    def test_publish_and_delete(self):
+        instance = StaticGenerator()
+        instance.publish_from_path('/foo/', content='foo')
+        instance.publish_from_path('/foo/', content='ajax', is_ajax=True)
+        instance.publish_from_path('/foo/bar/', content='bar')
+
+        files = get_storage().files
+        self.assertEqual('foo', files['test_web_root/fresh/foo/index.html%3F'])
+        self.assertEqual('foo', files['test_web_root/stale/foo/index.html%3F'])
+
+        instance.delete_from_path('/foo/')
+        self.assertEqual(['test_web_root/fresh/foo/bar/index.html%3F'],
+                         sorted(name for name in files if 'fresh' in name))
+
+        instance.publish_stale_path('/foo/', '')
+        self.assertEqual('foo', files['test_web_root/fresh/foo/index.html%3F'])
+
+        instance.recursive_delete_from_path('/foo/')
+        self.assertEqual([], [name for name in files if 'fresh' in name])
+
+
+class MemcachedStorage_Tests(TestCase):
+    def setUp(self):
+        self.server = MemcachedStandIn()
+        self.settings = override_settings(
+            STATIC_GENERATOR_ROOT='test_web_root',
+            SERVER_NAME='localhost',
+            STATIC_GENERATOR_STORAGE=
+            'staticgenerator.storage.MemcachedStorage',
+            STATIC_GENERATOR_STORAGE_OPTIONS={
+                'server': '127.0.0.1:%d' % self.server.server_address[1]})
+        self.settings.enable()
+
+    def tearDown(self):
+        get_storage().close()
+        self.settings.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_escape_memcached_key(self):
+        self.assertEqual('/fresh/a%20b/index.html%253F',
+                         escape_memcached_key('/fresh/a b/index.html%3F'))
+
+    def test_publish_stores_fresh_and_stale_items(self):
+        StaticGenerator().publish_from_path('/foo/', content='foo')
+
+        self.assertEqual('foo', self.server.get('/fresh/foo/index.html%253F'))
+        self.assertEqual('foo', self.server.get('/stale/foo/index.html%253F'))
+        self.assertEqual('index.html%3F\n',
+                         self.server.get('index:/fresh/foo'))
+        self.assertEqual('foo/\n', self.server.get('index:/fresh'))
+        self.assertEqual('fresh/\nstale/\n', self.server.get('index:/'))
+
+    def test_connections_are_pooled(self):
+        instance = StaticGenerator()
+        for path in ('/a/', '/b/', '/a/'):
+            instance.publish_from_path(path, content='content')
+
+        self.assertEqual(1, self.server.connections)
+
+    def test_delete_removes_variants(self):
+        instance = StaticGenerator()
+        instance.publish_from_path('/foo/', content='foo')
+        instance.publish_from_path('/foo/', content='ajax', is_ajax=True)
+        instance.publish_from_path('/foo/', content='{}',
+                                   content_type='application/json')
+
+        instance.delete_from_path('/foo/')
+
+        self.assertEqual([], [key for key in self.server.items
+                              if key.startswith('/fresh/')])
+        self.assertEqual(3, len([key for key in self.server.items
+                                 if key.startswith('/stale/')]))
+
+    def test_publish_stale_path(self):
+        instance = StaticGenerator()
+        instance.publish_from_path('/foo/', content='foo')
+        instance.delete_from_path('/foo/')
+
+        instance.publish_stale_path('/foo/', '')
+
+        self.assertEqual('foo', self.server.get('/fresh/foo/index.html%253F'))
+
+    def test_recursive_delete(self):
+        instance = StaticGenerator()
+        instance.publish_from_path('/foo/', content='foo')
+        instance.publish_from_path('/foo/bar/baz/', content='baz')
+        instance.publish_from_path('/other/', content='other')
+
+        instance.recursive_delete_from_path('/foo/')
+
+        self.assertEqual(['/fresh/other/index.html%253F'],
+                         sorted(key for key in self.server.items
+                                if key.startswith('/fresh/')))
+        self.assertEqual(None, self.server.get('index:/fresh/foo/bar'))
+
+        instance.publish_from_path('/foo/bar/', content='bar')
+        instance.recursive_delete_from_path('/foo/')
+        self.assertEqual(None,
+                         self.server.get('/fresh/foo/bar/index.html%253F'))
+
+    def test_full_index_is_compacted(self):
+        self.server.max_item_size = 40
+        instance = StaticGenerator()
+        for _ in range(5):
+            instance.publish_from_path('/foo/', content='foo')
+
+        self.assertEqual('index.html%3F\nindex.html%3F\n',
+                         self.server.get('index:/fresh/foo'))
+
+    def test_exists_does_not_fetch_values(self):
+        StaticGenerator().publish_from_path('/foo/', content='foo')
+        storage = get_storage()
+        del self.server.commands[:]
+
+        self.assertTrue(storage.exists('test_web_root/fresh/foo/index.html%3F'))
+        self.assertFalse(storage.exists('test_web_root/fresh/bar'))
+        self.assertEqual(['mg', 'mg'], self.server.commands)
+
+    def test_exists_falls_back_to_get(self):
+        self.server.meta_commands = False
+        StaticGenerator().publish_from_path('/foo/', content='foo')
+        storage = get_storage()
+
+        self.assertTrue(storage.exists('test_web_root/fresh/foo/index.html%3F'))
+        self.assertFalse(storage.exists('test_web_root/fresh/bar'))
+        self.assertFalse(storage.meta_commands)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.test import TestCase
+from mock import Mock, patch
+import os
+import re
+import shutil
+import staticgenerator
+from staticgenerator import StaticGenerator
+from staticgenerator.exceptions import StaticGeneratorException
+from staticgenerator.nginx import get_nginx_config
+from staticgenerator.variants import (
+    get_request_variant, get_variant_request_meta
+)
+
+
+def render_variant():
+    """Patches the handler to render the variant of the request"""
+    handler = Mock(side_effect=lambda request: HttpResponse(
+        get_request_variant(request) or 'default'))
+    return patch.object(staticgenerator, 'DummyHandler',
+                        Mock(return_value=handler))
+
+
+def shouting(request):
+    return request.GET.get('shout', '')
+
+shouting.nginx_variable = '$sg_shouting'
+shouting.nginx_map = 'map $arg_shout $sg_shouting {}'
+
+
+@override_settings(STATIC_GENERATOR_ROOT='test_web_root',
+                   SERVER_NAME='localhost')
+class Variants_Tests(TestCase):
+    def tearDown(self):
+        shutil.rmtree('test_web_root', ignore_errors=True)
+
+    def test_ajax_variant_by_default(self):
+        request = RequestFactory().get(
+            '/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        self.assertEqual(',ajax', get_request_variant(request))
+
+    @override_settings(STATIC_GENERATOR_VARIANTS=[])
+    def test_ajax_variant_can_be_switched_off(self):
+        request = RequestFactory().get(
+            '/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        self.assertEqual('', get_request_variant(request))
+
+    @override_settings(STATIC_GENERATOR_VARIANTS=[
+        'staticgenerator.variants.ajax',
+        'staticgenerator.variants.mobile',
+        shouting])
+    def test_variants_are_combined_and_sanitized(self):
+        request = RequestFactory().get(
+            '/', {'shout': 'a/b'}, HTTP_USER_AGENT='Mozilla/5.0 (Android)')
+
+        self.assertEqual(',mobile,a_b', get_request_variant(request))
+
+    @override_settings(STATIC_GENERATOR_VARIANTS=['no.such.variant'])
+    def test_missing_variant_raises(self):
+        request = RequestFactory().get('/')
+
+        self.assertRaises(StaticGeneratorException,
+                          get_request_variant, request)
+
+    def test_get_filename_from_path_appends_variant(self):
+        instance = StaticGenerator()
+
+        result = instance.get_filename_from_path('/foo/', '',
+                                                 variant=',ajax,fi')
+
+        self.assertEqual('test_web_root/foo/index.html%3F,ajax,fi', result)
+
+    def test_delete_from_path_deletes_all_variants(self):
+        instance = StaticGenerator()
+        instance.publish_from_path('/foo/', content='default')
+        instance.publish_from_path('/foo/', content='ajax', variant=',ajax')
+        instance.publish_from_path('/foo/', content='fi', variant=',fi')
+
+        instance.delete_from_path('/foo/')
+
+        self.assertFalse(os.path.exists('test_web_root/fresh/foo'))
+        self.assertEqual(
+            'fi', open('test_web_root/stale/foo/index.html%3F,fi').read())
+
+    @override_settings(STATIC_GENERATOR_VARIANTS=[
+        'staticgenerator.variants.ajax',
+        'staticgenerator.variants.language'],
+        LANGUAGES=[('en', 'English'), ('fi', 'Finnish')],
+        LANGUAGE_CODE='en')
+    def test_nginx_config_sets_variant(self):
+        config = get_nginx_config()
+
+        self.assertIn('map $cookie_django_language $sg_language {', config)
+        self.assertIn('fi(?:[-;,]|$)" ",fi";', config)
+        self.assertIn('default "$sg_ajax$sg_language";', config)
+        self.assertIn('index.html%3F$args$sg_variant', config)
+
+    @override_settings(STATIC_GENERATOR_VARIANTS=[
+        'staticgenerator.variants.ajax',
+        'staticgenerator.variants.language',
+        'staticgenerator.variants.mobile'],
+        LANGUAGES=[('en', 'English'), ('fi', 'Finnish')],
+        LANGUAGE_CODE='en')
+    def test_simulated_requests_get_the_variant(self):
+        instance = StaticGenerator()
+
+        with render_variant():
+            instance.publish_from_path('/foo/', variant=',ajax,fi,mobile')
+            instance.publish_from_path('/foo/', variant=',en')
+
+        self.assertEqual(',ajax,fi,mobile', open(
+            'test_web_root/fresh/foo/index.html%3F,ajax,fi,mobile').read())
+        self.assertEqual(
+            ',en', open('test_web_root/fresh/foo/index.html%3F,en').read())
+        self.assertRaises(StaticGeneratorException,
+                          get_variant_request_meta, ',fi,ajax')
+
+    def test_publish_renders_each_cached_variant(self):
+        instance = StaticGenerator('/foo/')
+        instance.publish_from_path('/foo/', content='old')
+        instance.publish_from_path('/foo/', content='old', variant=',ajax')
+        instance.delete_from_path('/foo/')
+
+        with render_variant():
+            instance.publish()
+
+        self.assertEqual(
+            'default', open('test_web_root/fresh/foo/index.html%3F').read())
+        self.assertEqual(',ajax', open(
+            'test_web_root/fresh/foo/index.html%3F,ajax').read())
+
+    @override_settings(STATIC_GENERATOR_VARIANTS=[
+        'staticgenerator.variants.language'],
+        LANGUAGES=[('en', 'English'), ('en-gb', 'British English'),
+                   ('fi', 'Finnish')],
+        LANGUAGE_CODE='en')
+    def test_nginx_language_map_agrees_with_django(self):
+        config = get_nginx_config()
+        entries = re.findall(r'^    "~\*(.*)" "(,[\w-]+)";$', config, re.M)
+
+        for header in ('fi', 'fi-FI,en;q=0.8', 'sv,fi;q=0.8,en;q=0.5',
+                       'fil,en-GB;q=0.9', 'en-AU', 'en-gb', 'de'):
+            request = RequestFactory().get('/', HTTP_ACCEPT_LANGUAGE=header)
+            nginx_variant = next((variant for pattern, variant in entries
+                                  if re.match(pattern, header, re.I)),
+                                 ',en')
+            self.assertEqual(get_request_variant(request), nginx_variant,
+                             header)
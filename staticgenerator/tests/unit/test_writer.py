@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.test import TestCase
+import os
+import re
+import shutil
+import threading
+import time
+import staticgenerator
+from staticgenerator import StaticGenerator, writer
+from staticgenerator.middleware import StaticGeneratorMiddleware
+from staticgenerator.writer import AsyncWriter
+
+
+class Blocked(object):
+    """Keeps the writer thread busy until released"""
+
+    def __init__(self, writer):
+        self.started = threading.Event()
+        self.released = threading.Event()
+        writer.submit('blocker', self.block)
+        self.started.wait(5)
+
+    def block(self):
+        self.started.set()
+        self.released.wait(5)
+
+
+class AsyncWriter_Tests(TestCase):
+    def test_duplicate_keys_are_coalesced(self):
+        instance = AsyncWriter(queue_size=10)
+        blocked = Blocked(instance)
+        calls = []
+
+        instance.submit('/a/', calls.append, 'old')
+        instance.submit('/b/', calls.append, 'b')
+        instance.submit('/a/', calls.append, 'new')
+        blocked.released.set()
+
+        self.assertTrue(instance.flush(5))
+        self.assertEqual(['new', 'b'], calls)
+        stats = instance.stats()
+        self.assertEqual(3, stats['written'])
+        self.assertEqual(1, stats['coalesced'])
+        self.assertEqual(2, stats['max_queued'])
+        self.assertEqual(0, stats['queued'])
+
+    def test_drop_policy_drops_when_full(self):
+        instance = AsyncWriter(queue_size=1, policy='drop')
+        blocked = Blocked(instance)
+        calls = []
+
+        self.assertTrue(instance.submit('/a/', calls.append, 'a'))
+        self.assertFalse(instance.submit('/b/', calls.append, 'b'))
+        self.assertEqual(1, instance.stats()['queued'])
+        blocked.released.set()
+
+        instance.flush(5)
+        self.assertEqual(['a'], calls)
+        self.assertEqual(1, instance.stats()['dropped'])
+
+    def test_block_policy_waits_for_room(self):
+        instance = AsyncWriter(queue_size=1, policy='block', block_timeout=5)
+        blocked = Blocked(instance)
+        calls = []
+        instance.submit('/a/', calls.append, 'a')
+        threading.Timer(0.1, blocked.released.set).start()
+
+        self.assertTrue(instance.submit('/b/', calls.append, 'b'))
+
+        instance.flush(5)
+        self.assertEqual(['a', 'b'], calls)
+
+    def test_block_policy_drops_after_timeout(self):
+        instance = AsyncWriter(queue_size=1, policy='block',
+                               block_timeout=0.05)
+        blocked = Blocked(instance)
+        instance.submit('/a/', lambda: None)
+
+        self.assertFalse(instance.submit('/b/', lambda: None))
+        blocked.released.set()
+
+    def test_failures_are_counted(self):
+        instance = AsyncWriter()
+
+        instance.submit('/a/', lambda: 1 / 0)
+
+        instance.flush(5)
+        self.assertEqual(1, instance.stats()['failed'])
+        self.assertTrue(instance.thread.is_alive())
+
+    def test_discard_waits_for_write_in_progress(self):
+        instance = AsyncWriter()
+        started = threading.Event()
+        released = threading.Event()
+        instance.submit('/a/', lambda: (started.set(), released.wait(5)))
+        started.wait(5)
+        discarded = threading.Event()
+        thread = threading.Thread(target=lambda: (
+            instance.discard(lambda key: key == '/a/'), discarded.set()))
+        thread.start()
+
+        self.assertFalse(discarded.wait(0.1))
+        released.set()
+        self.assertTrue(discarded.wait(5))
+
+    def test_writes_rendered_before_discard_are_dropped(self):
+        instance = AsyncWriter()
+        calls = []
+        rendered = time.time()
+        instance.discard(lambda key: key == '/a/')
+
+        self.assertFalse(instance.submit_since(rendered, '/a/', calls.append,
+                                               'old'))
+        self.assertTrue(instance.submit_since(rendered, '/b/', calls.append,
+                                              'b'))
+        self.assertTrue(instance.submit_since(time.time() + 1, '/a/',
+                                              calls.append, 'new'))
+
+        instance.flush(5)
+        self.assertEqual(['b', 'new'], calls)
+        self.assertEqual(1, instance.stats()['discarded'])
+
+    def test_flush_times_out(self):
+        instance = AsyncWriter()
+        blocked = Blocked(instance)
+
+        self.assertFalse(instance.flush(0.05))
+        blocked.released.set()
+
+
+@override_settings(STATIC_GENERATOR_ROOT='test_web_root',
+                   SERVER_NAME='localhost',
+                   STATIC_GENERATOR_ASYNC_WRITES=True)
+class AsyncMiddleware_Tests(TestCase):
+    def setUp(self):
+        self.middleware = StaticGeneratorMiddleware()
+        self.middleware.gen = StaticGenerator()
+        self.middleware.urls = (re.compile(r'^/'),)
+
+    def tearDown(self):
+        shutil.rmtree('test_web_root', ignore_errors=True)
+
+    def test_middleware_writes_in_background(self):
+        async_writer = writer.get_writer()
+        blocked = Blocked(async_writer)
+        request = RequestFactory().get('/foo/')
+        self.middleware.process_view(request, lambda r: None, (), {})
+
+        self.middleware.process_response(request, HttpResponse('foo'))
+
+        self.assertFalse(
+            os.path.exists('test_web_root/fresh/foo/index.html%3F'))
+        blocked.released.set()
+        self.assertTrue(async_writer.flush(5))
+        self.assertEqual(
+            'foo', open('test_web_root/fresh/foo/index.html%3F').read())
+
+    def test_delete_discards_queued_writes(self):
+        async_writer = writer.get_writer()
+        discarded = async_writer.stats()['discarded']
+        blocked = Blocked(async_writer)
+        for path in ('/foo/', '/foo/bar/', '/other/'):
+            request = RequestFactory().get(path)
+            self.middleware.process_view(request, lambda r: None, (), {})
+            self.middleware.process_response(request, HttpResponse(path))
+
+        staticgenerator.quick_delete('/other/')
+        staticgenerator.recursive_delete('/foo/')
+        blocked.released.set()
+
+        self.assertTrue(async_writer.flush(5))
+        self.assertEqual([], [files for _, _, files in os.walk('test_web_root')
+                              if files])
+        self.assertEqual(3, async_writer.stats()['discarded'] - discarded)
+
+    @override_settings(STATIC_GENERATOR_ASYNC_WRITES=False)
+    def test_writer_is_disabled_by_default(self):
+        self.assertEqual(None, writer.get_writer())
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.test import TestCase
+from mock import Mock, patch
+import shutil
+from wsgiref.util import FileWrapper
+from staticgenerator import StaticGenerator
+from staticgenerator.storage import get_storage
+from staticgenerator.wsgi import StaticGeneratorWSGI
+
+
+def get_environ(path, method='GET', **extra):
+    environ = RequestFactory().generic(method, path, **extra).environ
+    environ['wsgi.file_wrapper'] = FileWrapper
+    return environ
+
+
+@override_settings(STATIC_GENERATOR_ROOT='test_web_root',
+                   SERVER_NAME='localhost',
+                   STATIC_GENERATOR_URLS=[r'^/'],
+                   STATIC_GENERATOR_EXCLUDE_URLS=[r'^/admin/'])
+class WSGI_Tests(TestCase):
+    def setUp(self):
+        self.application = Mock(return_value=['django'])
+        self.front_door = StaticGeneratorWSGI(self.application)
+        self.gen = StaticGenerator()
+
+    def tearDown(self):
+        self.front_door.files.clear()
+        shutil.rmtree('test_web_root', ignore_errors=True)
+
+    def request(self, path, **extra):
+        start_response = Mock()
+        result = self.front_door(get_environ(path, **extra), start_response)
+        try:
+            content = ''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        if not start_response.called:
+            return None, {}, content
+        status, headers = start_response.call_args[0]
+        return status, dict(headers), content
+
+    def test_serves_cached_page(self):
+        self.gen.publish_from_path('/foo/', '', 'cached')
+
+        status, headers, content = self.request('/foo/')
+
+        self.assertEqual('200 OK', status)
+        self.assertEqual('cached', content)
+        self.assertEqual('text/html; charset=utf-8', headers['Content-Type'])
+        self.assertEqual('6', headers['Content-Length'])
+        self.assertFalse(self.application.called)
+
+    def test_passes_misses_to_application(self):
+        self.gen.publish_from_path('/foo/', '', 'cached')
+
+        for path, extra in (('/bar/', {}),
+                            ('/foo/', {'method': 'POST'}),
+                            ('/foo/', {'HTTP_COOKIE': '_sgb=1'}),
+                            ('/foo/?a=b', {})):
+            self.assertEqual('django', self.request(path, **extra)[2])
+        self.assertEqual(4, self.application.call_count)
+
+    def test_passes_excluded_urls_to_application(self):
+        self.gen.publish_from_path('/admin/', '', 'cached')
+
+        self.assertEqual('django', self.request('/admin/')[2])
+
+    def test_uses_publishing_file_names(self):
+        self.gen.publish_from_path('/foo/', 'a=b%20c', 'query')
+        self.gen.publish_from_path('/foo/', '', 'ajax', variant=',ajax')
+        self.gen.publish_from_path('/bar', '', 'plain')
+        self.gen.publish_from_path('/feed/', '', '{}',
+                                   content_type='application/json')
+
+        self.assertEqual('query', self.request('/foo/?a=b%20c')[2])
+        self.assertEqual('ajax', self.request(
+            '/foo/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')[2])
+        self.assertEqual('plain', self.request('/bar')[2])
+        status, headers, content = self.request('/feed/')
+        self.assertEqual('{}', content)
+        self.assertEqual('application/json', headers['Content-Type'])
+
+    @override_settings(STATIC_GENERATOR_SHARDED_PREFIXES=['/articles/'])
+    def test_serves_sharded_pages(self):
+        StaticGenerator().publish_from_path('/articles/a/', '', 'article')
+
+        self.assertEqual('article', self.request('/articles/a/')[2])
+
+    def test_head_request(self):
+        self.gen.publish_from_path('/foo/', '', 'cached')
+
+        status, headers, content = self.request('/foo/', method='HEAD')
+
+        self.assertEqual('', content)
+        self.assertEqual('6', headers['Content-Length'])
+
+    @override_settings(STATIC_GENERATOR_HEADER_SIDECARS=True)
+    def test_restores_headers_from_sidecar(self):
+        self.gen.publish_from_path('/foo/', '', 'cached',
+                                   content_type='text/html; charset=latin-1',
+                                   cache_control='max-age=60')
+
+        status, headers, content = self.request('/foo/')
+        self.assertEqual('text/html; charset=latin-1', headers['Content-Type'])
+        self.assertEqual('max-age=60', headers['Cache-Control'])
+
+        status, _, content = self.request(
+            '/foo/', HTTP_IF_NONE_MATCH=headers['ETag'])
+        self.assertEqual('304 Not Modified', status)
+        self.assertEqual('', content)
+
+    def test_keeps_files_open(self):
+        self.gen.publish_from_path('/foo/', '', 'old')
+        self.request('/foo/')
+        self.request('/foo/')
+        self.assertEqual((1, 1), (self.front_door.files.hits,
+                                  self.front_door.files.misses))
+
+        self.gen.publish_from_path('/foo/', '', 'new')
+        self.assertEqual('new', self.request('/foo/')[2])
+
+        self.gen.delete_from_path('/foo/')
+        self.assertEqual('django', self.request('/foo/')[2])
+
+    def test_assembles_includes(self):
+        self.gen.publish_from_path(
+            '/foo/', '',
+            'a<!--sg-fragment:menu-->menu<!--/sg-fragment:menu-->b')
+
+        self.assertEqual('amenub', self.request('/foo/')[2])
+
+        with override_settings(STATIC_GENERATOR_WSGI_INCLUDES=False):
+            self.assertEqual('a<!--# include virtual="/_sgfragments/menu/" '
+                             '-->b', self.request('/foo/')[2])
+
+        self.gen.delete_from_path('/_sgfragments/menu/')
+        self.assertEqual('django', self.request('/foo/')[2])
+
+    def test_streams_pages_without_fragments(self):
+        content = 'a<!--# include virtual="/bar/" -->b'
+        self.gen.publish_from_path('/foo/', '', content)
+
+        result = self.front_door(get_environ('/foo/'), Mock())
+        try:
+            self.assertTrue(isinstance(result, FileWrapper))
+            self.assertEqual(content, ''.join(result))
+        finally:
+            result.close()
+
+    def test_looks_up_other_types_with_one_listing(self):
+        self.gen.publish_from_path('/feed/', '', '{}',
+                                   content_type='application/json')
+        storage = self.front_door.gen.storage
+        files = self.front_door.files
+
+        with patch.object(storage, 'listdir',
+                          Mock(wraps=storage.listdir)) as listdir:
+            with patch.object(files, 'open',
+                              Mock(wraps=files.open)) as open_file:
+                self.assertEqual('{}', self.request('/feed/')[2])
+                self.assertEqual('django', self.request('/bar/')[2])
+
+        self.assertEqual(2, listdir.call_count)
+        self.assertEqual(3, open_file.call_count)
+
+    @override_settings(STATIC_GENERATOR_STORAGE=
+                       'staticgenerator.storage.MemoryStorage')
+    def test_serves_from_other_storages(self):
+        self.front_door = StaticGeneratorWSGI(self.application)
+        StaticGenerator().publish_from_path('/foo/', '', 'memory')
+
+        self.assertEqual('memory', self.request('/foo/')[2])
+        get_storage().clear()
+
+    @override_settings(STATIC_GENERATOR_SURROGATE_KEYS=True)
+    def test_adds_surrogate_keys(self):
+        self.gen.publish_from_path('/blog/post', '', 'cached')
+
+        status, headers, content = self.request('/blog/post')
+
+        self.assertEqual('path:/blog/post tree:/ tree:/blog/',
+                         headers['Surrogate-Key'])
@@ -0,0 +1,15 @@
+"""URLconf for cached fragments
+
+Include it at ``STATIC_GENERATOR_FRAGMENT_PREFIX``::
+
+    urlpatterns += patterns('',
+        url(r'^_sgfragments/', include('staticgenerator.urls')),
+    )
+
+"""
+from django.conf.urls import patterns, url
+
+
+urlpatterns = patterns('staticgenerator.views',
+    url(r'^(?P<name>[\w./-]+)/$', 'fragment', name='staticgenerator_fragment'),
+)
@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""Helpers shared by the network backends"""
+
+
+def parse_address(address):
+    """Parses a ``host:port`` string into a ``(host, port)`` tuple"""
+    host, _, port = address.rpartition(':')
+    return host, int(port)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""Cache variants
+
+A page which is rendered differently depending on the request (e.g. for AJAX
+requests or per language) is cached once per variant.  Each callable listed
+in ``STATIC_GENERATOR_VARIANTS`` takes the request and returns a file name
+suffix, or an empty string for the default variant.  The non-empty suffixes
+are appended to the cache file name, each prefixed with a comma::
+
+    /blog/index.html%3F,ajax,fi
+
+The web server has to compute the same suffix to find the file.  Each
+variant callable therefore has an ``nginx_variable`` attribute naming the
+nginx variable holding its suffix (including the comma) and an ``nginx_map``
+attribute with the nginx ``map`` block setting it, or a function returning
+the block.  Use the ``staticgenerator_nginx`` management command to print
+the configuration.
+
+Pages published outside of requests, e.g. with ``quick_publish`` or the
+crawler, are rendered with a simulated request.  A ``request_meta``
+attribute on the variant callable takes a suffix and returns the request
+``META`` items which make the callable return it, or ``None`` if the suffix
+isn't one of its own.
+
+"""
+import re
+
+from django.conf import settings as django_settings
+from django.utils import translation
+from django.utils.importlib import import_module
+
+from staticgenerator import settings
+from staticgenerator.exceptions import StaticGeneratorException
+
+
+unsafe_suffix_re = re.compile(r'[^\w.-]')
+
+
+def ajax(request):
+    """Separates responses to AJAX requests"""
+    return 'ajax' if request.is_ajax() else ''
+
+ajax.nginx_variable = '$sg_ajax'
+ajax.nginx_map = '''map $http_x_requested_with $sg_ajax {
+    default "";
+    XMLHttpRequest ",ajax";
+}'''
+ajax.request_meta = lambda suffix: (
+    {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'} if suffix == 'ajax' else None)
+
+
+def language(request):
+    """Separates responses by the active language
+
+    Uses the language chosen by ``LocaleMiddleware`` if it is installed.
+
+    The nginx map picks the first language in ``Accept-Language`` which is
+    in ``LANGUAGES``, while Django orders the languages by their q-values
+    first.  They agree for browsers, which list the languages in order of
+    preference.  A header with the q-values out of order may get the page
+    of another language from nginx.
+
+    """
+    if hasattr(request, 'LANGUAGE_CODE'):
+        return request.LANGUAGE_CODE
+    return translation.get_language_from_request(request)
+
+
+def _language_nginx_map():
+    codes = [code for code, name in django_settings.LANGUAGES]
+    # Like in Django, a code also matches its more specific variants, so
+    # longer codes are tried first
+    ordered = sorted(codes, key=len, reverse=True)
+    # Skips the leading tags of languages which aren't in LANGUAGES
+    unsupported = r'(?:\s*(?!(?:%s)(?:[-;,]|$))[^,]*,)*\s*' % '|'.join(
+        re.escape(code) for code in ordered)
+    lines = ['map $http_accept_language $sg_accept_language {',
+             '    default ",%s";' % django_settings.LANGUAGE_CODE]
+    lines += ['    "~*^%s%s(?:[-;,]|$)" ",%s";'
+              % (unsupported, re.escape(code), code) for code in ordered]
+    lines += ['}',
+              'map $cookie_%s $sg_language {'
+              % django_settings.LANGUAGE_COOKIE_NAME,
+              '    default $sg_accept_language;']
+    lines += ['    %s ",%s";' % (code, code) for code in codes]
+    lines += ['}']
+    return '\n'.join(lines)
+
+def _language_request_meta(suffix):
+    for code, name in django_settings.LANGUAGES:
+        if unsafe_suffix_re.sub('_', code) == suffix:
+            return {'HTTP_ACCEPT_LANGUAGE': code,
+                    'HTTP_COOKIE': '%s=%s' % (
+                        django_settings.LANGUAGE_COOKIE_NAME, code)}
+    return None
+
+language.nginx_variable = '$sg_language'
+language.nginx_map = _language_nginx_map
+language.request_meta = _language_request_meta
+
+
+def mobile(request):
+    """Separates responses to mobile devices by their User-Agent"""
+    user_agent = request.META.get('HTTP_USER_AGENT', '')
+    if re.search(settings.MOBILE_USER_AGENTS, user_agent, re.I):
+        return 'mobile'
+    return ''
+
+
+def _mobile_nginx_map():
+    return '\n'.join(['map $http_user_agent $sg_mobile {',
+                      '    default "";',
+                      '    "~*%s" ",mobile";' % settings.MOBILE_USER_AGENTS,
+                      '}'])
+
+# User-Agent of simulated requests for the mobile variant
+MOBILE_USER_AGENT = ('Mozilla/5.0 (iPhone; CPU iPhone OS 10_3 like Mac OS X) '
+                     'Mobile')
+
+
+def _mobile_request_meta(suffix):
+    if suffix != 'mobile':
+        return None
+    if not re.search(settings.MOBILE_USER_AGENTS, MOBILE_USER_AGENT, re.I):
+        return None  # no sample of the configured User-Agents
+    return {'HTTP_USER_AGENT': MOBILE_USER_AGENT}
+
+mobile.nginx_variable = '$sg_mobile'
+mobile.nginx_map = _mobile_nginx_map
+mobile.request_meta = _mobile_request_meta
+
+
+def import_variant(path):
+    """Imports a variant callable from its dotted path"""
+    module_name, _, name = path.rpartition('.')
+    try:
+        return getattr(import_module(module_name), name)
+    except (ImportError, AttributeError, ValueError):
+        raise StaticGeneratorException('Could not import cache variant',
+                                       path=path)
+
+
+_variants_cache = {}
+
+
+def get_variants():
+    """Returns the variant callables listed in the settings"""
+    key = tuple(settings.VARIANTS)
+    if key not in _variants_cache:
+        _variants_cache[key] = [
+            import_variant(path) if isinstance(path, basestring) else path
+            for path in key]
+    return _variants_cache[key]
+
+
+def get_request_variant(request):
+    """Returns the cache file name suffix for the request"""
+    suffixes = []
+    for variant in get_variants():
+        suffix = variant(request)
+        if suffix:
+            suffixes.append(unsafe_suffix_re.sub('_', suffix))
+    return ''.join(',%s' % suffix for suffix in suffixes)
+
+
+def get_variant_request_meta(variant):
+    """Returns the request ``META`` items of a simulated request which gets
+    the cache file name suffix ``variant``
+
+    Raises ``StaticGeneratorException`` if a variant callable doesn't
+    recognize its part of the suffix.
+
+    """
+    meta = {}
+    variants = iter(get_variants())
+    for suffix in variant.split(',')[1:]:
+        for callable_ in variants:
+            request_meta = getattr(callable_, 'request_meta', None)
+            items = request_meta and request_meta(suffix)
+            if items is not None:
+                meta.update(items)
+                break
+        else:
+            raise StaticGeneratorException(
+                'Cannot simulate a request of the cache variant',
+                variant=variant)
+    return meta
+
+
+def get_nginx_map(variant):
+    """Returns the nginx ``map`` block of a variant callable"""
+    nginx_map = getattr(variant, 'nginx_map', None)
+    if callable(nginx_map):
+        nginx_map = nginx_map()
+    if nginx_map is None:
+        raise StaticGeneratorException(
+            'Cache variant has no nginx configuration', variant=variant)
+    return nginx_map
+
+
+def get_nginx_maps():
+    """Returns the nginx configuration which sets ``$sg_variant``
+
+    The result belongs in the ``http`` block.
+
+    """
+    variants = get_variants()
+    blocks = [get_nginx_map(variant) for variant in variants]
+    blocks.append('map $uri $sg_variant {\n    default "%s";\n}' % ''.join(
+        variant.nginx_variable for variant in variants))
+    return '\n'.join(blocks)
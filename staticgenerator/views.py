@@ -0,0 +1,20 @@
+from django.http import Http404, HttpResponse
+from django.template import RequestContext, TemplateDoesNotExist
+from django.template.loader import get_template
+
+from staticgenerator.exceptions import StaticGeneratorException
+from staticgenerator.fragments import get_fragment_template_name
+
+
+def fragment(request, name):
+    """Renders a cached fragment on its own
+
+    Serves the SSI subrequests for fragments which are missing from the
+    cache, e.g. after invalidation.  The middleware caches the response.
+
+    """
+    try:
+        template = get_template(get_fragment_template_name(name))
+    except (StaticGeneratorException, TemplateDoesNotExist):
+        raise Http404
+    return HttpResponse(template.render(RequestContext(request)))
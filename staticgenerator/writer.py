@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""Asynchronous cache writes
+
+With ``STATIC_GENERATOR_ASYNC_WRITES`` the middleware doesn't write the
+cached files before returning the response.  Instead it queues the write
+for a background thread, so cache misses don't wait for the disk.
+
+Each process has one writer thread and a queue of at most
+``STATIC_GENERATOR_ASYNC_QUEUE_SIZE`` writes.  A write of a page which is
+queued already replaces the queued one, so the queue holds the latest
+content of each page once.  When the queue is full, writes are dropped
+(``STATIC_GENERATOR_ASYNC_FULL_POLICY = 'drop'``) or the request waits for
+up to ``STATIC_GENERATOR_ASYNC_BLOCK_TIMEOUT`` seconds for room in the queue
+(``'block'``).  Queued writes are finished when the process exits, for up
+to ``STATIC_GENERATOR_ASYNC_EXIT_TIMEOUT`` seconds.
+
+Deleting a page in a process keeps content rendered before the deletion
+out of the cache of that process' writer: queued writes of the page are
+discarded, a write in progress is waited for before the files are deleted,
+and writes of responses whose rendering started before the deletion are
+dropped when they're submitted.  Deletes in other processes, e.g. the
+``staticgenerator.fanout`` listener, don't reach this queue.
+
+"""
+import atexit
+from collections import OrderedDict, deque
+import logging
+import os
+import threading
+import time
+
+from staticgenerator import settings
+from staticgenerator.exceptions import StaticGeneratorException
+
+
+logger = logging.getLogger('staticgenerator.writer')
+
+POLICIES = ('drop', 'block')
+
+# Seconds deletions are remembered for dropping writes rendered before them
+INVALIDATION_WINDOW = 300
+
+
+class AsyncWriter(object):
+    """Runs queued writes in a background thread"""
+
+    def __init__(self, queue_size=1000, policy='drop', block_timeout=None):
+        if policy not in POLICIES:
+            raise StaticGeneratorException('Unknown queue full policy',
+                                           policy=policy)
+        self.queue_size = queue_size
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.pending = OrderedDict()
+        self.active = 0
+        self.active_key = None
+        self.invalidations = deque()
+        self.condition = threading.Condition()
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.discarded = 0
+        self.max_queued = 0
+        self.thread = threading.Thread(target=self.run,
+                                       name='staticgenerator writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, key, func, *args, **kwargs):
+        """Queues ``func(*args, **kwargs)``, replacing a queued call with
+        the same key
+
+        Returns ``False`` if the call was dropped.
+
+        """
+        return self.submit_since(None, key, func, *args, **kwargs)
+
+    def submit_since(self, since, key, func, *args, **kwargs):
+        """Like :meth:`submit`, but drops the call if its key was discarded
+        after the time ``since``, e.g. when rendering the content started"""
+        item = (func, args, kwargs)
+        with self.condition:
+            if since is not None and self._invalidated_since(key, since):
+                self.discarded += 1
+                logger.debug('%r invalidated while rendering, dropping', key)
+                return False
+            if key in self.pending:
+                self.pending[key] = item
+                self.coalesced += 1
+                return True
+            if len(self.pending) >= self.queue_size:
+                if self.policy == 'block':
+                    self._wait_for_room()
+                if len(self.pending) >= self.queue_size:
+                    self.dropped += 1
+                    logger.warning('Write queue full, dropping %r', key)
+                    return False
+            self.pending[key] = item
+            self.max_queued = max(self.max_queued, len(self.pending))
+            self.condition.notify_all()
+        return True
+
+    def _wait_for_room(self):
+        deadline = (None if self.block_timeout is None
+                    else time.time() + self.block_timeout)
+        while len(self.pending) >= self.queue_size:
+            if deadline is None:
+                self.condition.wait()
+                continue
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            self.condition.wait(remaining)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                key, (func, args, kwargs) = self.pending.popitem(last=False)
+                self.active += 1
+                self.active_key = key
+                self.condition.notify_all()
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                logger.warning('Could not write %r', key, exc_info=True)
+                succeeded = False
+            else:
+                succeeded = True
+            with self.condition:
+                if succeeded:
+                    self.written += 1
+                else:
+                    self.failed += 1
+                self.active -= 1
+                self.active_key = None
+                self.condition.notify_all()
+
+    def _invalidated_since(self, key, since):
+        return any(match(key) for invalidated, match in self.invalidations
+                   if invalidated >= since)
+
+    def discard(self, match):
+        """Removes the queued writes whose key ``match(key)`` is true
+
+        A matching write in progress is waited for, so the caller can
+        delete its files afterwards.  Calls submitted with
+        :meth:`submit_since` are dropped if ``match`` is true for them and
+        rendering started before this.  Returns the number of discarded
+        writes.
+
+        """
+        now = time.time()
+        with self.condition:
+            self.invalidations.append((now, match))
+            while self.invalidations[0][0] < now - INVALIDATION_WINDOW:
+                self.invalidations.popleft()
+            keys = [key for key in self.pending if match(key)]
+            for key in keys:
+                del self.pending[key]
+            self.discarded += len(keys)
+            if keys:
+                self.condition.notify_all()
+            if threading.current_thread() is not self.thread:
+                while self.active_key is not None and match(self.active_key):
+                    self.condition.wait()
+        return len(keys)
+
+    def flush(self, timeout=None):
+        """Waits until all queued writes are done, or ``timeout`` seconds
+
+        Returns ``False`` on timeout.
+
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while self.pending or self.active:
+                if deadline is None:
+                    self.condition.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def stats(self):
+        with self.condition:
+            return {'queued': len(self.pending),
+                    'active': self.active,
+                    'max_queued': self.max_queued,
+                    'written': self.written,
+                    'failed': self.failed,
+                    'dropped': self.dropped,
+                    'coalesced': self.coalesced,
+                    'discarded': self.discarded}
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer():
+    """Returns the writer of this process, or ``None`` if not enabled"""
+    if not settings.ASYNC_WRITES:
+        return None
+    # Threads don't survive a fork, so each process gets its own writer
+    key = (os.getpid(), settings.ASYNC_QUEUE_SIZE, settings.ASYNC_FULL_POLICY,
+           settings.ASYNC_BLOCK_TIMEOUT)
+    with _writers_lock:
+        if key not in _writers:
+            _writers[key] = AsyncWriter(*key[1:])
+        return _writers[key]
+
+
+def discard_writes(path, query_string=None, recursive=False):
+    """Discards the queued writes of a deleted page
+
+    With ``recursive`` the writes of all pages below the directory of
+    ``path`` are discarded, like :meth:`recursive_delete_from_path` deletes
+    them.
+
+    """
+    async_writer = get_writer()
+    if async_writer is None:
+        return 0
+    if recursive:
+        prefix = path[:path.rfind('/') + 1]
+        return async_writer.discard(lambda key: key[0].startswith(prefix))
+    query_string = query_string or ''
+    return async_writer.discard(
+        lambda key: key[0] == path and key[1] == query_string)
+
+
+@atexit.register
+def _flush_on_exit():
+    for (pid, _, _, _), writer in _writers.items():
+        if pid == os.getpid():
+            writer.flush(timeout=settings.ASYNC_EXIT_TIMEOUT)
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+#-*- coding:utf-8 -*-
+
+"""WSGI front door serving cached pages without nginx
+
+Wrap the Django WSGI application to serve cached pages before Django sees
+the request::
+
+    from django.core.wsgi import get_wsgi_application
+    from staticgenerator.wsgi import StaticGeneratorWSGI
+
+    application = StaticGeneratorWSGI(get_wsgi_application())
+
+``GET`` and ``HEAD`` requests for URLs in ``STATIC_GENERATOR_URLS`` are
+looked up with the same file name rules as the middleware uses when
+publishing: the ``%3F`` query string encoding, cache variants, sharded
+directories and content type suffixes.  Pages of other types than HTML are
+found with one listing of their directory.  Requests carrying the bypass
+cookie and cache misses are passed to Django.
+
+Hits are sent with the server's ``wsgi.file_wrapper``, which uses
+``sendfile`` in servers like gunicorn.  Up to
+``STATIC_GENERATOR_WSGI_FILE_CACHE_SIZE`` files are kept open between
+requests.  The headers are restored from the sidecar files written with
+``STATIC_GENERATOR_HEADER_SIDECARS``.  With
+``STATIC_GENERATOR_SURROGATE_KEYS`` the surrogate keys derived from the path
+are added, keys added by views aren't cached.
+
+Cached pages with fragments contain SSI directives.  Their sidecars mark
+them with ``includes``, so only these pages are read and the directives
+replaced with the cached fragments, other pages are still sent with
+``sendfile``.  Without ``STATIC_GENERATOR_WSGI_INCLUDES`` they are sent as
+is, for servers in front which process the directives.
+
+"""
+from collections import OrderedDict
+import json
+import logging
+import os
+import re
+import threading
+
+from django.conf import settings as django_settings
+from django.core.handlers.base import get_path_info
+from django.core.handlers.wsgi import WSGIRequest
+from django.http.cookie import parse_cookie
+
+from staticgenerator import StaticGenerator, settings
+from staticgenerator.headers import (
+    META_SUFFIX, get_mime_type, get_type_suffixes
+)
+from staticgenerator.purge import get_page_keys, get_separator
+from staticgenerator.sharding import shard_path
+from staticgenerator.storage import FilesystemStorage
+from staticgenerator.variants import get_request_variant
+
+
+logger = logging.getLogger('staticgenerator.wsgi')
+
+BLOCK_SIZE = 65536
+
+# Fragments including fragments are assembled up to this depth
+MAX_INCLUDE_DEPTH = 10
+
+include_re = re.compile(r'<!--# include virtual="(?P<path>[^"]+)" -->')
+
+
+class CachedFile(object):
+    """An open cached file checked out of a :class:`FileCache`
+
+    Closing it returns it to the cache.
+
+    """
+
+    def __init__(self, cache, filename, f, identity, size):
+        self.cache = cache
+        self.filename = filename
+        self.file = f
+        self.identity = identity
+        self.size = size
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def close(self):
+        self.cache.release(self)
+
+
+def get_identity(st):
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+
+
+class FileCache(object):
+    """Keeps recently served files open
+
+    A file is used by one request at a time, so concurrent requests don't
+    share the file offset.  Files replaced or removed since they were
+    opened are detected by comparing the result of ``stat`` on the file
+    name with the open file.
+
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.files = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def open(self, filename):
+        """Returns the :class:`CachedFile` of a file name, or ``None`` if
+        it doesn't exist"""
+        try:
+            identity = get_identity(os.stat(filename))
+        except OSError:
+            return None
+        with self.lock:
+            cached = self.files.pop(filename, None)
+        if cached is not None:
+            if cached.identity == identity:
+                cached.file.seek(0)
+                self.hits += 1
+                return cached
+            cached.file.close()
+        self.misses += 1
+        try:
+            f = open(filename, 'rb')
+        except IOError:
+            return None  # removed meanwhile
+        st = os.fstat(f.fileno())
+        return CachedFile(self, filename, f, get_identity(st), st.st_size)
+
+    def release(self, cached):
+        with self.lock:
+            if self.size and cached.filename not in self.files:
+                self.files[cached.filename] = cached
+                cached = None
+            while len(self.files) > self.size:
+                self.files.popitem(last=False)[1].file.close()
+        if cached is not None:
+            cached.file.close()
+
+    def clear(self):
+        with self.lock:
+            files, self.files = self.files, OrderedDict()
+        for cached in files.values():
+            cached.file.close()
+
+
+class FileIterator(object):
+    """Iterates over a file in blocks when the server has no
+    ``wsgi.file_wrapper``"""
+
+    def __init__(self, filelike, block_size=BLOCK_SIZE):
+        self.filelike = filelike
+        self.block_size = block_size
+
+    def __iter__(self):
+        while True:
+            block = self.filelike.read(self.block_size)
+            if not block:
+                return
+            yield block
+
+    def close(self):
+        self.filelike.close()
+
+
+class StaticGeneratorWSGI(object):
+    """WSGI middleware serving cached pages in front of ``application``"""
+
+    def __init__(self, application, file_cache_size=None):
+        self.application = application
+        self.gen = StaticGenerator()
+        self.urls = [re.compile(url) for url in settings.URLS]
+        self.excluded_urls = [re.compile(url)
+                              for url in settings.EXCLUDE_URLS]
+        if file_cache_size is None:
+            file_cache_size = settings.WSGI_FILE_CACHE_SIZE
+        self.files = FileCache(file_cache_size)
+        content_types = {'': 'text/html; charset=%s'
+                             % django_settings.DEFAULT_CHARSET}
+        for content_type, suffix in sorted(settings.CONTENT_TYPES.items(),
+                                           reverse=True):
+            if suffix:
+                # The alphabetically first type of an extension is served,
+                # like in the nginx configuration
+                content_types[suffix] = content_type
+        self.content_types = content_types
+        self.type_suffixes = get_type_suffixes()
+
+    def __call__(self, environ, start_response):
+        try:
+            response = self.serve(environ, start_response)
+        except Exception:
+            logger.warning('Could not serve cached page, passing to Django',
+                           exc_info=True)
+            response = None
+        if response is None:
+            return self.application(environ, start_response)
+        return response
+
+    def is_cacheable(self, environ, path):
+        if environ.get('REQUEST_METHOD') not in ('GET', 'HEAD'):
+            return False
+        cookies = parse_cookie(environ.get('HTTP_COOKIE', ''))
+        if settings.BYPASS_COOKIE in cookies:
+            return False
+        if any(url.match(path) for url in self.excluded_urls):
+            return False
+        return any(url.match(path) for url in self.urls)
+
+    def get_variant(self, environ):
+        if not settings.VARIANTS:
+            return ''
+        return get_request_variant(WSGIRequest(environ.copy()))
+
+    def get_filename(self, path, query_string, variant):
+        """Returns the base file name of the fresh page, or ``None``"""
+        return self.gen.get_filename_from_path(
+            u'fresh{0}'.format(shard_path(path)), query_string,
+            variant=variant)
+
+    def serve(self, environ, start_response):
+        """Serves the cached page, or returns ``None`` on a miss"""
+        try:
+            path = get_path_info(environ) or u'/'
+        except UnicodeDecodeError:
+            return None
+        if not self.is_cacheable(environ, path):
+            return None
+        query_string = environ.get('QUERY_STRING', '')
+        variant = self.get_variant(environ)
+        filename = self.get_filename(path, query_string, variant)
+        if not filename:
+            return None  # too long URLs are not cached
+        if settings.SURROGATE_KEYS:
+            start_response = self.tag_response(start_response, path)
+        response = self.serve_file(environ, start_response, filename, '',
+                                   variant)
+        if response is None:
+            suffix = self.find_type_suffix(filename)
+            if suffix:
+                response = self.serve_file(environ, start_response,
+                                           filename + suffix, suffix, variant)
+        return response
+
+    def find_type_suffix(self, filename):
+        """Returns the suffix of the cached page of another type than HTML,
+        or ``None``
+
+        The directory is listed once instead of looking up each suffix.
+
+        """
+        if not self.type_suffixes:
+            return None
+        directory, basename = os.path.split(filename)
+        suffixes = [name[len(basename):]
+                    for name in self.gen.storage.listdir(directory)
+                    if name.startswith(basename)
+                    and name[len(basename):] in self.type_suffixes]
+        return min(suffixes) if suffixes else None
+
+    def tag_response(self, start_response, path):
+        """Wraps ``start_response`` to add the surrogate keys of a path"""
+        header = str(settings.SURROGATE_KEY_HEADER)
+        keys = get_separator(header).join(get_page_keys(path))
+
+        def tagged_start_response(status, headers, *exc_info):
+            headers = list(headers) + [(header, keys.encode('utf-8'))]
+            return start_response(status, headers, *exc_info)
+        return tagged_start_response
+
+    def get_metadata(self, filename, suffix):
+        """Returns the metadata in the sidecar of a cached file
+
+        HTML pages may have a sidecar marking their fragments even without
+        ``STATIC_GENERATOR_HEADER_SIDECARS``.
+
+        """
+        if not (settings.HEADER_SIDECARS or
+                settings.WSGI_INCLUDES and not suffix):
+            return {}
+        metadata = self.gen.storage.read(filename + META_SUFFIX)
+        try:
+            return json.loads(metadata) if metadata else {}
+        except ValueError:
+            return {}
+
+    def get_headers(self, suffix, metadata):
+        """Returns the response headers of a cached file"""
+        headers = {'Content-Type': self.content_types[suffix]}
+        if metadata.get('content_type'):
+            headers['Content-Type'] = metadata['content_type']
+        if metadata.get('cache_control'):
+            headers['Cache-Control'] = metadata['cache_control']
+        if metadata.get('etag'):
+            headers['ETag'] = metadata['etag']
+        return dict((str(key), str(value)) for key, value in headers.items())
+
+    def serve_file(self, environ, start_response, filename, suffix,
+                   variant):
+        if isinstance(self.gen.storage, FilesystemStorage):
+            cached = self.files.open(filename)
+            if cached is None:
+                return None
+            content = None
+        else:
+            content = self.gen.storage.read(filename)
+            if content is None:
+                return None
+        metadata = self.get_metadata(filename, suffix)
+        headers = self.get_headers(suffix, metadata)
+
+        if (settings.WSGI_INCLUDES and metadata.get('includes') and
+                get_mime_type(headers['Content-Type']) == 'text/html'):
+            if content is None:
+                content = cached.read()
+                cached.close()
+            content = self.assemble_includes(content, variant)
+            if content is None:
+                return None  # a fragment isn't cached
+            # The ETag is computed from the page without the fragments
+            headers.pop('ETag', None)
+
+        if ('ETag' in headers and
+                environ.get('HTTP_IF_NONE_MATCH') == headers['ETag']):
+            if content is None:
+                cached.close()
+            del headers['Content-Type']
+            start_response('304 Not Modified', headers.items())
+            return []
+
+        headers['Content-Length'] = str(
+            cached.size if content is None else len(content))
+        start_response('200 OK', headers.items())
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            if content is None:
+                cached.close()
+            return []
+        if content is not None:
+            return [content]
+        file_wrapper = environ.get('wsgi.file_wrapper', FileIterator)
+        return file_wrapper(cached, BLOCK_SIZE)
+
+    def assemble_includes(self, content, variant, depth=0):
+        """Replaces the SSI directives in ``content`` with the cached
+        fragments
+
+        Returns ``None`` if a fragment isn't cached.
+
+        """
+        missing = []
+
+        def replace(match):
+            filename = self.get_filename(match.group('path').decode('utf-8'),
+                                         '', variant)
+            fragment = filename and self.gen.storage.read(filename)
+            if fragment is not None and depth < MAX_INCLUDE_DEPTH:
+                fragment = self.assemble_includes(fragment, variant,
+                                                  depth + 1)
+            if fragment is None:
+                missing.append(match.group('path'))
+                return ''
+            return fragment
+
+        content = include_re.sub(replace, content)
+        if missing:
+            logger.debug('Fragments %s not cached', ', '.join(missing))
+            return None
+        return content